@@ -0,0 +1,246 @@
+""" アニメーションのフレーム
+
+各フレームはレイヤー名ごとの配列を持つ（レイヤーの構成と属性は全フレーム共通）。
+フレームを複製したときは配列をコピーせず、読み取り専用にして共有する。
+書き込む側が Frame.writable_layer() で初めてコピーする（コピーオンライト）ので、
+変更していないレイヤーは何フレームあってもメモリを 1 つ分しか使わない。
+
+数セルだけ描き変えたフレームもレイヤー全体をコピーするので、表示していないフレームは
+pack_frames() で共有している土台との差分（LayerPatch）に置き換える。表示するときや
+書き込むときに配列に戻すので、メモリは表示中のフレームの分と土台・差分だけになる。
+"""
+import mmap
+import weakref
+
+import numpy as np
+import PySide6.QtGui as QG
+
+from Compositor import composite_region
+
+DEFAULT_FPS = 12
+ONION_OPACITY = 0.3  # 隣のフレームを重ねて表示するときの不透明度（離れるほど薄くする）
+PATCH_LIMIT = 0.25  # 土台と違うセルがこの割合以下なら差分で持つ
+
+
+def _flat_cells(layer):
+    """セルごとに 1 要素の 1 次元ビュー（RGBA は 4 バイトを uint32 として見る）。できなければ None"""
+    if not layer.flags.c_contiguous:
+        return None
+    if layer.ndim == 3 and layer.shape[2] == 4 and layer.dtype == np.uint8:
+        return layer.view(np.uint32).reshape(-1)
+    if layer.ndim == 2:
+        return layer.reshape(-1)
+    return None
+
+
+class LayerPatch:
+    """ 土台の配列との差分で持つレイヤー（表示していないフレーム用、内容は変えない）
+
+    base: 読み取り専用で共有する土台、index: 土台と違うセルのフラットな位置、values: そのセルの値。
+    shape・dtype・nbytes と np.asarray() は配列と同じように使える（保存・合成・自動保存用）
+    """
+
+    def __init__(self, base, index, values):
+        base.flags.writeable = False  # 土台は他のフレームと共有する
+        self.base = base
+        self.index = index
+        self.values = values
+
+    @property
+    def shape(self):
+        return self.base.shape
+
+    @property
+    def dtype(self):
+        return self.base.dtype
+
+    @property
+    def nbytes(self):
+        """配列に戻したときの大きさ（保存するときの大きさ）"""
+        return self.base.nbytes
+
+    @property
+    def stored_nbytes(self):
+        """差分が実際に使っているメモリ（土台を除く）"""
+        return self.index.nbytes + self.values.nbytes
+
+    def materialize(self):
+        """書き込める配列に戻す"""
+        layer = np.array(self.base)
+        _flat_cells(layer)[self.index] = self.values
+        return layer
+
+    def any(self):
+        return bool(self.materialize().any())
+
+    def __array__(self, dtype=None, copy=None):
+        layer = self.materialize()
+        return layer if dtype is None else layer.astype(dtype, copy=False)
+
+
+def diff_layer(base, layer, limit=PATCH_LIMIT):
+    """ base との差分で layer を表した LayerPatch（違うセルが多すぎる・形が違うなら None） """
+    if base is layer or base.shape != layer.shape or base.dtype != layer.dtype:
+        return None
+    base_cells, cells = _flat_cells(base), _flat_cells(layer)
+    if base_cells is None or cells is None:
+        return None
+    index = np.flatnonzero(base_cells != cells)
+    if index.size > limit * cells.size:
+        return None
+    return LayerPatch(base, index.astype(np.int32), cells[index])
+
+
+def stored_nbytes(layer):
+    """レイヤーが実際に使っているメモリ（差分なら土台を除く）"""
+    return layer.stored_nbytes if isinstance(layer, LayerPatch) else layer.nbytes
+
+
+class Frame:
+    """1 枚のフレーム（レイヤー名 → 配列）と、合成済み画像のキャッシュ"""
+
+    def __init__(self, layers, revision=None):
+        self.layers = layers  # {レイヤー名: 配列か LayerPatch}
+        self.revision = dict(revision or {})  # レイヤーごとの変更番号
+        self._bases = {}  # {レイヤー名: コピーする前の共有配列の weakref}（差分の土台の候補）
+        self._image = None
+        self._image_array = None
+        self._image_key = None
+
+    def duplicate(self):
+        """配列を共有した複製（共有中の配列は読み取り専用になる）"""
+        return Frame(share_layers(self.layers), self.revision)
+
+    @property
+    def nbytes(self):
+        return sum(stored_nbytes(layer) for layer in self.layers.values())
+
+    def unpack(self):
+        """差分で持っているレイヤーを配列に戻して layers を返す（表示するフレーム用）"""
+        for name, layer in self.layers.items():
+            if isinstance(layer, LayerPatch):
+                self.layers[name] = layer.materialize()
+                self._bases[name] = weakref.ref(layer.base)
+        return self.layers
+
+    def writable_layer(self, name):
+        """書き込める配列を返す（共有中の読み取り専用の配列や差分なら、ここで初めてコピーする）"""
+        layer = self.layers[name]
+        if isinstance(layer, LayerPatch):
+            self.layers[name] = layer.materialize()
+            self._bases[name] = weakref.ref(layer.base)
+        elif not layer.flags.writeable:
+            self.layers[name] = np.array(layer)
+            self._bases[name] = weakref.ref(layer)
+        return self.layers[name]
+
+    def _base_candidates(self, name, neighbors, current):
+        """差分の土台にできる配列（コピーする前の配列、前後のフレームの同じレイヤー）"""
+        ref = self._bases.get(name)
+        if ref is not None and ref() is not None:
+            yield ref()
+        for frame in neighbors:
+            layer = frame.layers.get(name)
+            if isinstance(layer, LayerPatch):
+                yield layer.base
+            elif layer is not None and not (frame is current and layer.flags.writeable):
+                yield layer  # 表示中のフレームが書き込んでいる配列は土台にしない
+
+    def image(self, version, visibility, opacity, blend, palette):
+        """ 合成済みの QImage（透明背景、グリッド解像度）
+
+        内容（各レイヤーの変更番号）と version（属性・並び順・色表）が同じ間はキャッシュを返す
+        """
+        key = (version, tuple((name, id(layer), self.revision.get(name)) for name, layer in self.layers.items()))
+        if self._image is not None and self._image_key == key:
+            return self._image
+        height, width = next(iter(self.layers.values())).shape[:2]
+        if self._image is None or self._image.width() != width or self._image.height() != height:
+            # 無名の mmap に書き込み、QImage はそれを参照する（手放せばすぐ OS に返る）
+            buffer = mmap.mmap(-1, height * width * 4)
+            self._image_array = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 4)
+            self._image = QG.QImage(buffer, width, height, width * 4, QG.QImage.Format_RGBA8888)
+        layers = {name: np.asarray(layer) for name, layer in self.layers.items()}  # 差分はここだけ配列に戻す
+        self._image_array[...] = composite_region(layers, visibility, 0, height, 0, width,
+                                                  opacity=opacity, blend=blend, palette=palette)
+        self._image_key = key
+        return self._image
+
+    def release_image(self):
+        """合成済み画像のキャッシュを手放す（次に image() を呼んだときに合成し直す）"""
+        self._image = None
+        self._image_array = None
+        self._image_key = None
+
+
+def share_layers(layers):
+    """配列を読み取り専用にして、同じ配列を参照する新しい dict を返す（差分はそのまま共有できる）"""
+    for layer in layers.values():
+        if not isinstance(layer, LayerPatch):
+            layer.flags.writeable = False
+    return dict(layers)
+
+
+def layer_owners(frames):
+    """ {id(配列): 参照しているレイヤーの数}、{差分の土台の id}（土台としての参照も数に含める） """
+    owners, bases = {}, set()
+    for frame in frames:
+        for layer in frame.layers.values():
+            if isinstance(layer, LayerPatch):
+                layer = layer.base
+                bases.add(id(layer))
+            owners[id(layer)] = owners.get(id(layer), 0) + 1
+    return owners, bases
+
+
+def pack_frames(frames, current=None, limit=PATCH_LIMIT):
+    """ 表示中（current）以外のフレームの、どことも共有していない配列を土台との差分に置き換える
+
+    メモリマップした配列（ファイルが持っている）と、差分が大きい配列はそのまま残す
+    """
+    owners, _ = layer_owners(frames)
+    for i, frame in enumerate(frames):
+        if frame is current:
+            frame.unpack()
+            continue
+        neighbors = frames[max(i - 1, 0):i] + frames[i + 1:i + 2]
+        for name, layer in frame.layers.items():
+            if isinstance(layer, (LayerPatch, np.memmap)) or owners.get(id(layer)) != 1:
+                continue
+            for base in frame._base_candidates(name, neighbors, current):
+                patch = diff_layer(base, layer, limit)
+                if patch is not None:
+                    frame.layers[name] = patch
+                    owners[id(layer)] -= 1
+                    owners[id(base)] = owners.get(id(base), 0) + 1
+                    break
+        frame._bases.clear()
+
+
+def mapped_layer(layer, func, done):
+    """ func(配列) で変換したレイヤー
+
+    done: {id(元): (元, 変換後)}。共有している配列は 1 回だけ変換し、変換後も同じ書き込み可否にする。
+    差分は土台を変換してから、変換した内容との差分を取り直す（差分が大きくなれば配列のまま）
+    """
+    if id(layer) not in done:
+        if isinstance(layer, LayerPatch):
+            base = mapped_layer(layer.base, func, done)
+            array = func(layer.materialize())
+            result = diff_layer(base, array) or array
+        else:
+            result = func(layer)
+            result.flags.writeable = layer.flags.writeable
+        done[id(layer)] = (layer, result)
+    return done[id(layer)][1]
+
+
+def unique_nbytes(frames):
+    """フレーム全体で実際に使っているメモリ（共有している配列・土台は 1 回だけ数える）"""
+    seen = {}
+    for frame in frames:
+        for layer in frame.layers.values():
+            seen[id(layer)] = stored_nbytes(layer)
+            if isinstance(layer, LayerPatch):
+                seen[id(layer.base)] = layer.base.nbytes
+    return sum(seen.values())
@@ -0,0 +1,459 @@
+""" 自動保存（クラッシュしても作業を復元できるようにする）
+
+保存先のディレクトリには世代ごとに 2 つのファイルを置く。
+
+    snapshot-NNNNNN.dotp   ある時点のキャンバス全体（ProjectFile の形式）
+    journal-NNNNNN.log     それ以降に確定した操作を 1 件ずつ追記した記録
+
+操作の記録は
+    [0:16]  JSON のバイト数・配列データのバイト数（uint32, uint64）と CRC32（uint32）
+    以降    JSON（種類とセルの位置など）と、JSON に並べた配列の生データ
+で、途中までしか書けていない末尾の記録は CRC で判定して読み飛ばす。
+
+    cells: 変化したセル（フレーム番号・レイヤー名・インデックス・変更前後の値）
+    state: レイヤー構成・属性・色表・フレームの並びが変わったとき。各フレームのレイヤーは
+           直前の状態のどのレイヤーと同じか（["slot", フレーム, 名前]）、空か（["blank"]）、
+           この記録に含める配列か（["data", 番号]）で表す
+
+ファイルへの書き込みはすべてワーカースレッドで行い、GUI スレッドは確定した操作の配列を
+渡すだけにする（ストロークの描画中は何もしない）。記録が SNAPSHOT_RECORDS 件か
+SNAPSHOT_BYTES を超えたら新しい世代のスナップショットを書き、古い世代を消す。
+スナップショットに渡す配列はコピーせず、書き終わるまで読み取り専用にして共有する
+（その間に描かれたレイヤーだけが Animation のコピーオンライトで複製される）。
+"""
+import glob
+import json
+import logging
+import os
+import queue
+import re
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+import PySide6.QtCore as QC
+
+from Animation import Frame, LayerPatch, layer_owners
+from History import CellDelta
+from Profiler import profiler
+import ProjectFile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".dot_editor", "autosave")
+SYNC_INTERVAL = 0.5  # 記録がディスクに届くまでの最大の遅れ（秒）
+SNAPSHOT_RECORDS = 500  # この件数の記録を追記したらスナップショットを書き直す
+SNAPSHOT_BYTES = 64 * 1024 * 1024
+_RECORD = struct.Struct("<IQI")  # JSON のバイト数, 配列データのバイト数, CRC32
+_NAME = re.compile(r"snapshot-(\d+)\.dotp$")
+
+
+def _snapshot_path(directory, generation):
+    return os.path.join(directory, f"snapshot-{generation:06d}{ProjectFile.EXTENSION}")
+
+
+def _journal_path(directory, generation):
+    return os.path.join(directory, f"journal-{generation:06d}.log")
+
+
+def _generations(directory):
+    """スナップショットが書き終わっている世代（古い順）"""
+    found = []
+    for path in glob.glob(os.path.join(glob.escape(directory), "snapshot-*" + ProjectFile.EXTENSION)):
+        match = _NAME.search(os.path.basename(path))
+        if match:
+            found.append(int(match.group(1)))
+    return sorted(found)
+
+
+def find_recovery(directory=DEFAULT_DIRECTORY):
+    """前回の自動保存が残っていれば (スナップショット, 記録) のパスを返す（なければ None）"""
+    generations = _generations(directory)
+    if not generations:
+        return None
+    return _snapshot_path(directory, generations[-1]), _journal_path(directory, generations[-1])
+
+
+def discard(directory=DEFAULT_DIRECTORY):
+    """自動保存のファイルをすべて消す"""
+    for path in glob.glob(os.path.join(glob.escape(directory), "*")):
+        if os.path.basename(path).startswith(("snapshot-", "journal-")):
+            os.remove(path)
+
+
+def encode_record(header, arrays):
+    """記録 1 件分のバイト列のリスト（配列はコピーせず memoryview で渡す）"""
+    header = dict(header, arrays=[[array.dtype.str, list(array.shape)] for array in arrays])
+    body = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    chunks = [body] + [memoryview(np.ascontiguousarray(array)).cast("B") for array in arrays]
+    crc = 0
+    for chunk in chunks:
+        crc = zlib.crc32(chunk, crc)
+    return [_RECORD.pack(len(body), sum(len(chunk) for chunk in chunks[1:]), crc)] + chunks
+
+
+def read_records(path):
+    """記録を先頭から (header, [配列]) で返す（壊れた末尾の記録があればそこで止める）"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        while True:
+            prefix = f.read(_RECORD.size)
+            if len(prefix) < _RECORD.size:
+                return
+            body_size, data_size, crc = _RECORD.unpack(prefix)
+            body = f.read(body_size)
+            data = bytearray(f.read(data_size))  # 書き込める配列にする
+            if len(body) < body_size or len(data) < data_size or zlib.crc32(data, zlib.crc32(body)) != crc:
+                logger.warning("自動保存の記録の末尾が壊れているため読み飛ばしました: %s", path)
+                return
+            header = json.loads(body.decode("utf-8"))
+            arrays, offset = [], 0
+            for dtype, shape in header.pop("arrays"):
+                array = np.frombuffer(data, dtype=np.dtype(dtype), count=int(np.prod(shape)), offset=offset)
+                arrays.append(array.reshape(shape))
+                offset += arrays[-1].nbytes
+            yield header, arrays
+
+
+class Autosave(QC.QObject):
+    """ キャンバスの変更をワーカースレッドで自動保存する
+
+    start() で新しい世代のスナップショットを書き、以降は履歴に積まれた操作ごとに記録を追記する。
+    """
+    _released = QC.Signal(object)  # ワーカーが書き終えた配列（GUI スレッドで書き込み可能に戻す）
+
+    def __init__(self, canvas, directory=DEFAULT_DIRECTORY):
+        super().__init__(canvas)
+        self.canvas = canvas
+        self.directory = directory
+        self.generation = 0
+        self.records = 0  # 今の世代に追記した記録の数
+        self.bytes = 0
+        self._journaled = None  # 最後に記録した状態 [(フレーム, {名前: (配列, 変更番号)})]
+        self._properties = None
+        self._palette = None
+        self._lent = {}  # ワーカーに渡している配列 {id: [配列, 件数, 渡す前に書き込めたか]}
+        self._snapshot_pending = False
+        self._queue = queue.Queue()
+        self._thread = None
+        self._released.connect(self._release)
+
+    # ----- GUI スレッド -----
+
+    def start(self):
+        """自動保存を始める（前の世代のファイルは新しいスナップショットを書いた後に消す）"""
+        os.makedirs(self.directory, exist_ok=True)
+        generations = _generations(self.directory)
+        self.generation = generations[-1] if generations else 0
+        self._thread = threading.Thread(target=self._run, name="autosave", daemon=True)
+        self._thread.start()
+        self.canvas.history.listener = self._changed
+        self._snapshot()
+
+    def close(self, discard_files=True):
+        """ワーカーを止める（discard_files なら自動保存のファイルを消す）"""
+        if self._thread is None:
+            return
+        self.canvas.history.listener = None
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if discard_files:
+            discard(self.directory)
+
+    def flush(self):
+        """ここまでの記録をディスクに書き終えるまで待つ"""
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        done.wait()
+
+    def _changed(self, records, undone):
+        """履歴の確定・取り消し・やり直し・消去のたびに呼ばれる"""
+        if records is None or not all(isinstance(record, CellDelta) for record in records):
+            # フレームの複製や履歴の記録で配列が共有されたかもしれないので、書き終えても読み取り専用のままにする
+            for entry in self._lent.values():
+                entry[2] = False
+        if records is None:
+            # キャンバス全体が変わった（サイズ変更・読み込みなど）。処理が終わってから書き直す
+            if not self._snapshot_pending:
+                self._snapshot_pending = True
+                QC.QTimer.singleShot(0, self._snapshot)
+            return
+        if self._snapshot_pending:
+            return  # 次のスナップショットに含まれる
+        if self.records >= SNAPSHOT_RECORDS or self.bytes >= SNAPSHOT_BYTES:
+            self._snapshot()
+            return
+        self._append(records, undone)
+
+    def _lend(self, array):
+        """配列をワーカーに渡す（書き終わるまで読み取り専用にする。差分は変わらないのでそのまま渡す）"""
+        if isinstance(array, LayerPatch):
+            return array
+        entry = self._lent.get(id(array))
+        if entry is None:
+            entry = self._lent[id(array)] = [array, 0, array.flags.writeable]
+            array.flags.writeable = False
+        entry[1] += 1
+        return array
+
+    def _release(self, arrays):
+        """ワーカーが書き終えた配列を、他と共有していなければ書き込み可能に戻す"""
+        owners, bases = layer_owners(self.canvas.frames)
+        for array in arrays:
+            entry = self._lent.get(id(array))
+            if entry is None:
+                continue
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._lent[id(array)]
+                if entry[2] and owners.get(id(array)) == 1 and id(array) not in bases:  # 差分の土台は変えない
+                    array.flags.writeable = True
+
+    def _state(self):
+        """今のキャンバスの状態 [(フレーム, {名前: (配列, 変更番号)})]"""
+        return [(frame, {name: (layer, frame.revision.get(name)) for name, layer in frame.layers.items()})
+                for frame in self.canvas.frames]
+
+    def _snapshot(self):
+        """キャンバス全体を新しい世代のスナップショットとして書く"""
+        self._snapshot_pending = False
+        canvas = self.canvas
+        arrays, _, frame_keys = canvas._project_arrays()
+        properties, extra = canvas._project_header(frame_keys)
+        extra.update(frames=frame_keys, current_frame=canvas.current_frame, fps=canvas.fps,
+                     project_path=canvas.project_path)
+        arrays = {key: self._lend(array) for key, array in arrays.items()}
+        self.generation += 1
+        self.records = self.bytes = 0
+        self._journaled = self._state()
+        self._properties = self._property_values()
+        self._palette = self._palette_values()
+        self._queue.put(("snapshot", self.generation, arrays, properties, extra))
+
+    def _property_values(self):
+        canvas = self.canvas
+        return {key: dict(values) for key, values in canvas._layer_property_dicts().items()}
+
+    def _palette_values(self):
+        canvas = self.canvas
+        return (canvas.grid_size, canvas.indexed, canvas.palette_lut[:canvas.palette_count].tobytes())
+
+    def _append(self, records, undone):
+        """確定した操作を記録としてワーカーに渡す"""
+        canvas = self.canvas
+        frame_index = {id(frame): i for i, frame in enumerate(canvas.frames)}
+        cells, cell_arrays, touched = [], [], set()
+        for record in (reversed(records) if undone else records):
+            if not isinstance(record, CellDelta):
+                continue
+            frame = record.frame or canvas.frames[canvas.current_frame]
+            if id(frame) not in frame_index:
+                continue  # 削除済みのフレーム（戻したときに state として記録される）
+            before, after = (record.after, record.before) if undone else (record.before, record.after)
+            cells.append([frame_index[id(frame)], record.layer, len(cell_arrays)])
+            cell_arrays += [record.index, before, after]
+            touched.add((id(frame), record.layer))
+
+        state = self._state()
+        previous = {id(frame): (j, layers) for j, (frame, layers) in enumerate(self._journaled)}
+        by_array, by_revision = {}, {}
+        for j, (frame, layers) in enumerate(self._journaled):
+            for name, (layer, revision) in layers.items():
+                by_array.setdefault(id(layer), (j, name, revision))
+                if revision:  # 変更番号は内容ごとに一意（0 と None は名前を変えただけのものがある）
+                    by_revision.setdefault(revision, (j, name))
+
+        # 各フレームのレイヤーが直前の状態のどれと同じかを調べる
+        frames, data, changed = [], [], len(state) != len(self._journaled)
+        for i, (frame, layers) in enumerate(state):
+            j, old_layers = previous.get(id(frame), (None, {}))
+            refs = {}
+            for name, (layer, revision) in layers.items():
+                old = old_layers.get(name)
+                if old is not None and (id(frame), name) in touched and \
+                        old[0].shape == layer.shape and old[0].dtype == layer.dtype:
+                    ref = ["slot", j, name]  # 直前の内容にセルの変化を適用
+                elif old is not None and (old[0] is layer or revision) and old[1] == revision:
+                    ref = ["slot", j, name]  # 差分にしただけなら配列が変わっても変更番号は同じ
+                elif id(layer) in by_array and by_array[id(layer)][2] == revision:
+                    ref = ["slot", by_array[id(layer)][0], by_array[id(layer)][1]]
+                elif revision in by_revision:  # 差分から戻した配列を複製したフレームなど
+                    ref = ["slot", *by_revision[revision]]
+                elif not layer.any():
+                    ref = ["blank"]
+                else:
+                    ref = ["data", len(data)]
+                    data.append(self._lend(layer))
+                refs[name] = ref
+                changed |= ref != ["slot", i, name]
+            changed |= list(old_layers) != list(layers)
+            frames.append(refs)
+        properties, palette = self._property_values(), self._palette_values()
+        changed |= properties != self._properties or palette != self._palette
+
+        # 直前の状態にないレイヤーへのセルの変化は、配列ごと記録しているので不要
+        keep = [c for c in cells if frames[c[0]][c[1]][0] == "slot"] if changed else cells
+        arrays = [cell_arrays[c[2] + k] for c in keep for k in range(3)]
+        header = {"type": "cells", "cells": [[c[0], c[1]] for c in keep]}
+        if changed:
+            header.update(type="state", frames=frames, properties=properties,
+                          grid_size=palette[0], indexed=palette[1],
+                          palette_lut=canvas.palette_lut[:canvas.palette_count].tolist(),
+                          current_layer=canvas.current_layer, current_frame=canvas.current_frame,
+                          fps=canvas.fps)
+            arrays = data + arrays
+            header["cell_offset"] = len(data)
+        elif not keep:
+            return
+        self._journaled = state
+        self._properties, self._palette = properties, palette
+        self.records += 1
+        self.bytes += sum(array.nbytes for array in arrays)
+        self._queue.put(("record", self.generation, header, arrays, data))
+
+    # ----- ワーカースレッド -----
+
+    def _run(self):
+        journal = None
+        generation = None
+        last_sync = time.monotonic()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            kind = item[0]
+            try:
+                if kind == "snapshot":
+                    _, generation, arrays, properties, extra = item
+                    self._write_snapshot(generation, arrays, properties, extra)
+                    if journal is not None:
+                        journal.close()
+                    journal = open(_journal_path(self.directory, generation), "ab")
+                    self._remove_old(generation)
+                    self._released.emit(list(arrays.values()))
+                elif kind == "record":
+                    _, record_generation, header, arrays, lent = item
+                    if journal is not None and record_generation == generation:
+                        with profiler.section("autosave/record"):
+                            for chunk in encode_record(header, arrays):
+                                journal.write(chunk)
+                    self._released.emit(lent)
+                elif kind == "flush":
+                    if journal is not None:
+                        journal.flush()
+                        os.fsync(journal.fileno())
+                    item[1].set()
+                    continue
+            except OSError as e:
+                logger.warning("自動保存に失敗しました: %s", e)
+            # 続けて届いている記録はまとめて書き、一定間隔でディスクに同期する
+            if journal is not None and (self._queue.empty() or time.monotonic() - last_sync >= SYNC_INTERVAL):
+                journal.flush()
+                os.fsync(journal.fileno())
+                last_sync = time.monotonic()
+        if journal is not None:
+            journal.close()
+
+    def _write_snapshot(self, generation, arrays, properties, extra):
+        with profiler.section("autosave/snapshot"):
+            ProjectFile.save_project(_snapshot_path(self.directory, generation), arrays, properties, extra=extra)
+
+    def _remove_old(self, generation):
+        for old in _generations(self.directory):
+            if old < generation:
+                os.remove(_snapshot_path(self.directory, old))
+                if os.path.exists(_journal_path(self.directory, old)):
+                    os.remove(_journal_path(self.directory, old))
+
+
+def recover(canvas, directory=DEFAULT_DIRECTORY):
+    """ 残っている自動保存からキャンバスを復元し、適用した記録の数を返す
+
+    セルの変化は履歴にも積むので、復元後にアンドゥできる（構成の変化より前には戻れない）。
+    """
+    found = find_recovery(directory)
+    if found is None:
+        return 0
+    snapshot, journal = found
+    header = ProjectFile.read_header(snapshot)
+    canvas.load_project(snapshot)
+    canvas._load_into_memory()  # 自動保存のファイルは次のスナップショットで消える
+    count = 0
+    for record, arrays in read_records(journal):
+        if record["type"] == "state":
+            _apply_state(canvas, record, arrays)
+            arrays = arrays[record["cell_offset"]:]
+        _apply_cells(canvas, record["cells"], arrays)
+        count += 1
+    canvas._pack_frames()  # 記録から作り直したフレームは、隣のフレームとの差分にできる
+    canvas.project_path = header.get("project_path")
+    canvas._saved_revision = {}
+    canvas._saved_layout = {}
+    canvas._invalidate_composite()
+    canvas.update_canvas_size()
+    canvas.layers_changed.emit()
+    canvas.palette_changed.emit()
+    canvas.frames_changed.emit()
+    logger.info("自動保存から復元しました: %s（記録 %d 件）", snapshot, count)
+    return count
+
+
+def _apply_state(canvas, record, arrays):
+    """state の記録のとおりにレイヤー構成・属性・フレームを作り直す"""
+    previous = [frame.layers for frame in canvas.frames]
+    canvas.grid_size = record["grid_size"]
+    canvas.indexed = record["indexed"]
+    canvas.palette_lut[:] = 0
+    colors = np.asarray(record["palette_lut"], dtype=np.uint8).reshape(-1, 4)
+    canvas.palette_lut[:len(colors)] = colors
+    canvas.palette_count = max(len(colors), 1)
+    blank = None
+    frames = []
+    for refs in record["frames"]:
+        layers = {}
+        for name, ref in refs.items():
+            if ref[0] == "slot":
+                layers[name] = previous[ref[1]][ref[2]]
+            elif ref[0] == "blank":
+                if blank is None:
+                    blank = canvas._new_layer()
+                layers[name] = blank
+            else:
+                layers[name] = arrays[ref[1]]
+        frames.append(Frame(layers))
+    # 複数のフレームで同じ配列を使っている場合は、読み取り専用にして共有する
+    counts = {}
+    for frame in frames:
+        for layer in frame.layers.values():
+            counts[id(layer)] = counts.get(id(layer), 0) + 1
+    for frame in frames:
+        for name, layer in frame.layers.items():
+            if counts[id(layer)] > 1 and not isinstance(layer, LayerPatch):
+                layer.flags.writeable = False
+            canvas._touch_layer(name, frame)
+    canvas.frames = frames
+    canvas.current_frame = min(record["current_frame"], len(frames) - 1)
+    canvas.fps = record["fps"]
+    for key, values in canvas._layer_property_dicts().items():
+        values.clear()
+        values.update(record["properties"][key])
+    canvas.current_layer = record["current_layer"]
+    canvas.history.clear()
+
+
+def _apply_cells(canvas, cells, arrays):
+    """cells の記録を書き込み、1 回分の履歴として積む"""
+    records = []
+    for k, (frame_index, name) in enumerate(cells):
+        index, before, after = arrays[3 * k:3 * k + 3]
+        frame = canvas.frames[frame_index]
+        layer = frame.writable_layer(name)
+        layer.reshape(layer.shape[0] * layer.shape[1], -1)[index] = after
+        canvas._touch_layer(name, frame)
+        records.append(CellDelta(name, index, before, after, frame))
+    if records:
+        canvas.history.push(records)
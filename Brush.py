@@ -0,0 +1,177 @@
+""" ブラシ（スタンプのマスク + 模様 + 対称変換）
+
+1 回の描画では、ストロークで通ったセル（ダブの中心）を対称変換で増やし、
+スタンプの形に広げて（マスクの行ごとの区間の累積和）、模様で間引いた結果をまとめて返す。
+ダブごとの Python のループはないので、処理はブラシの大きさではなく
+塗られる範囲の面積で決まる。描画と消しゴムは同じセルを使う。
+"""
+import functools
+import math
+
+import numpy as np
+
+from Dither import bayer_matrix
+
+BRUSH_SHAPES = ("square", "circle")
+MIN_BRUSH_SIZE = 1
+MAX_BRUSH_SIZE = 64
+
+# 模様はキャンバス全体に敷き詰めたタイル（キャンバスの座標で固定なので、重ね塗りしてもずれない）
+BRUSH_PATTERNS = {
+    "solid": np.ones((1, 1), dtype=bool),
+    "checker": np.array([[True, False], [False, True]]),
+    "dither25": bayer_matrix(4) < 0.25,
+    "dither50": bayer_matrix(4) < 0.5,
+    "dither75": bayer_matrix(4) < 0.75,
+}
+SYMMETRY_MODES = ("none", "horizontal", "vertical", "quad", "radial")
+DEFAULT_RADIAL_COUNT = 6
+
+
+def brush_mask(size, shape="square"):
+    """ size x size のスタンプのマスク（bool） """
+    size = min(max(int(size), MIN_BRUSH_SIZE), MAX_BRUSH_SIZE)
+    if shape == "square":
+        return np.ones((size, size), dtype=bool)
+    if shape != "circle":
+        raise ValueError(f"unknown brush shape: {shape}")
+    center = (size - 1) / 2
+    yy, xx = np.mgrid[0:size, 0:size]
+    # 半径ぎりぎりのセルを除くと、小さいサイズでもドット絵らしい円になる
+    return (yy - center) ** 2 + (xx - center) ** 2 <= max((size / 2) ** 2 - 0.5, 0.5)
+
+
+class Brush:
+    """ スタンプのマスクと模様
+
+    mask: 任意の形の bool 配列（None なら size と shape から作る）
+    """
+
+    def __init__(self, size=1, shape="square", pattern="solid", mask=None):
+        if pattern not in BRUSH_PATTERNS:
+            raise ValueError(f"unknown brush pattern: {pattern}")
+        self.shape = shape if mask is None else "custom"
+        self.mask = brush_mask(size, shape) if mask is None else np.asarray(mask, dtype=bool)
+        self.size = max(self.mask.shape)
+        self.pattern = pattern
+        # マスクの (0, 0) がダブの中心からいくつずれているか（偶数の大きさは右下に寄せる）
+        self.origin = ((self.mask.shape[0] - 1) // 2, (self.mask.shape[1] - 1) // 2)
+        self.runs = _mask_runs(self.mask, self.origin)
+        self._oriented = {}  # {変換行列のバイト列: (マスク, 原点, 区間)}
+
+    def oriented(self, matrix):
+        """90 度単位の変換で向きを変えたマスク・原点・区間（変換ごとに 1 回だけ作る）"""
+        key = matrix.tobytes()
+        if key not in self._oriented:
+            mask, origin = _transformed_mask(self.mask, self.origin, matrix)
+            self._oriented[key] = (mask, origin, _mask_runs(mask, origin))
+        return self._oriented[key]
+
+
+@functools.lru_cache(maxsize=None)
+def symmetry_transforms(mode, count=DEFAULT_RADIAL_COUNT):
+    """ 対称変換のタプル ((2x2 行列, 行列が 90 度単位か), ...)（先頭は恒等変換） """
+    identity = np.eye(2)
+    flip_x, flip_y = np.diag([-1.0, 1.0]), np.diag([1.0, -1.0])
+    if mode == "none":
+        matrices = [identity]
+    elif mode == "horizontal":
+        matrices = [identity, flip_x]
+    elif mode == "vertical":
+        matrices = [identity, flip_y]
+    elif mode == "quad":
+        matrices = [identity, flip_x, flip_y, flip_x @ flip_y]
+    elif mode == "radial":
+        matrices = []
+        for k in range(max(int(count), 1)):
+            angle = 2 * math.pi * k / max(int(count), 1)
+            c, s = math.cos(angle), math.sin(angle)
+            matrices.append(np.array([[c, -s], [s, c]]))
+    else:
+        raise ValueError(f"unknown symmetry mode: {mode}")
+    matrices = [np.round(m, 12) for m in matrices]
+    return tuple((m, bool(np.all(np.isin(m, (-1.0, 0.0, 1.0))))) for m in matrices)
+
+
+def _transformed_mask(mask, origin, matrix):
+    """マスクを 90 度単位の変換で向きを変える（(マスク, 原点) を返す）"""
+    ys, xs = np.nonzero(mask)
+    offsets = np.stack([xs - origin[1], ys - origin[0]])  # (2, n) の (dx, dy)
+    dx, dy = np.rint(matrix @ offsets).astype(np.intp)
+    out = np.zeros((dy.max() - dy.min() + 1, dx.max() - dx.min() + 1), dtype=bool)
+    out[dy - dy.min(), dx - dx.min()] = True
+    return out, (-dy.min(), -dx.min())
+
+
+def _mask_runs(mask, origin):
+    """マスクを横方向の連続区間 (行, 左端, 右端 + 1) に分ける（原点からの相対座標）"""
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, lefts = np.nonzero(edges == 1)
+    _, rights = np.nonzero(edges == -1)
+    return rows - origin[0], lefts - origin[1], rights - origin[1]
+
+
+def _stamp(xs, ys, mask, origin, grid_size, runs=None):
+    """中心 (xs, ys) にマスクを押したセル (xs, ys)（1 セルのマスク以外は範囲外を除く）"""
+    if mask.shape == (1, 1):
+        return xs, ys
+    rows, lefts, rights = _mask_runs(mask, origin) if runs is None else runs
+    # 中心が動いた範囲にスタンプの大きさの余白を付けた領域だけで計算する
+    x0, y0 = int(xs.min()) + int(lefts.min()), int(ys.min()) + int(rows.min())
+    x1, y1 = int(xs.max()) + int(rights.max()), int(ys.max()) + int(rows.max()) + 1
+    x0c, y0c = max(x0, 0), max(y0, 0)
+    x1c, y1c = min(x1, grid_size), min(y1, grid_size)
+    if x1c <= x0c or y1c <= y0c:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    # 各ダブの各区間の始まりに +1、終わりに -1 を置いて横に累積すると、塗られたセルが正になる
+    width = x1 - x0 + 1
+    line = (ys[:, None] + rows - y0) * width - x0
+    starts = np.bincount((line + (xs[:, None] + lefts)).ravel(), minlength=(y1 - y0) * width)
+    ends = np.bincount((line + (xs[:, None] + rights)).ravel(), minlength=(y1 - y0) * width)
+    covered = np.cumsum((starts - ends).reshape(y1 - y0, width), axis=1) > 0
+    cy, cx = np.nonzero(covered[y0c - y0:y1c - y0, x0c - x0:x1c - x0])
+    return cx + x0c, cy + y0c
+
+
+def _transform_centers(xs, ys, matrix, axis_aligned, grid_size):
+    """ダブの中心をキャンバスの中心まわりに変換する"""
+    if axis_aligned:
+        # 2 倍した座標なら中心が整数になるので、丸めずに整数のまま計算できる
+        (a, b), (c, d) = matrix.astype(np.intp)
+        dx, dy = 2 * xs - (grid_size - 1), 2 * ys - (grid_size - 1)
+        return (a * dx + b * dy + (grid_size - 1)) // 2, (c * dx + d * dy + (grid_size - 1)) // 2
+    center = (grid_size - 1) / 2
+    moved = matrix @ np.stack([xs - center, ys - center])
+    return np.rint(moved[0] + center).astype(np.intp), np.rint(moved[1] + center).astype(np.intp)
+
+
+def brush_cells(brush, xs, ys, grid_size, symmetry="none", count=DEFAULT_RADIAL_COUNT):
+    """ ダブの中心 (xs, ys) をブラシで塗るセル (xs, ys)（重複や範囲外を含む場合がある） """
+    xs = np.asarray(xs, dtype=np.intp)
+    ys = np.asarray(ys, dtype=np.intp)
+    single = brush.mask.shape == (1, 1)
+    if xs.size == 0 or (single and symmetry == "none" and brush.pattern == "solid"):
+        return xs, ys  # 1 セルのブラシはそのまま（範囲外の除去は書き込む側で行う）
+    cells_x, cells_y = [], []
+    for k, (matrix, axis_aligned) in enumerate(symmetry_transforms(symmetry, count)):
+        if k == 0:
+            tx, ty, mask, origin, runs = xs, ys, brush.mask, brush.origin, brush.runs
+        else:
+            tx, ty = _transform_centers(xs, ys, matrix, axis_aligned, grid_size)
+            # 左右反転・回転したダブはスタンプも同じ向きにする（奇数サイズなら形は変わらない）
+            if axis_aligned and not single:
+                mask, origin, runs = brush.oriented(matrix)
+            else:
+                mask, origin, runs = brush.mask, brush.origin, brush.runs
+        cx, cy = _stamp(tx, ty, mask, origin, grid_size, runs)
+        cells_x.append(cx)
+        cells_y.append(cy)
+    xs_out = np.concatenate(cells_x) if len(cells_x) > 1 else cells_x[0]
+    ys_out = np.concatenate(cells_y) if len(cells_y) > 1 else cells_y[0]
+    pattern = BRUSH_PATTERNS[brush.pattern]
+    if pattern.size > 1:
+        keep = pattern[ys_out % pattern.shape[0], xs_out % pattern.shape[1]]
+        xs_out, ys_out = xs_out[keep], ys_out[keep]
+    return xs_out, ys_out
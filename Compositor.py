@@ -0,0 +1,64 @@
+import numpy as np
+
+BLEND_MODES = ("normal", "multiply", "add", "screen")
+
+
+def _blend(mode, cb, cs):
+    """ブレンド関数 B(背景色, 前景色)（どちらも 0〜1 の非乗算色）"""
+    if mode == "multiply":
+        return cb * cs
+    if mode == "screen":
+        return cb + cs - cb * cs
+    if mode == "add":
+        return np.minimum(cb + cs, 1.0)
+    return cs
+
+
+def composite_region(layers, visibility, y0, y1, x0, x1, background=None, opacity=None, blend=None,
+                     palette=None):
+    """ レイヤー配列の指定範囲を下から順に重ねて RGBA (uint8) を返す
+
+    layers: {名前: (H, W, 4) uint8 配列、またはパレット番号の (H, W) uint8 配列}（辞書の順番が描画順）
+    background: (r, g, b) を指定するとその色の上に合成（結果は不透明）
+    opacity: {名前: 0.0〜1.0} レイヤー全体の不透明度
+    blend: {名前: BLEND_MODES のいずれか} ブレンドモード
+    palette: (256, 4) uint8 の色表（パレット番号のレイヤーはこれで RGBA に変換）
+    """
+    opacity = opacity or {}
+    blend = blend or {}
+    h, w = y1 - y0, x1 - x0
+    # 0〜1 の乗算済みアルファで計算
+    acc_rgb = np.zeros((h, w, 3), dtype=np.float32)
+    acc_a = np.zeros((h, w, 1), dtype=np.float32)
+    if background is not None:
+        acc_rgb[:] = np.asarray(background, dtype=np.float32) / 255.0
+        acc_a[:] = 1.0
+
+    for name, layer in layers.items():
+        layer_opacity = opacity.get(name, 1.0)
+        if not visibility.get(name, True) or layer_opacity <= 0:
+            continue
+        src = layer[y0:y1, x0:x1]
+        if src.ndim == 2:
+            src = palette[src]  # 色表を引いて RGBA に
+        if not src[:, :, 3].any():
+            continue  # 空の範囲はスキップ
+        a = src[:, :, 3:4] * np.float32(layer_opacity / 255.0)
+        cs = src[:, :, :3] * np.float32(1.0 / 255.0)
+        mode = blend.get(name, "normal")
+        if mode == "normal":
+            acc_rgb *= 1.0 - a
+            acc_rgb += cs * a
+        else:
+            # co = cs*as*(1 - ab) + cb*ab*(1 - as) + as*ab*B(Cb, Cs)
+            cb = np.divide(acc_rgb, acc_a, out=np.zeros_like(acc_rgb), where=acc_a > 0)
+            acc_rgb *= 1.0 - a
+            acc_rgb += a * ((1.0 - acc_a) * cs + acc_a * _blend(mode, cb, cs))
+        acc_a *= 1.0 - a
+        acc_a += a
+
+    out = np.empty((h, w, 4), dtype=np.uint8)
+    np.divide(acc_rgb, acc_a, out=acc_rgb, where=acc_a > 0)
+    out[:, :, :3] = np.clip(acc_rgb * 255.0 + 0.5, 0, 255)
+    out[:, :, 3] = np.clip(acc_a[:, :, 0] * 255.0 + 0.5, 0, 255)
+    return out
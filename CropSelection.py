@@ -1,13 +1,34 @@
+import logging
+
 import PySide6.QtWidgets as QW
 import PySide6.QtGui as QG
 import PySide6.QtCore as QC
 
+logger = logging.getLogger(__name__)
+
 class CropSelectionView(QW.QGraphicsView):
-    def __init__(self, scene):
+    def __init__(self, scene, source_size=None):
         super().__init__(scene)
         self.scene = scene
         self.start_pos = None
         self.selection_rect = None
+        # シーンには縮小した画像を表示し、選択範囲は元画像のサイズに換算する
+        self.source_size = source_size
+
+    def source_rect(self):
+        """選択範囲を元画像の座標に変換して返す（画像の範囲外は切り捨て）"""
+        if not self.selection_rect:
+            return None
+        rect = self.selection_rect.rect()
+        shown = self.scene.sceneRect()
+        if self.source_size is None or shown.isEmpty():
+            return rect.toRect()
+
+        sx = self.source_size.width() / shown.width()
+        sy = self.source_size.height() / shown.height()
+        mapped = QC.QRectF((rect.x() - shown.x()) * sx, (rect.y() - shown.y()) * sy,
+                           rect.width() * sx, rect.height() * sy).toAlignedRect()
+        return mapped.intersected(QC.QRect(QC.QPoint(0, 0), self.source_size))
 
     def mousePressEvent(self, event):
         if event.button() == QC.Qt.LeftButton:
@@ -27,4 +48,4 @@ class CropSelectionView(QW.QGraphicsView):
 
     def mouseReleaseEvent(self, event):
         if event.button() == QC.Qt.LeftButton and self.selection_rect:
-            print("選択範囲:", self.selection_rect.rect())  # デバッグ用に範囲を表示
+            logger.debug("選択範囲: %s", self.selection_rect.rect())
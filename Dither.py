@@ -0,0 +1,113 @@
+""" 減色時のディザリング（色数が少ないときのグラデーションの縞を抑える）
+
+ordered（Bayer 2x2 / 4x4 / 8x8）はしきい値の表を足してから最も近い色を選ぶだけなので、
+画像全体を一度に NumPy で処理する。
+
+誤差拡散（Floyd–Steinberg / Atkinson）は左上から順に誤差を配るため 1 画素ずつの処理に
+見えるが、画素 (y, x) が待つ必要があるのは x + 2y が小さい画素だけなので、
+x + 2y が等しい画素（斜めの列）はまとめて処理できる。幅 W・高さ H の画像は
+W + 2H 回の NumPy の処理で終わる（画素ごとの Python のループは使わない）。
+"""
+import numpy as np
+
+DITHER_METHODS = ("none", "bayer2", "bayer4", "bayer8", "floyd-steinberg", "atkinson")
+
+# 誤差を配る先 (dy, dx) と割合
+_DIFFUSION = {
+    "floyd-steinberg": (((0, 1), 7 / 16), ((1, -1), 3 / 16), ((1, 0), 5 / 16), ((1, 1), 1 / 16)),
+    # Atkinson は誤差の 3/4 だけを配る（残りは捨てるのでコントラストが保たれる）
+    "atkinson": (((0, 1), 1 / 8), ((0, 2), 1 / 8), ((1, -1), 1 / 8), ((1, 0), 1 / 8),
+                 ((1, 1), 1 / 8), ((2, 0), 1 / 8)),
+}
+_PAD = 2  # 誤差を配る先が画像の外に出る分の余白
+
+_NEAREST_CHUNK = 1 << 16  # 最も近い色を求めるときに一度に処理する画素数
+
+
+def bayer_matrix(size):
+    """ size x size（2 の累乗）の Bayer 行列を 0〜1 未満のしきい値で返す """
+    matrix = np.zeros((1, 1), dtype=np.float32)
+    while matrix.shape[0] < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return (matrix + 0.5) / matrix.size
+
+
+class _Palette:
+    """最も近い色を ||p||² - 2 x·p の最小で求めるための前計算"""
+
+    def __init__(self, colors):
+        self.colors = np.asarray(colors, dtype=np.float32).reshape(-1, 3)
+        self.half_norms = 0.5 * np.einsum("ij,ij->i", self.colors, self.colors)
+
+    def nearest(self, pixels):
+        """pixels (n, 3) float32 に最も近い色の番号"""
+        return np.argmax(pixels @ self.colors.T - self.half_norms, axis=1)
+
+    def spread(self):
+        """隣り合う色どうしの距離の目安（ordered のしきい値の振れ幅に使う）"""
+        if len(self.colors) < 2:
+            return 0.0
+        diff = self.colors[:, None, :] - self.colors[None, :, :]
+        distance = np.sqrt((diff * diff).sum(axis=2))
+        np.fill_diagonal(distance, np.inf)
+        return float(np.median(distance.min(axis=1)))
+
+
+def dither(rgb, colors, method="floyd-steinberg", strength=1.0):
+    """ RGB 画像 (H, W, 3) を colors (k, 3) の色だけで表す（戻り値は (H, W, 3) uint8）
+
+    strength: ordered のしきい値の強さ（1.0 で隣の色との距離ぶん）
+    """
+    palette = _Palette(colors)
+    colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+    if len(colors) == 0:
+        return np.array(rgb, dtype=np.uint8)
+    if method == "none":
+        index = _nearest_all(palette, rgb.reshape(-1, 3).astype(np.float32))
+    elif method.startswith("bayer"):
+        index = _ordered(rgb, palette, int(method[len("bayer"):]), strength)
+    elif method in _DIFFUSION:
+        index = _diffuse(rgb, palette, _DIFFUSION[method])
+    else:
+        raise ValueError(f"unknown dither method: {method}")
+    return colors[index].reshape(rgb.shape)
+
+
+def _nearest_all(palette, pixels):
+    index = np.empty(len(pixels), dtype=np.intp)
+    for start in range(0, len(pixels), _NEAREST_CHUNK):
+        index[start:start + _NEAREST_CHUNK] = palette.nearest(pixels[start:start + _NEAREST_CHUNK])
+    return index
+
+
+def _ordered(rgb, palette, size, strength):
+    """Bayer 行列のしきい値を足して（画像全体を一度に）最も近い色を選ぶ"""
+    height, width = rgb.shape[:2]
+    threshold = bayer_matrix(size) - 0.5
+    threshold = np.tile(threshold, (height // size + 1, width // size + 1))[:height, :width]
+    shifted = rgb.astype(np.float32) + (threshold * (palette.spread() * strength))[:, :, None]
+    return _nearest_all(palette, shifted.reshape(-1, 3))
+
+
+def _diffuse(rgb, palette, weights):
+    """誤差拡散（x + 2y が等しい画素を 1 回の処理でまとめて量子化する）"""
+    height, width = rgb.shape[:2]
+    stride = width + 2 * _PAD
+    # 余白付きの作業用配列（誤差を足し込む）。左右と下に _PAD 画素ずつ余白を取る
+    work = np.zeros(((height + _PAD) * stride, 3), dtype=np.float32)
+    work.reshape(height + _PAD, stride, 3)[:height, _PAD:_PAD + width] = rgb
+    index = np.zeros(len(work), dtype=np.intp)
+    offsets = [(dy * stride + dx, np.float32(w)) for (dy, dx), w in weights]
+
+    # x + 2y = t の画素の位置は y * (stride - 2) + t + _PAD なので、斜めの列は等間隔のスライスになる
+    step = stride - 2
+    for t in range(width + 2 * (height - 1)):
+        y0, y1 = max(0, (t - width + 2) // 2), min(height - 1, t // 2) + 1
+        line = slice(y0 * step + t + _PAD, (y1 - 1) * step + t + _PAD + 1, step)
+        values = np.clip(work[line], 0, 255)
+        chosen = palette.nearest(values)
+        index[line] = chosen
+        error = values - palette.colors[chosen]
+        for offset, w in offsets:
+            work[line.start + offset:line.stop + offset:step] += error * w
+    return index.reshape(height + _PAD, stride)[:height, _PAD:_PAD + width].reshape(-1)
@@ -1,13 +1,28 @@
+import logging
+
 import PySide6.QtWidgets as QW
 import PySide6.QtGui as QG
 import PySide6.QtCore as QC
-from PixelCanvas import PixelCanvas
+from PixelCanvas import PixelCanvas, FILL_MODES, FILL_SAMPLES, PALETTE_SIZE, MIN_GRID_SIZE, MAX_GRID_SIZE
 from LayerSetting import LayerListWidget
+from Compositor import BLEND_MODES
+from Dither import DITHER_METHODS
+from Brush import BRUSH_SHAPES, BRUSH_PATTERNS, SYMMETRY_MODES, MIN_BRUSH_SIZE, MAX_BRUSH_SIZE
+import ProjectFile
+import Autosave
+from Profiler import profiler
+
+logger = logging.getLogger(__name__)
+
+MAX_PALETTE_COLORS = PALETTE_SIZE - 1  # 色表の 0 番は透明に使う
+THUMBNAIL_INTERVAL_MS = 200  # レイヤーのサムネイルを更新する間隔（描画中はこの間隔でまとめて更新）
+PALETTE_COLUMNS = 8
 
 class DotEditor(QW.QWidget):
     def __init__(self):
         super().__init__()
         self.canvas = PixelCanvas()
+        self.autosave = None  # start_autosave() で開始
         self.brush_mode = None  # ブラシモード（normal, checker, symmetry）
 
         # 色のパレットを保持するリスト
@@ -30,24 +45,50 @@ class DotEditor(QW.QWidget):
 
         # ===== 左側（ツール） =====
         tool_layout = QW.QVBoxLayout()
+        self.tool_layout = tool_layout
 
-        # パレットボタン
+        # パレットボタン（PALETTE_COLUMNS 個ずつ並べる）
+        self.palette_layout = QW.QGridLayout()
+        self.palette_layout.setSpacing(2)
+        tool_layout.addLayout(self.palette_layout)
         self.palette_buttons = []
         for color in self.color_palette:
-            btn = QW.QPushButton()
-            btn.setFixedSize(30, 30)
-            btn.setStyleSheet(
-                f"background-color: {color.name()}; border: 1px solid black;")
-            btn.clicked.connect(
-                lambda checked, c=color: self.canvas.set_color(c))
-            self.palette_buttons.append(btn)
-            tool_layout.addWidget(btn)
+            self.add_palette_button(color)
+
+        # インデックスカラー（レイヤーは色表の番号を持ち、色の置き換えは色表を書き換えるだけ）
+        self.indexed_check = QW.QCheckBox("インデックスカラー")
+        self.indexed_check.toggled.connect(self.set_indexed)
+        tool_layout.addWidget(self.indexed_check)
+
+        self.replace_color_button = QW.QPushButton("選択中の色を置き換え")
+        self.replace_color_button.clicked.connect(self.replace_color)
+        self.replace_color_button.setEnabled(False)
+        tool_layout.addWidget(self.replace_color_button)
+        self.canvas.palette_changed.connect(self.sync_palette)
 
         # 画像読み込みボタン
         self.load_image_button = QW.QPushButton("画像を読み込む")
         self.load_image_button.clicked.connect(self.load_image)
         tool_layout.addWidget(self.load_image_button)
 
+        # 読み込み時の減色のディザリング
+        self.dither_box = QW.QComboBox()
+        self.dither_box.addItems(DITHER_METHODS)
+        tool_layout.addWidget(QW.QLabel("ディザリング:"))
+        tool_layout.addWidget(self.dither_box)
+
+        # 読み込みの進み具合（バックグラウンドで実行中のみ表示）
+        self.import_progress_bar = QW.QProgressBar()
+        self.import_progress_bar.setRange(0, 100)
+        self.import_cancel_button = QW.QPushButton("読み込みを中止")
+        self.import_cancel_button.clicked.connect(self.canvas.cancel_imports)
+        for widget in (self.import_progress_bar, self.import_cancel_button):
+            widget.hide()
+            tool_layout.addWidget(widget)
+        self.canvas.imports_changed.connect(self.update_import_progress)
+        self.canvas.import_failed.connect(
+            lambda path, message: QW.QMessageBox.warning(self, "エラー", f"画像を読み込めません: {path}\n{message}"))
+
         # ショートカットキーの設定
         undo_shortcut = QG.QShortcut(QG.QKeySequence("Ctrl+Z"), self)
         undo_shortcut.activated.connect(self.canvas.undo)
@@ -55,6 +96,20 @@ class DotEditor(QW.QWidget):
         redo_shortcut = QG.QShortcut(QG.QKeySequence("Ctrl+Y"), self)
         redo_shortcut.activated.connect(self.canvas.redo)
 
+        # 計測値の表示（F3）と、計測結果のファイルへの書き出し
+        stats_shortcut = QG.QShortcut(QG.QKeySequence("F3"), self)
+        stats_shortcut.activated.connect(self.canvas.toggle_stats)
+
+        dump_shortcut = QG.QShortcut(QG.QKeySequence("Ctrl+Shift+P"), self)
+        dump_shortcut.activated.connect(self.dump_profile)
+
+        # 選択範囲の操作
+        for key, slot in (("Ctrl+A", self.canvas.select_all), ("Ctrl+C", self.canvas.copy_selection),
+                          ("Ctrl+X", self.canvas.cut_selection), ("Ctrl+V", self.paste),
+                          ("Delete", self.canvas.delete_selection), ("Escape", self.canvas.deselect),
+                          ("Return", self.canvas.anchor_selection)):
+            QG.QShortcut(QG.QKeySequence(key), self).activated.connect(slot)
+
         # 色を追加するボタン
         self.add_color_button = QW.QPushButton("色を追加")
         self.add_color_button.clicked.connect(self.add_color)
@@ -75,21 +130,41 @@ class DotEditor(QW.QWidget):
         self.save_button.clicked.connect(self.canvas.save_canvas)
         tool_layout.addWidget(self.save_button)
 
+        # プロジェクト（レイヤー・パレット込み）の保存と読み込み
+        self.save_project_button = QW.QPushButton("プロジェクトを保存")
+        self.save_project_button.clicked.connect(self.save_project)
+        tool_layout.addWidget(self.save_project_button)
+
+        self.open_project_button = QW.QPushButton("プロジェクトを開く")
+        self.open_project_button.clicked.connect(self.open_project)
+        tool_layout.addWidget(self.open_project_button)
+
         # ツール部分を上部に寄せる
         tool_layout.addStretch()
 
         # キャンバスサイズ変更 UI
         self.size_input = QW.QSpinBox()
-        self.size_input.setRange(8, 64)  # 最小 8x8、最大 64x64
+        self.size_input.setRange(MIN_GRID_SIZE, MAX_GRID_SIZE)  # 表示は拡大・縮小できる
         self.size_input.setValue(self.canvas.grid_size)
 
         self.resize_button = QW.QPushButton("キャンバスサイズ変更")
         self.resize_button.clicked.connect(self.change_canvas_size)
 
+        # 全体表示（ホイールで拡大・縮小、中ボタンのドラッグで移動）
+        self.fit_button = QW.QPushButton("全体表示")
+        self.fit_button.clicked.connect(self.canvas.update_canvas_size)
+
         #グリッドON / OFFボタン
         self.grid_button = QW.QCheckBox("グリッド ON/OFF")
         self.grid_button.clicked.connect(self.canvas.toggle_grid)
 
+        # 太いグリッド線の間隔（0 で非表示）
+        self.grid_major_input = QW.QSpinBox()
+        self.grid_major_input.setRange(0, 64)
+        self.grid_major_input.setValue(self.canvas.grid_major)
+        self.grid_major_input.valueChanged.connect(
+            lambda value: self.canvas.set_grid_spacing(major=value))
+
         self.checker_brush_button = QW.QPushButton("市松模様")
         self.checker_brush_button.clicked.connect(lambda: self.set_brush_mode("checker"))
 
@@ -99,14 +174,81 @@ class DotEditor(QW.QWidget):
         self.normal_brush_button = QW.QPushButton("ブラシモード")  # 追加
         self.normal_brush_button.clicked.connect(lambda: self.set_brush_mode("normal"))
 
+        # ブラシの大きさ・形・模様と対称変換
+        self.brush_size_input = QW.QSpinBox()
+        self.brush_size_input.setRange(MIN_BRUSH_SIZE, MAX_BRUSH_SIZE)
+        self.brush_size_input.setValue(self.canvas.brush.size)
+        self.brush_size_input.valueChanged.connect(lambda size: self.canvas.set_brush(size=size))
+
+        self.brush_shape_box = QW.QComboBox()
+        self.brush_shape_box.addItems(BRUSH_SHAPES)
+        self.brush_shape_box.currentTextChanged.connect(lambda shape: self.canvas.set_brush(shape=shape))
+
+        self.brush_pattern_box = QW.QComboBox()
+        self.brush_pattern_box.addItems(BRUSH_PATTERNS)
+        self.brush_pattern_box.currentTextChanged.connect(lambda pattern: self.canvas.set_brush(pattern=pattern))
+
+        self.symmetry_box = QW.QComboBox()
+        self.symmetry_box.addItems(SYMMETRY_MODES)
+        self.symmetry_box.currentTextChanged.connect(lambda mode: self.canvas.set_symmetry(mode))
+
+        self.symmetry_count_input = QW.QSpinBox()
+        self.symmetry_count_input.setRange(2, 32)
+        self.symmetry_count_input.setValue(self.canvas.symmetry_count)
+        self.symmetry_count_input.valueChanged.connect(
+            lambda count: self.canvas.set_symmetry(self.canvas.symmetry, count))
+
+        # 選択ツール（矩形・投げ縄・自動選択）と、選択範囲の移動
+        self.selection_buttons = []
+        for label, tool in (("矩形選択", "select_rect"), ("投げ縄", "lasso"), ("自動選択", "wand"), ("移動", "move")):
+            button = QW.QPushButton(label)
+            button.clicked.connect(lambda checked=False, tool=tool: setattr(self.canvas, "tool", tool))
+            self.selection_buttons.append(button)
+
+        # 塗りつぶし（バケツ）ツールと設定
+        self.fill_button = QW.QPushButton("塗りつぶし")
+        self.fill_button.clicked.connect(lambda: setattr(self.canvas, "tool", "fill"))
+
+        self.fill_mode_box = QW.QComboBox()
+        self.fill_mode_box.addItems(FILL_MODES)
+        self.fill_mode_box.currentTextChanged.connect(lambda mode: setattr(self.canvas, "fill_mode", mode))
+
+        self.fill_sample_box = QW.QComboBox()
+        self.fill_sample_box.addItems(FILL_SAMPLES)
+        self.fill_sample_box.currentTextChanged.connect(lambda sample: setattr(self.canvas, "fill_sample", sample))
+
+        self.fill_tolerance_input = QW.QSpinBox()
+        self.fill_tolerance_input.setRange(0, 255)
+        self.fill_tolerance_input.setValue(self.canvas.fill_tolerance)
+        self.fill_tolerance_input.valueChanged.connect(
+            lambda value: setattr(self.canvas, "fill_tolerance", value))
+
         # ツールのレイアウトに追加
         tool_layout.addWidget(QW.QLabel("キャンバスサイズ:"))
         tool_layout.addWidget(self.size_input)
         tool_layout.addWidget(self.resize_button)
+        tool_layout.addWidget(self.fit_button)
         tool_layout.addWidget(self.grid_button)
+        tool_layout.addWidget(QW.QLabel("太いグリッド間隔:"))
+        tool_layout.addWidget(self.grid_major_input)
         tool_layout.addWidget(self.checker_brush_button)
         tool_layout.addWidget(self.symmetry_brush_button)
         tool_layout.addWidget(self.normal_brush_button)
+        tool_layout.addWidget(QW.QLabel("ブラシの大きさ / 形 / 模様:"))
+        tool_layout.addWidget(self.brush_size_input)
+        tool_layout.addWidget(self.brush_shape_box)
+        tool_layout.addWidget(self.brush_pattern_box)
+        tool_layout.addWidget(QW.QLabel("対称 / 放射の数:"))
+        tool_layout.addWidget(self.symmetry_box)
+        tool_layout.addWidget(self.symmetry_count_input)
+        tool_layout.addWidget(self.fill_button)
+        for button in self.selection_buttons:
+            tool_layout.addWidget(button)
+        tool_layout.addWidget(QW.QLabel("塗りつぶし範囲 / 判定対象:"))
+        tool_layout.addWidget(self.fill_mode_box)
+        tool_layout.addWidget(self.fill_sample_box)
+        tool_layout.addWidget(QW.QLabel("許容値:"))
+        tool_layout.addWidget(self.fill_tolerance_input)
 
 
         # ===== 右側（レイヤー操作） =====
@@ -114,10 +256,22 @@ class DotEditor(QW.QWidget):
 
         # レイヤーリストウィジェット
         self.layer_list_widget = LayerListWidget(self)
-        self.layer_list_widget.setFixedWidth(150)  # 横幅を狭める
+        self.layer_list_widget.setFixedWidth(180)  # サムネイルが入る幅
         self.layer_list_widget.layer_order_changed.connect(self.reorder_layers)  # シグナルを接続
+        self.layer_list_widget.layer_renamed.connect(self.canvas.rename_layer)
+        self.layer_list_widget.layer_deleted.connect(self.canvas.delete_layer)
+        self.layer_list_widget.currentTextChanged.connect(self.select_layer)  # 選択中のレイヤーに描画
+        self.canvas.layers_changed.connect(self.update_layer_list)  # アンドゥ等での変更もリストに反映
         layer_layout.addWidget(self.layer_list_widget)
 
+        # サムネイルは描画のたびではなく、一定間隔でまとめて更新する
+        self._thumbnail_timer = QC.QTimer(self)
+        self._thumbnail_timer.setSingleShot(True)
+        self._thumbnail_timer.setInterval(THUMBNAIL_INTERVAL_MS)
+        self._thumbnail_timer.timeout.connect(self.update_thumbnails)
+        for signal in (self.canvas.content_changed, self.canvas.frames_changed, self.canvas.palette_changed):
+            signal.connect(self.schedule_thumbnails)
+
         # 新しいレイヤー
         self.add_layer_button = QW.QPushButton("レイヤー追加")
         self.add_layer_button.setFixedWidth(100)  # 横幅を狭める
@@ -136,6 +290,85 @@ class DotEditor(QW.QWidget):
         self.set_opacity_button.clicked.connect(self.set_opacity)
         layer_layout.addWidget(self.set_opacity_button)
 
+        # 選択中のレイヤーの不透明度（ドラッグ中もそのまま反映）
+        self.opacity_slider = QW.QSlider(QC.Qt.Horizontal)
+        self.opacity_slider.setFixedWidth(100)
+        self.opacity_slider.setRange(0, 100)
+        self.opacity_slider.setValue(100)
+        self.opacity_slider.valueChanged.connect(
+            lambda value: self.canvas.set_layer_opacity(self.canvas.current_layer, value / 100))
+        layer_layout.addWidget(self.opacity_slider)
+
+        # 選択中のレイヤーのブレンドモード
+        self.blend_mode_box = QW.QComboBox()
+        self.blend_mode_box.setFixedWidth(100)
+        self.blend_mode_box.addItems(BLEND_MODES)
+        self.blend_mode_box.currentTextChanged.connect(
+            lambda mode: self.canvas.set_layer_blend_mode(self.canvas.current_layer, mode))
+        layer_layout.addWidget(self.blend_mode_box)
+
+        # ===== 変形（選択中のレイヤー、またはキャンバス全体） =====
+        self.transform_target_box = QW.QComboBox()
+        self.transform_target_box.setFixedWidth(150)
+        self.transform_target_box.addItems(["レイヤー", "キャンバス全体"])
+        layer_layout.addWidget(self.transform_target_box)
+
+        transform_buttons = QW.QGridLayout()
+        for i, (label, op, amount) in enumerate((
+                ("⇆", "flip_h", None), ("⇅", "flip_v", None), ("↻", "rotate", 1), ("↺", "rotate", -1),
+                ("←", "shift", (-1, 0)), ("→", "shift", (1, 0)), ("↑", "shift", (0, -1)), ("↓", "shift", (0, 1)),
+                ("x2", "scale", 2), ("x1/2", "scale", 0.5))):
+            button = QW.QPushButton(label)
+            button.setFixedWidth(36)
+            button.clicked.connect(lambda checked=False, op=op, amount=amount: self.transform(op, amount))
+            transform_buttons.addWidget(button, i // 4, i % 4)
+        layer_layout.addLayout(transform_buttons)
+
+        # ===== アニメーションのフレーム =====
+        layer_layout.addWidget(QW.QLabel("フレーム:"))
+        self.frame_list_widget = QW.QListWidget()
+        self.frame_list_widget.setFixedWidth(150)
+        self.frame_list_widget.currentRowChanged.connect(self.select_frame)
+        self.canvas.frames_changed.connect(self.update_frame_list)
+        layer_layout.addWidget(self.frame_list_widget)
+
+        frame_buttons = QW.QGridLayout()
+        for i, (label, slot) in enumerate((
+                ("追加", self.canvas.add_frame),
+                ("複製", self.canvas.duplicate_frame),
+                ("削除", self.canvas.delete_frame),
+                ("↑", lambda: self.canvas.move_frame(self.canvas.current_frame, self.canvas.current_frame - 1)),
+                ("↓", lambda: self.canvas.move_frame(self.canvas.current_frame, self.canvas.current_frame + 1)))):
+            button = QW.QPushButton(label)
+            button.setFixedWidth(48)
+            button.clicked.connect(slot)
+            frame_buttons.addWidget(button, i // 3, i % 3)
+        layer_layout.addLayout(frame_buttons)
+
+        # 再生／停止
+        self.play_button = QW.QPushButton("再生")
+        self.play_button.setFixedWidth(100)
+        self.play_button.clicked.connect(self.toggle_playback)
+        self.canvas.playback_changed.connect(
+            lambda playing: self.play_button.setText("停止" if playing else "再生"))
+        layer_layout.addWidget(self.play_button)
+
+        self.fps_input = QW.QSpinBox()
+        self.fps_input.setFixedWidth(100)
+        self.fps_input.setRange(1, 60)
+        self.fps_input.setSuffix(" fps")
+        self.fps_input.setValue(self.canvas.fps)
+        self.fps_input.valueChanged.connect(self.canvas.set_fps)
+        layer_layout.addWidget(self.fps_input)
+
+        # 前後のフレームを薄く重ねて表示する枚数
+        layer_layout.addWidget(QW.QLabel("オニオンスキン:"))
+        self.onion_skin_input = QW.QSpinBox()
+        self.onion_skin_input.setFixedWidth(100)
+        self.onion_skin_input.setRange(0, 5)
+        self.onion_skin_input.valueChanged.connect(self.canvas.set_onion_skin)
+        layer_layout.addWidget(self.onion_skin_input)
+
         # レイヤー部分を上部に寄せる
         layer_layout.addStretch()
 
@@ -148,7 +381,8 @@ class DotEditor(QW.QWidget):
         self.setLayout(main_layout)
 
         # 初期レイヤーリストを更新
-        self.layer_list_widget.update_layer_list(self.layers.keys())
+        self.update_layer_list()
+        self.update_frame_list()
 
         # ウィンドウ全体の背景色
         self.setStyleSheet("background-color: #F0F0F0;")  # 淡いグレー
@@ -172,28 +406,146 @@ class DotEditor(QW.QWidget):
         file_name, _ = QW.QFileDialog.getOpenFileName(
             self, "画像を選択", "", "Images (*.png *.jpg *.bmp)")
         if file_name:
-            self.canvas.load_and_crop_image(file_name)
+            self.canvas.load_and_crop_image(file_name, dither=self.dither_box.currentText())
+
+    def update_import_progress(self):
+        """読み込み中の件数と進み具合を表示"""
+        progress = self.canvas.import_progress()
+        for widget in (self.import_progress_bar, self.import_cancel_button):
+            widget.setVisible(progress is not None)
+        if progress is not None:
+            self.import_progress_bar.setValue(progress)
+            self.import_progress_bar.setFormat(f"読み込み中 ({len(self.canvas.imports)}) %p%")
 
     def add_color(self):
         """新しい色を追加する"""
         color = QW.QColorDialog.getColor()
-        if color.isValid() and len(self.color_palette) < 10:  # 最大10色まで保持
+        if not color.isValid():
+            return
+        if self.canvas.indexed:
+            self.canvas.add_palette_color(color)  # ボタンは palette_changed で更新
+        elif len(self.color_palette) < MAX_PALETTE_COLORS:
             self.color_palette.append(color)
-            btn = QW.QPushButton()
-            btn.setFixedSize(30, 30)
-            btn.setStyleSheet(
-                f"background-color: {color.name()}; border: 1px solid black;")
-            btn.clicked.connect(
-                lambda checked, c=color: self.canvas.set_color(c))
-            self.palette_buttons.append(btn)
-            self.layout().insertWidget(1, btn)  # パレットのレイアウトに追加
+            self.add_palette_button(color)
+
+    def add_palette_button(self, color):
+        """パレットの末尾に色のボタンを追加"""
+        btn = QW.QPushButton()
+        btn.setFixedSize(30, 30)
+        btn.setStyleSheet(
+            f"background-color: {color.name()}; border: 1px solid black;")
+        btn.clicked.connect(
+            lambda checked, c=color: self.canvas.set_color(c))
+        row, column = divmod(len(self.palette_buttons), PALETTE_COLUMNS)
+        self.palette_layout.addWidget(btn, row, column)  # パレットのレイアウトに追加
+        self.palette_buttons.append(btn)
+
+    def set_palette(self, colors):
+        """パレットを丸ごと置き換える"""
+        for btn in self.palette_buttons:
+            self.palette_layout.removeWidget(btn)
+            btn.deleteLater()
+        self.palette_buttons = []
+        self.color_palette = list(colors)
+        for color in self.color_palette:
+            self.add_palette_button(color)
+
+    def sync_palette(self):
+        """インデックスカラーの色表をパレットに反映（色が変わったボタンだけ更新）"""
+        if not self.canvas.indexed:
+            return
+        colors = self.canvas.palette_colors()
+        if len(colors) < len(self.color_palette):
+            self.set_palette(colors)
+            return
+        for i, color in enumerate(colors):
+            if i >= len(self.color_palette):
+                self.color_palette.append(color)
+                self.add_palette_button(color)
+            elif color != self.color_palette[i]:
+                self.color_palette[i] = color
+                btn = self.palette_buttons[i]
+                btn.setStyleSheet(f"background-color: {color.name()}; border: 1px solid black;")
+                btn.clicked.disconnect()
+                btn.clicked.connect(lambda checked, c=color: self.canvas.set_color(c))
+
+    def set_indexed(self, enabled):
+        """インデックスカラーモードの切り替え（今のパレットの色から色表を作る）"""
+        self.canvas.set_indexed(enabled, self.color_palette)
+        self.replace_color_button.setEnabled(enabled)
+
+    def replace_color(self):
+        """選択中の色を別の色に置き換える（その色で塗ったセルがすべて変わる）"""
+        old_color = self.canvas.current_color
+        if old_color is None:
+            return
+        color = QW.QColorDialog.getColor(old_color, self)
+        if color.isValid():
+            self.canvas.replace_color(old_color, color)
+            self.canvas.set_color(color)
+
+    def save_project(self):
+        """プロジェクトを保存する（同じファイルなら変更したレイヤーだけ書き込む）"""
+        file_name, _ = QW.QFileDialog.getSaveFileName(
+            self, "プロジェクトを保存", self.canvas.project_path or "",
+            f"Dot Projects (*{ProjectFile.EXTENSION})")
+        if file_name:
+            if not file_name.endswith(ProjectFile.EXTENSION):
+                file_name += ProjectFile.EXTENSION
+            palette = [color.getRgb() for color in self.color_palette]
+            self.canvas.save_project(file_name, palette)
+
+    def open_project(self):
+        """プロジェクトを開く"""
+        file_name, _ = QW.QFileDialog.getOpenFileName(
+            self, "プロジェクトを開く", "", f"Dot Projects (*{ProjectFile.EXTENSION})")
+        if not file_name:
+            return
+        try:
+            palette = self.canvas.load_project(file_name)
+        except (OSError, ValueError) as e:
+            QW.QMessageBox.warning(self, "エラー", f"プロジェクトを開けません: {e}")
+            return
+        if palette and not self.canvas.indexed:
+            self.set_palette([QG.QColor(*color) for color in palette])
+        self.sync_project_controls()
+
+    def sync_project_controls(self):
+        """読み込んだプロジェクトに合わせて、色の形式・サイズ・再生速度などの表示を更新"""
+        self.indexed_check.blockSignals(True)
+        self.indexed_check.setChecked(self.canvas.indexed)
+        self.indexed_check.blockSignals(False)
+        self.replace_color_button.setEnabled(self.canvas.indexed)
+        self.size_input.setValue(self.canvas.grid_size)
+        self.fps_input.setValue(self.canvas.fps)
+        self.sync_layer_controls()
+
+    def start_autosave(self, recover=False, directory=Autosave.DEFAULT_DIRECTORY):
+        """ 自動保存を始める
+
+        recover=True なら前回の自動保存（クラッシュ時に残ったもの）を先に復元する
+        """
+        if recover:
+            try:
+                Autosave.recover(self.canvas, directory)
+            except (OSError, ValueError, KeyError) as e:
+                QW.QMessageBox.warning(self, "エラー", f"自動保存から復元できません: {e}")
+            self.sync_project_controls()
+        self.autosave = Autosave.Autosave(self.canvas, directory)
+        self.autosave.start()
+
+    def closeEvent(self, event):
+        """正常に終了したときは自動保存のファイルを消す"""
+        if self.autosave is not None:
+            self.autosave.close()
+            self.autosave = None
+        super().closeEvent(event)
 
     def add_layer(self):
       """新しいレイヤーを追加"""
       layer_name, ok = QW.QInputDialog.getText(self, "レイヤー名", "レイヤー名を入力:")
       if ok and layer_name:
-        self.canvas.add_layer(layer_name)
-        self.layer_list_widget.add_layer_item(layer_name)  # レイヤーアイテムを追加
+        self.canvas.add_layer(layer_name)  # リストは layers_changed で更新
 
     def delete_layer(self):
       """選択したレイヤーを削除"""
@@ -208,9 +560,7 @@ class DotEditor(QW.QWidget):
 
     def clear_canvas(self):
         """キャンバスをクリアする"""
-        for layer in self.canvas.layers.values():
-            layer.clear()
-        self.canvas.update()
+        self.canvas.clear_canvas()
 
     def toggle_layer(self):
         """背景と前景の切り替え"""
@@ -235,9 +585,31 @@ class DotEditor(QW.QWidget):
       layer_name, ok = QW.QInputDialog.getText(self, "透明度設定", "設定するレイヤー名を入力:")
       if ok and layer_name in self.canvas.layers:
         opacity, ok = QW.QInputDialog.getDouble(
-            self, "透明度", "透明度 (0.0-1.0):", 1.0, 0.0, 1.0, 1)
+            self, "透明度", "透明度 (0.0-1.0):", self.canvas.layer_opacity[layer_name], 0.0, 1.0, 1)
         if ok:
             self.canvas.set_layer_opacity(layer_name, opacity)
+            self.sync_layer_controls()
+
+    def select_layer(self, layer_name):
+      """リストで選んだレイヤーを描画対象にする"""
+      self.canvas.set_layer(layer_name)
+      self.sync_layer_controls()
+
+    def sync_layer_controls(self):
+      """不透明度スライダーとブレンドモードを選択中のレイヤーに合わせる"""
+      layer_name = self.canvas.current_layer
+      for widget in (self.opacity_slider, self.blend_mode_box):
+        widget.blockSignals(True)
+      self.opacity_slider.setValue(round(self.canvas.layer_opacity.get(layer_name, 1.0) * 100))
+      self.blend_mode_box.setCurrentText(self.canvas.layer_blend.get(layer_name, "normal"))
+      for widget in (self.opacity_slider, self.blend_mode_box):
+        widget.blockSignals(False)
+
+    def dump_profile(self):
+        """描画・ストロークなどの所要時間の統計とヒストグラムを JSON で保存"""
+        file_path, _ = QW.QFileDialog.getSaveFileName(self, "計測結果を保存", "profile.json", "JSON (*.json)")
+        if file_path:
+            profiler.dump(file_path)
 
     def change_canvas_size(self):
         """キャンバスのサイズを変更する"""
@@ -246,45 +618,110 @@ class DotEditor(QW.QWidget):
 
     def set_brush_mode(self, mode):
       self.brush_mode = mode
-      print(f"Brush mode set to: {self.brush_mode}")  # デバッグ用
+      logger.debug("ブラシモード: %s", mode)
       # PixelCanvas 側にも反映させる
       if hasattr(self, "canvas"):
         self.canvas.brush_mode = mode  # これを追加
-
-      print(f"Brush mode after setting: {self.brush_mode}")
+        self.canvas.tool = "brush"  # ブラシを選んだら塗りつぶしツールから戻す
+        self.sync_brush_controls()
+
+    def transform(self, op, amount=None):
+      """選択中のレイヤー、またはキャンバス全体を変形"""
+      if self.transform_target_box.currentIndex() == 0:
+        if op == "scale":
+          self.canvas.scale_layer(amount)
+        else:
+          self.canvas.transform_layer(op, amount)
+        return
+      try:
+        self.canvas.transform_canvas(op, amount)
+      except ValueError as e:
+        QW.QMessageBox.warning(self, "エラー", str(e))
+      self.size_input.setValue(self.canvas.grid_size)
+
+    def paste(self):
+      """貼り付けて、そのまま移動できるよう移動ツールにする"""
+      if self.canvas.clipboard is not None:
+        self.canvas.paste()
+        self.canvas.tool = "move"
+
+    def sync_brush_controls(self):
+      """キャンバスのブラシの設定に合わせて表示を更新"""
+      brush = self.canvas.brush
+      for widget, value in ((self.brush_size_input, brush.size),
+                            (self.symmetry_count_input, self.canvas.symmetry_count)):
+        widget.blockSignals(True)
+        widget.setValue(value)
+        widget.blockSignals(False)
+      for widget, value in ((self.brush_shape_box, brush.shape), (self.brush_pattern_box, brush.pattern),
+                            (self.symmetry_box, self.canvas.symmetry)):
+        widget.blockSignals(True)
+        widget.setCurrentText(value)
+        widget.blockSignals(False)
 
     def update_layer_order(self, new_order):
       """ ドラッグ＆ドロップ後にレイヤーの順序を更新 """
-      new_layers = {name: self.layers[name]
-                  for name in new_order if name in self.layers}
-      self.layers = new_layers  # 更新
-      self.update()  # 再描画
+      self.reorder_layers(new_order)
 
     def reorder_layers(self, new_order):
-      """レイヤーの順番を self.layers に反映"""
-      self.layers = {name: self.layers[name]for name in new_order if name in self.layers}
-      self.update()  # 再描画
+      """レイヤーの順番を PixelCanvas に反映（アンドゥ可能）"""
+      self.layers = {name: self.layers[name] for name in new_order if name in self.layers}
+      self.canvas.reorder_layers(new_order)
 
     def update_layer_list(self):
       """レイヤーリストを更新"""
-      self.layer_list_widget.update_layer_list(self.canvas.layers.keys())  
+      self.layer_list_widget.update_layer_list(
+        self.canvas.layers.keys(), self.canvas.layer_visibility, self.canvas.layer_lock)
+      self.schedule_thumbnails()
+
+    def schedule_thumbnails(self):
+      """サムネイルの更新を予約（予約済みなら何もしない）"""
+      if not self._thumbnail_timer.isActive():
+        self._thumbnail_timer.start()
+
+    def update_thumbnails(self):
+      """内容が変わったレイヤーのサムネイルだけを作り直す"""
+      canvas = self.canvas
+      palette = canvas.palette_lut if canvas.indexed else None
+      palette_key = palette[:canvas.palette_count].tobytes() if palette is not None else None
+      keys = {name: (id(layer), canvas.layer_revision.get(name), palette_key)
+              for name, layer in canvas.layers.items()}
+      with profiler.section("thumbnails"):
+        self.layer_list_widget.update_thumbnails(canvas.layers, keys, palette)
 
     def toggle_layer_visibility(self, layer_name):
       """レイヤーの表示/非表示を切り替える"""
-      if layer_name not in self.layer_visibility:
-        self.layer_visibility[layer_name] = True  # デフォルトで表示
-
-      self.layer_visibility[layer_name] = not self.layer_visibility[layer_name]
-      self.update_canvas()
+      # 表示状態は PixelCanvas 側で管理（合成キャッシュも更新される）
+      self.canvas.toggle_layer_visibility(layer_name)
+      self.layer_visibility[layer_name] = self.canvas.layer_visibility.get(layer_name, True)
       return self.layer_visibility[layer_name]
 
     def toggle_layer_lock(self, layer_name):
       """レイヤーのロック/解除を切り替え"""
-      if layer_name not in self.layer_lock:
-        self.layer_lock[layer_name] = False  # デフォルトを設定
-
-      self.layer_lock[layer_name] = not self.layer_lock[layer_name]  # ロックをトグル
+      # ロック状態は PixelCanvas 側で管理（描画・塗りつぶしがこれを参照する）
+      self.layer_lock[layer_name] = self.canvas.toggle_layer_lock(layer_name)
       return self.layer_lock[layer_name]  # 現在のロック状態を返す
 
+    def update_frame_list(self):
+      """フレームリストを更新（選択は表示中のフレーム）"""
+      self.frame_list_widget.blockSignals(True)
+      self.frame_list_widget.clear()
+      self.frame_list_widget.addItems([f"フレーム {i + 1}" for i in range(len(self.canvas.frames))])
+      self.frame_list_widget.setCurrentRow(self.canvas.current_frame)
+      self.frame_list_widget.blockSignals(False)
+
+    def select_frame(self, index):
+      """リストで選んだフレームを表示・編集する"""
+      if index >= 0:
+        self.canvas.stop()
+        self.canvas.set_frame(index)
+
+    def toggle_playback(self):
+      """アニメーションの再生／停止"""
+      if self.canvas.is_playing():
+        self.canvas.stop()
+      else:
+        self.canvas.play()
+
     def update_canvas(self):
         self.canvas.update()
@@ -0,0 +1,92 @@
+""" レイヤー配列から直接画像ファイルを書き出す（ウィジェットの再描画は不要）
+
+Qt を使わないので、QApplication のないスクリプトやワーカースレッドからも呼べる。
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from Compositor import composite_region
+import ProjectFile
+
+# アルファチャンネルを保存できる形式
+_ALPHA_FORMATS = (".png", ".webp", ".tif", ".tiff")
+
+
+def render_image(layers, visibility=None, opacity=None, blend=None, scale=1, background=None,
+                 palette=None):
+    """ レイヤーを合成し、scale 倍（最近傍）に拡大した RGBA 配列を返す
+
+    background: None なら透明のまま、(r, g, b) ならその色の上に合成
+    palette: インデックスカラーのレイヤーに使う (256, 4) の色表
+    """
+    height, width = next(iter(layers.values())).shape[:2]
+    image = composite_region(layers, visibility or {}, 0, height, 0, width,
+                             background=background, opacity=opacity, blend=blend, palette=palette)
+    if scale != 1:
+        image = np.repeat(np.repeat(image, scale, axis=0), scale, axis=1)
+    return image
+
+
+def save_image(path, rgba):
+    """ RGBA 配列を拡張子に合わせて保存（アルファ非対応の形式は白背景に合成） """
+    ext = os.path.splitext(path)[1].lower() or ".png"
+    if ext in _ALPHA_FORMATS:
+        data = cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGRA)
+    else:
+        alpha = rgba[:, :, 3:4].astype(np.float32) / 255.0
+        rgb = rgba[:, :, :3] * alpha + 255.0 * (1.0 - alpha)
+        data = cv2.cvtColor(np.clip(rgb + 0.5, 0, 255).astype(np.uint8), cv2.COLOR_RGB2BGR)
+    ok, encoded = cv2.imencode(ext, data)
+    if not ok:
+        raise ValueError(f"この形式では保存できません: {ext}")
+    encoded.tofile(path)  # 日本語パスにも対応
+
+
+def export_layers(path, layers, visibility=None, opacity=None, blend=None, scale=1, transparent=True,
+                  palette=None):
+    """レイヤーを合成して画像ファイルに書き出す"""
+    background = None if transparent else (255, 255, 255)
+    save_image(path, render_image(layers, visibility, opacity, blend, scale, background, palette))
+
+
+def export_project(project_path, path, scale=1, transparent=True):
+    """プロジェクトファイル（.dotp）を開かずに直接画像へ書き出す"""
+    project = ProjectFile.load_project(project_path)
+    entries = {entry["name"]: entry for entry in project["layers"]
+               if not ProjectFile.is_frame_array(entry["name"])}
+    export_layers(path, {name: project["arrays"][name] for name in entries},
+                  visibility={name: e.get("visible", True) for name, e in entries.items()},
+                  opacity={name: e.get("opacity", 1.0) for name, e in entries.items()},
+                  blend={name: e.get("blend", "normal") for name, e in entries.items()},
+                  scale=scale, transparent=transparent, palette=palette_lut(project))
+
+
+def palette_lut(project):
+    """インデックスカラーのプロジェクトなら (256, 4) の色表を返す（RGBA なら None）"""
+    if not project.get("indexed"):
+        return None
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    colors = np.asarray(project.get("palette_lut", []), dtype=np.uint8).reshape(-1, 4)
+    lut[:len(colors)] = colors
+    return lut
+
+
+def export_many(jobs, workers=None):
+    """ 複数の書き出しをスレッドプールで並列に実行
+
+    jobs: [(関数, 引数のタプル), ...]（例: (export_project, ("a.dotp", "a.png", 4))）
+    戻り値: 各ジョブの例外（成功なら None）のリスト
+    """
+    def run(job):
+        func, args = job
+        try:
+            func(*args)
+        except Exception as e:
+            return e
+        return None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run, jobs))
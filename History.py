@@ -0,0 +1,334 @@
+import numpy as np
+
+from Transform import inverse
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024  # 履歴に使うメモリの上限（32MB）
+
+# 配列以外の記録にかかるおおよそのオーバーヘッド
+_RECORD_OVERHEAD = 128
+
+
+class CellDelta:
+    """1 つのレイヤー内で変化したセル（フラットなインデックスと変更前後の値）"""
+
+    def __init__(self, layer, index, before, after, frame=None):
+        self.layer = layer
+        self.index = index
+        self.before = before
+        self.after = after
+        self.frame = frame  # 変更したアニメーションのフレーム（None なら表示中のフレーム）
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes + self.before.nbytes + self.after.nbytes + _RECORD_OVERHEAD
+
+    def undo(self, canvas):
+        canvas._restore_cells(self.layer, self.index, self.before, self.frame)
+
+    def redo(self, canvas):
+        canvas._restore_cells(self.layer, self.index, self.after, self.frame)
+
+
+def _state_nbytes(state):
+    """取り除いたレイヤーの全フレームの配列のバイト数（フレーム間で共有している配列は 1 回だけ数える）"""
+    if state is None:
+        return 0
+    return sum({id(array): array.nbytes for array in state[2].values()}.values())
+
+
+class LayerAdded:
+    """レイヤーの追加"""
+
+    def __init__(self, name, position):
+        self.name = name
+        self.position = position
+        self.state = None  # アンドゥで取り除いたレイヤー（リドゥ用）
+
+    @property
+    def nbytes(self):
+        return _RECORD_OVERHEAD + _state_nbytes(self.state)
+
+    def undo(self, canvas):
+        self.state = canvas._remove_layer(self.name)
+
+    def redo(self, canvas):
+        canvas._insert_layer(self.name, *self.state)
+        self.state = None
+
+
+class LayerDeleted:
+    """レイヤーの削除（削除したレイヤーの内容を保持する）"""
+
+    def __init__(self, name, state):
+        self.name = name
+        self.state = state  # (position, properties, {フレーム: 配列})
+
+    @property
+    def nbytes(self):
+        return _state_nbytes(self.state) + _RECORD_OVERHEAD
+
+    def undo(self, canvas):
+        canvas._insert_layer(self.name, *self.state)
+
+    def redo(self, canvas):
+        canvas._remove_layer(self.name)
+
+
+class LayerOrderChanged:
+    """レイヤーの並び順の変更"""
+
+    def __init__(self, before, after):
+        self.before = list(before)
+        self.after = list(after)
+
+    @property
+    def nbytes(self):
+        return _RECORD_OVERHEAD
+
+    def undo(self, canvas):
+        canvas._set_layer_order(self.before)
+
+    def redo(self, canvas):
+        canvas._set_layer_order(self.after)
+
+
+class LayerRenamed:
+    """レイヤー名の変更"""
+
+    def __init__(self, old_name, new_name):
+        self.old_name = old_name
+        self.new_name = new_name
+
+    @property
+    def nbytes(self):
+        return _RECORD_OVERHEAD
+
+    def undo(self, canvas):
+        canvas._rename_layer(self.new_name, self.old_name)
+
+    def redo(self, canvas):
+        canvas._rename_layer(self.old_name, self.new_name)
+
+
+class LayerPropertyChanged:
+    """レイヤーの属性（不透明度・ブレンドモードなど）の変更"""
+
+    def __init__(self, name, key, before, after):
+        self.name = name
+        self.key = key
+        self.before = before
+        self.after = after
+
+    @property
+    def nbytes(self):
+        return _RECORD_OVERHEAD
+
+    def merge(self, other):
+        """同じ属性の連続した変更（スライダーのドラッグなど）を 1 つにまとめる"""
+        if not isinstance(other, LayerPropertyChanged) or (other.name, other.key) != (self.name, self.key):
+            return False
+        self.after = other.after
+        return True
+
+    def undo(self, canvas):
+        canvas._set_layer_property(self.name, self.key, self.before)
+
+    def redo(self, canvas):
+        canvas._set_layer_property(self.name, self.key, self.after)
+
+
+class PaletteChanged:
+    """ インデックスカラーの色表の変更（変更した範囲の前後の色だけを持つ）
+
+    色を末尾に追加したときは count に追加前の色数を持ち、アンドゥで色数も戻す
+    """
+
+    def __init__(self, start, before, after, count=None):
+        self.start = start
+        self.before = before
+        self.after = after
+        self.count = count
+
+    @property
+    def nbytes(self):
+        return self.before.nbytes + self.after.nbytes + _RECORD_OVERHEAD
+
+    def undo(self, canvas):
+        canvas._set_palette_entries(self.start, self.before, self.count)
+
+    def redo(self, canvas):
+        canvas._set_palette_entries(self.start, self.after)
+
+
+class FramesChanged:
+    """アニメーションのフレームの追加・複製・削除・並び替え（フレームのリストごと記録）"""
+
+    def __init__(self, before, after, before_index, after_index):
+        self.before = list(before)
+        self.after = list(after)
+        self.before_index = before_index
+        self.after_index = after_index
+
+    @property
+    def nbytes(self):
+        return _RECORD_OVERHEAD
+
+    def undo(self, canvas):
+        canvas._set_frames(self.before, self.before_index)
+
+    def redo(self, canvas):
+        canvas._set_frames(self.after, self.after_index)
+
+
+class LayersTransformed:
+    """ レイヤー（layer が None ならキャンバス全体）の反転・回転・ずらし・拡大
+
+    元に戻せる変形だけを記録し、アンドゥでは逆の変形をかける（セルの内容は持たない）
+    """
+
+    def __init__(self, op, amount, layer=None, frame=None):
+        self.op = op
+        self.amount = amount
+        self.layer = layer
+        self.frame = frame  # 変形したフレーム（キャンバス全体なら None）
+
+    @property
+    def nbytes(self):
+        return _RECORD_OVERHEAD
+
+    def undo(self, canvas):
+        canvas._transform_layers(*inverse(self.op, self.amount), self.layer, self.frame)
+
+    def redo(self, canvas):
+        canvas._transform_layers(self.op, self.amount, self.layer, self.frame)
+
+
+class UndoJournal:
+    """ アンドゥ／リドゥの記録
+
+    1 回の操作（ストロークなど）を記録のリストとして積み、
+    合計サイズが max_bytes を超えたら古いものから捨てる。
+    listener: 操作が確定・取り消し・やり直しされるたびに (記録のリスト, 取り消しなら True) で呼ばれる
+    （clear() では (None, False)）。自動保存に使う。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.undo_stack = []
+        self.redo_stack = []
+        self.nbytes = 0
+        self.listener = None
+
+    def _notify(self, records, undone=False):
+        if self.listener is not None:
+            self.listener(records, undone)
+
+    def __len__(self):
+        return len(self.undo_stack)
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    @staticmethod
+    def _size(entry):
+        return sum(record.nbytes for record in entry)
+
+    def push(self, records, merge=False):
+        """ 新しい操作を記録（リドゥ履歴は破棄）
+
+        merge=True なら、直前の操作とまとめられる場合は 1 つにする
+        """
+        if not records:
+            return
+        for entry in self.redo_stack:
+            self.nbytes -= self._size(entry)
+        self.redo_stack.clear()
+        if merge and self.undo_stack and len(records) == 1 and len(self.undo_stack[-1]) == 1:
+            last = self.undo_stack[-1][0]
+            if hasattr(last, "merge") and last.merge(records[0]):
+                self._notify(records)
+                return
+        self.undo_stack.append(list(records))
+        self.nbytes += self._size(records)
+        self._evict()
+        self._notify(records)
+
+    def _evict(self):
+        # 最新の 1 件は上限を超えていても残す
+        while self.nbytes > self.max_bytes and len(self.undo_stack) > 1:
+            self.nbytes -= self._size(self.undo_stack.pop(0))
+
+    def undo(self, canvas):
+        """直前の操作を取り消す（取り消した操作を返す）"""
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack.pop()
+        self.nbytes -= self._size(entry)
+        for record in reversed(entry):
+            record.undo(canvas)
+        self.redo_stack.append(entry)
+        self.nbytes += self._size(entry)
+        self._notify(entry, undone=True)
+        return entry
+
+    def redo(self, canvas):
+        """取り消した操作をやり直す（やり直した操作を返す）"""
+        if not self.redo_stack:
+            return None
+        entry = self.redo_stack.pop()
+        self.nbytes -= self._size(entry)
+        for record in entry:
+            record.redo(canvas)
+        self.undo_stack.append(entry)
+        self.nbytes += self._size(entry)
+        self._evict()
+        self._notify(entry)
+        return entry
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.nbytes = 0
+        self._notify(None)
+
+
+def _as_words(rows):
+    """(n, 4) の uint8 配列を (n,) の uint32 ビューとして返す（できなければ None）"""
+    if rows.dtype == np.uint8 and rows.ndim == 2 and rows.shape[1] == 4 and rows.flags.c_contiguous:
+        return rows.view(np.uint32)[:, 0]
+    return None
+
+
+def take_rows(flat, index):
+    """flat[index] のコピー（RGBA は 4 バイトを 1 要素として集めるので大きな範囲で速い）"""
+    words = _as_words(flat)
+    if words is None:
+        return flat[index]
+    return words[index].view(np.uint8).reshape(-1, 4)
+
+
+def cell_delta(layer_name, layer, index, before, frame=None):
+    """変更前の値から、実際に変化したセルだけの CellDelta を作る（変化なしなら None）"""
+    flat = layer.reshape(layer.shape[0] * layer.shape[1], -1)
+    after = take_rows(flat, index)
+    before_words, after_words = _as_words(before), _as_words(after)
+    if before_words is not None and after_words is not None:
+        changed = before_words != after_words
+    else:
+        changed = np.any(before != after, axis=1)
+    if not changed.any():
+        return None
+    if not changed.all():
+        index = index[changed]
+        if before_words is not None and after_words is not None:
+            before = before_words[changed].view(np.uint8).reshape(-1, 4)
+            after = after_words[changed].view(np.uint8).reshape(-1, 4)
+        else:
+            before, after = before[changed], after[changed]
+    if index.size > 1 and not np.all(index[1:] > index[:-1]):
+        order = np.argsort(index, kind="stable")
+        index, before, after = index[order], before[order], after[order]
+    return CellDelta(layer_name, index.astype(np.int32), before, after, frame)
@@ -0,0 +1,110 @@
+""" 画像の読み込み（デコード・縮小・減色）をバックグラウンドのスレッドで行う
+
+重い処理はすべてワーカー（QThreadPool）で行い、結果のセル配列だけを
+シグナルで GUI スレッドに渡す。レイヤーへの書き込みは受け取った側で 1 回に行う。
+"""
+import logging
+import threading
+
+import numpy as np
+import PySide6.QtGui as QG
+import PySide6.QtCore as QC
+
+from Pixelize import pixelize
+from Profiler import profiler
+
+logger = logging.getLogger(__name__)
+
+# 進み具合（%）の目安: デコード → 縮小 → 減色
+_DECODED = 30
+_RESAMPLED = 40
+
+
+class ImportCancelled(Exception):
+    """読み込みが取り消された"""
+
+
+class ImportSignals(QC.QObject):
+    """ワーカーから GUI スレッドへの通知（QRunnable はシグナルを持てないので別に用意）"""
+    progress = QC.Signal(object, int)  # (タスク, 0〜100)
+    finished = QC.Signal(object, object)  # (タスク, (grid, grid, 3) の RGB 配列)
+    failed = QC.Signal(object, str)
+    cancelled = QC.Signal(object)
+
+
+def decode_region(file_path, rect, limit):
+    """元画像の rect の範囲だけを、一辺 limit 画素まで縮小してデコード"""
+    reader = QG.QImageReader(file_path)
+    reader.setClipRect(rect)
+    if rect.width() > limit or rect.height() > limit:
+        reader.setScaledSize(QC.QSize(min(rect.width(), limit), min(rect.height(), limit)))
+    return reader.read()
+
+
+def image_to_rgb(image):
+    """QImage を (H, W, 3) の RGB 配列に変換（行末のパディングを考慮）"""
+    image = image.convertToFormat(QG.QImage.Format_RGB888)
+    width, height = image.width(), image.height()
+    data = np.frombuffer(image.constBits(), dtype=np.uint8).reshape(height, image.bytesPerLine())
+    return data[:, :width * 3].reshape(height, width, 3).copy()
+
+
+class ImportTask(QC.QRunnable):
+    """ 1 枚の画像をドット絵のセルに変換するタスク
+
+    layer_name / frame: 結果を書き込む先（開始時に選択していたレイヤーとフレーム）
+    """
+
+    def __init__(self, file_path, rect, grid_size, num_colors, method, layer_name, frame, samples_per_cell,
+                 dither="none"):
+        super().__init__()
+        self.setAutoDelete(False)  # 完了後も GUI スレッド側で参照する
+        self.file_path = file_path
+        self.rect = rect
+        self.grid_size = grid_size
+        self.num_colors = num_colors
+        self.method = method
+        self.dither = dither
+        self.layer_name = layer_name
+        self.frame = frame
+        self.samples_per_cell = samples_per_cell
+        self.progress = 0
+        self.signals = ImportSignals()
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """取り消す（実行中なら次の区切りで中断する）"""
+        self._cancel.set()
+
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def _report(self, percent):
+        if self._cancel.is_set():
+            raise ImportCancelled()
+        self.progress = percent
+        self.signals.progress.emit(self, percent)
+
+    def run(self):
+        try:
+            self._report(0)
+            with profiler.section("import/decode"):
+                image = decode_region(self.file_path, self.rect, self.grid_size * self.samples_per_cell)
+            if image.isNull():
+                raise ValueError("画像を読み込めません")
+            rgb = image_to_rgb(image)
+            if rgb.size == 0:
+                raise ValueError("切り取り範囲が空です")
+            self._report(_DECODED)
+            with profiler.section("import/quantize"):
+                cells = pixelize(rgb, self.grid_size, self.num_colors, self.method,
+                                 progress=lambda done: self._report(
+                                     _RESAMPLED + round((99 - _RESAMPLED) * done)), dither=self.dither)
+            self._report(100)
+        except ImportCancelled:
+            self.signals.cancelled.emit(self)
+        except Exception as e:
+            logger.warning("画像を読み込めません: %s (%s)", self.file_path, e)
+            self.signals.failed.emit(self, str(e))
+        else:
+            self.signals.finished.emit(self, cells)
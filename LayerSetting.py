@@ -1,7 +1,88 @@
+import numpy as np
 import PySide6.QtWidgets as QW
 import PySide6.QtGui as QG
 import PySide6.QtCore as QC
 
+THUMBNAIL_SIZE = 28  # サムネイルの一辺（ピクセル）
+_CHECKER = 4  # サムネイルの背景の市松模様のマス（ピクセル）
+
+
+def layer_thumbnail(layer, palette=None, size=THUMBNAIL_SIZE):
+    """ レイヤーの配列から size x size のサムネイル（QImage）を作る
+
+    セルを間引いて拾うだけなので、レイヤーの大きさによらず size² セル分の処理で済む
+    """
+    height, width = layer.shape[:2]
+    scale = max(height, width) / size
+    ys = np.minimum((np.arange(min(size, height)) * scale).astype(np.intp), height - 1)
+    xs = np.minimum((np.arange(min(size, width)) * scale).astype(np.intp), width - 1)
+    cells = layer[ys[:, None], xs[None, :]]
+    if cells.ndim == 2:  # インデックスカラー
+        cells = palette[cells]
+    cells = np.ascontiguousarray(cells)
+    image = QG.QImage(cells.data, cells.shape[1], cells.shape[0], cells.strides[0],
+                      QG.QImage.Format_RGBA8888).scaled(size, size, QC.Qt.KeepAspectRatio)
+
+    # 透明な部分が分かるよう市松模様の上に描く
+    thumbnail = QG.QImage(size, size, QG.QImage.Format_ARGB32_Premultiplied)
+    thumbnail.fill(QC.Qt.white)
+    painter = QG.QPainter(thumbnail)
+    for y in range(0, size, _CHECKER):
+        for x in range((y // _CHECKER) % 2 * _CHECKER, size, 2 * _CHECKER):
+            painter.fillRect(x, y, _CHECKER, _CHECKER, QG.QColor(204, 204, 204))
+    painter.drawImage(0, 0, image)
+    painter.end()
+    return thumbnail
+
+
+class LayerRow(QW.QWidget):
+    """レイヤー 1 行分の表示（サムネイル・表示ボタン・ロックボタン・名前）"""
+
+    def __init__(self, list_widget, layer_name):
+        super().__init__()
+        self.list_widget = list_widget
+        self.layer_name = layer_name
+
+        # サムネイル（内容が変わったときだけ作り直す）
+        self.thumbnail_label = QW.QLabel()
+        self.thumbnail_label.setFixedSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+
+        # 👁️ 表示ボタン（デフォルト: 表示）
+        self.visibility_button = QW.QPushButton("👁️")
+        self.visibility_button.setFixedSize(24, 24)
+        self.visibility_button.clicked.connect(
+            lambda: self.set_state(visible=list_widget.toggle_visibility(self.layer_name)))
+
+        # 🔒 ロックボタン（デフォルト: 編集可能）
+        self.lock_button = QW.QPushButton("🔓")
+        self.lock_button.setFixedSize(24, 24)
+        self.lock_button.clicked.connect(
+            lambda: self.set_state(locked=list_widget.toggle_lock(self.layer_name)))
+
+        # レイヤー名ラベル
+        self.name_label = QW.QLabel(layer_name)
+
+        # レイアウト設定
+        layout = QW.QHBoxLayout(self)
+        layout.addWidget(self.thumbnail_label)
+        layout.addWidget(self.visibility_button)
+        layout.addWidget(self.lock_button)
+        layout.addWidget(self.name_label)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+    def set_name(self, layer_name):
+        self.layer_name = layer_name
+        self.name_label.setText(layer_name)
+
+    def set_state(self, visible=None, locked=None):
+        if visible is not None:
+            self.visibility_button.setText("👁️" if visible else "🚫")  # 👁️ → 🚫 に変更
+        if locked is not None:
+            self.lock_button.setText("🔒" if locked else "🔓")  # 🔓 → 🔒 に変更
+
+    def set_thumbnail(self, image):
+        self.thumbnail_label.setPixmap(QG.QPixmap.fromImage(image))
+
 
 class LayerListWidget(QW.QListWidget):
     layer_order_changed = QC.Signal(list)  # レイヤーの順番が変更されたときに発火するシグナル
@@ -19,12 +100,53 @@ class LayerListWidget(QW.QListWidget):
         self.customContextMenuRequested.connect(self.show_context_menu)
         self.setDragDropMode(QW.QAbstractItemView.InternalMove)
         self.setAcceptDrops(True)
-
-    def update_layer_list(self, layer_names):
-        """レイヤーリストを更新する"""
-        self.clear()  # 既存のリストをクリア
-        for name in layer_names:
-            self.add_layer_item(name)  # レイヤーアイテムを追加
+        self._thumbnails = {}  # {レイヤー名: (作成時のキー, QImage)}
+
+    def update_layer_list(self, layer_names, visibility=None, locked=None):
+        """ レイヤーリストを更新する
+
+        行は作り直さず、名前が変わった行だけを書き換える（増減は末尾で調整）
+        """
+        layer_names = list(layer_names)
+        visibility, locked = visibility or {}, locked or {}
+        current = self.currentItem().text() if self.currentItem() else None
+        self.blockSignals(True)  # 書き換え中に選択中のレイヤーが変わらないようにする
+        while self.count() > len(layer_names):
+            self.takeItem(self.count() - 1)
+        for row, name in enumerate(layer_names):
+            item = self.item(row) or self.add_layer_item(name)
+            widget = self.itemWidget(item)
+            if widget is None:  # ドラッグ＆ドロップで移動した行はウィジェットが外れる
+                widget = LayerRow(self, name)
+                self.setItemWidget(item, widget)
+                item.setSizeHint(widget.sizeHint())
+            if item.text() != name:
+                item.setText(name)
+            if widget.layer_name != name or widget.thumbnail_label.pixmap().isNull():
+                widget.set_name(name)
+                if name in self._thumbnails:
+                    widget.set_thumbnail(self._thumbnails[name][1])
+            widget.set_state(visibility.get(name, True), locked.get(name, False))
+        if current in layer_names:
+            self.setCurrentRow(layer_names.index(current))
+        self.blockSignals(False)
+        for name in set(self._thumbnails) - set(layer_names):
+            del self._thumbnails[name]
+
+    def update_thumbnails(self, layers, keys, palette=None):
+        """ 内容が変わったレイヤーだけサムネイルを作り直す
+
+        keys: {レイヤー名: 内容を表すキー（変更番号など）}。前回と同じなら何もしない
+        """
+        for row in range(self.count()):
+            widget = self.itemWidget(self.item(row))
+            if widget is None or widget.layer_name not in layers:
+                continue
+            name = widget.layer_name
+            cached = self._thumbnails.get(name)
+            if cached is None or cached[0] != keys.get(name):
+                cached = self._thumbnails[name] = (keys.get(name), layer_thumbnail(layers[name], palette))
+                widget.set_thumbnail(cached[1])
 
     def dropEvent(self, event):
         """アイテムのドロップ時にレイヤーの順番を更新"""
@@ -61,35 +183,17 @@ class LayerListWidget(QW.QListWidget):
 
     def add_layer_item(self, layer_name):
         item = QW.QListWidgetItem(layer_name, self)
-
-        # 👁️ 表示ボタン（デフォルト: 表示）
-        visibility_button = QW.QPushButton("👁️")
-        visibility_button.setFixedSize(24, 24)
-        visibility_button.clicked.connect(lambda: self.toggle_visibility(layer_name, visibility_button))
-
-        # 🔒 ロックボタン（デフォルト: 編集可能）
-        lock_button = QW.QPushButton("🔓")
-        lock_button.setFixedSize(24, 24)
-        lock_button.clicked.connect(lambda: self.toggle_lock(layer_name, lock_button))
-
-        # レイヤー名ラベル
-        name_label = QW.QLabel(layer_name)
-
-        # レイアウト設定
-        widget = QW.QWidget()
-        layout = QW.QHBoxLayout(widget)
-        layout.addWidget(visibility_button)
-        layout.addWidget(lock_button)
-        layout.addWidget(name_label)
-        layout.setContentsMargins(0, 0, 0, 0)
-        widget.setLayout(layout)
-
+        widget = LayerRow(self, layer_name)
         self.setItemWidget(item, widget)
+        item.setSizeHint(widget.sizeHint())
+        return item
 
-    def toggle_visibility(self, layer_name, button):
+    def toggle_visibility(self, layer_name):
         is_visible = self.parent().toggle_layer_visibility(layer_name)  # 表示/非表示を切り替え
-        button.setText("👁️" if is_visible else "🚫")  # 👁️ → 🚫 に変更
+        self.layer_visibility_changed.emit(layer_name, is_visible)
+        return is_visible
 
-    def toggle_lock(self, layer_name, button):
+    def toggle_lock(self, layer_name):
         is_locked = self.parent().toggle_layer_lock(layer_name)  # ロック/解除を切り替え
-        button.setText("🔒" if is_locked else "🔓")  # 🔓 → 🔒 に変更
\ No newline at end of file
+        self.layer_lock_changed.emit(layer_name, is_locked)
+        return is_locked
@@ -2,133 +2,734 @@ import PySide6.QtWidgets as QW
 import PySide6.QtGui as QG
 import PySide6.QtCore as QC
 from CropSelection import CropSelectionView
+from Compositor import composite_region, BLEND_MODES
+from Pixelize import pixelize
+from ImportWorker import ImportTask, image_to_rgb
+import ProjectFile
+import Exporter
+from Animation import Frame, LayerPatch, pack_frames, mapped_layer, DEFAULT_FPS, ONION_OPACITY
+from Brush import Brush, brush_cells, DEFAULT_RADIAL_COUNT
+from Selection import FloatingSelection, rect_mask, lasso_mask, mask_bounds, mask_outline, opaque_cells
+from Profiler import profiler
+from History import (UndoJournal, DEFAULT_MAX_BYTES, LayerAdded, LayerDeleted,
+                     LayerOrderChanged, LayerRenamed, LayerPropertyChanged, PaletteChanged,
+                     FramesChanged, LayersTransformed, cell_delta, take_rows)
+from Transform import transformed_layer, scale_in_place
+import logging
+import time
+
 import cv2
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
+STROKE_FLUSH_MS = 16  # ドラッグ中にまとめて描画する間隔（約 1 フレーム）
+IMPORT_SAMPLES_PER_CELL = 8  # 画像読み込み時に 1 セルあたりデコードする画素数（一辺）
+IMPORT_THREADS = 2  # 同時に実行する画像の読み込み（残りは順番待ち）
+MIN_ZOOM = 0.1  # 1 セルあたりの表示ピクセル数の下限・上限
+MAX_ZOOM = 64.0
+ZOOM_STEP = 1.25  # ホイール 1 段あたりの拡大率
+MIN_GRID_SPACING = 4  # グリッド線の間隔がこのピクセル数より狭くなったら描かない
+PALETTE_SIZE = 256  # インデックスカラーの色数（0 番は透明に予約）
+MIN_GRID_SIZE = 8  # キャンバスの一辺のセル数の下限・上限
+MAX_GRID_SIZE = 2048
+PLAYBACK_IMAGE_BUDGET = 64 * 1024 * 1024  # 再生前に合成しておくフレーム画像の合計バイト数の上限
+FILL_MODES = ("contiguous", "global")  # 塗りつぶし: つながった範囲のみ / 同じ色をすべて
+FILL_SAMPLES = ("layer", "merged")  # 色を判定する対象: 現在のレイヤー / 表示中の合成結果
+
+
+def line_cells(x0, y0, x1, y1):
+    """ 2 点間を結ぶグリッドセル（ブレゼンハムと同じ 1 セル幅の直線）を配列で返す """
+    steps = max(abs(x1 - x0), abs(y1 - y0))
+    if steps == 0:
+        return np.array([x0]), np.array([y0])
+    t = np.arange(steps + 1)
+    # 長軸は 1 セルずつ進め、短軸は四捨五入で決める
+    xs = x0 + np.floor((x1 - x0) * t / steps + 0.5).astype(np.int64)
+    ys = y0 + np.floor((y1 - y0) * t / steps + 0.5).astype(np.int64)
+    return xs, ys
+
+
 class PixelCanvas(QW.QWidget):
-    def __init__(self, grid_size=16, pixel_size=20):
+    layers_changed = QC.Signal()  # レイヤーの追加・削除・並び替え・名前変更で発火
+    content_changed = QC.Signal()  # レイヤーの内容が変わると発火（サムネイルの更新用）
+    palette_changed = QC.Signal()  # インデックスカラーの色表が変わると発火
+    imports_changed = QC.Signal()  # 画像の読み込みの開始・進行・終了で発火
+    import_failed = QC.Signal(str, str)  # (ファイル名, エラーの内容)
+    frames_changed = QC.Signal()  # フレームの追加・削除・並び替え・切り替えで発火
+    playback_changed = QC.Signal(bool)  # 再生の開始・停止で発火
+
+    def __init__(self, grid_size=16, pixel_size=20, history_bytes=DEFAULT_MAX_BYTES):
         super().__init__()
         self.grid_size = grid_size
-        self.pixel_size = pixel_size
-        self.pixels = {}  # ピクセルの色を保存
+        self.pixel_size = pixel_size  # 初期表示での 1 セルの大きさ（ピクセル）
         self.current_color = QG.QColor(0, 0, 0)  # 初期色（黒）
         self.show_grid = True  # グリッド線の表示/非表示
-
-        self.history = []
-        self.future = []
-
+        self.show_stats = False  # FPS・描画時間の表示/非表示
+        self.grid_minor = 1  # 細いグリッド線の間隔（セル数）
+        self.grid_major = 0  # 太いグリッド線の間隔（0 なら表示しない）
+
+        # 表示位置: スクリーン座標 = グリッド座標 * zoom + offset
+        self.zoom = float(pixel_size)
+        self._offset = QC.QPointF(0, 0)
+        self._auto_fit = True  # ユーザーが拡大・移動するまではウィンドウに合わせる
+        self._pan_anchor = None  # 中ボタンでドラッグ中の直前の位置
+
+        self.history = UndoJournal(history_bytes)  # 変更されたセルだけを記録する履歴
+        self._stroke = None  # 記録中の操作 {レイヤー名: (記録済みマスク, [インデックス], [変更前の値])}
+        self._stroke_palette = 1  # 記録を始めたときの色数
+
+        # アニメーションのフレーム（self.layers と self.layer_revision は表示中のフレームのもの）
+        self.frames = [Frame({})]
+        self.current_frame = 0
+        self.fps = DEFAULT_FPS
+        self.onion_skin = 0  # 前後に重ねて表示するフレーム数
+        self._playback_frame = None  # 再生中に表示しているフレーム
+        self._playback_cached = set()  # 再生中に画像を持ち続けるフレーム（残りは表示のたびに合成して手放す）
+        self._playback_timer = QC.QTimer(self)
+        self._playback_timer.timeout.connect(self._advance_playback)
+        self._view_version = 0  # 属性・並び順・色表の変更で増える（フレーム画像のキャッシュ判定用）
+
+        # レイヤーごとの変更番号（内容が変わるたびに増える。保存やサムネイルの差分判定に使う）
+        self._revision_counter = 0
+        self.project_path = None  # 最後に保存／読み込みしたプロジェクトファイル
+        self._saved_revision = {}
+        self._saved_layout = {}  # ファイル上のレイヤー構成 {名前: 形}
+
+        # インデックスカラーモードではレイヤーは色表の番号 (grid_size, grid_size) uint8 を持ち、
+        # 合成時に色表を引いて RGBA にする（色表を書き換えるだけで全レイヤーの色が変わる）
+        self.indexed = False
+        self.palette_lut = np.zeros((PALETTE_SIZE, 4), dtype=np.uint8)
+        self.palette_count = 1  # 使用中の色表の数（0 番の透明を含む）
+
+        # レイヤーは (grid_size, grid_size, 4) の RGBA 配列（[y, x] のグリッド座標）
         self.layers = {
-            "background": {},  # 背景レイヤー
-            "foreground": {}   # 前景レイヤー
+            "background": self._new_layer(),  # 背景レイヤー
+            "foreground": self._new_layer()   # 前景レイヤー
         }
 
         self.current_layer = "foreground"  # 初期レイヤーは前景
         self.layer_visibility = {"background": True, "foreground": True}# レイヤーの表示状態
-        self.brush_mode = "normal"  # ブラシモード（normal, checker, symmetry）
+        self.brush = Brush()  # スタンプの形・大きさ・模様
+        self.symmetry = "none"  # 対称変換（none, horizontal, vertical, quad, radial）
+        self.symmetry_count = DEFAULT_RADIAL_COUNT  # radial の分割数
         self.layer_lock = {"background": False,"foreground": False}  # レイヤーのロック状態
-        self.setFixedSize(grid_size * pixel_size, grid_size * pixel_size)
+        self.layer_opacity = {"background": 1.0, "foreground": 1.0}  # レイヤーの不透明度（合成時に適用）
+        self.layer_blend = {"background": "normal", "foreground": "normal"}  # ブレンドモード
+        self.tool = "brush"  # 左クリックの動作（brush, fill, select_rect, lasso, wand, move）
+        self.fill_mode = "contiguous"
+        self.fill_tolerance = 0  # 同じ色とみなす RGBA 各成分の差（0〜255）
+        self.fill_sample = "layer"
+        for name in self.layers:
+            self._touch_layer(name)
+        self.is_drawing = False
+
+        # 選択範囲（(grid, grid) の bool、なければ None）と、移動・貼り付け中の浮いている内容
+        self.selection = None
+        self._selection_outline = []  # 選択範囲の境界線（セル座標の QLineF）
+        self.floating = None
+        self.clipboard = None  # (RGBA の内容, マスク, x, y)
+        self._selection_drag = None  # ドラッグ中の選択ツールと、押したセル（移動なら掴んだ位置のずれ）
+        self._lasso_points = []
+        self._last_cell = None  # ドラッグ中の直前のセル
+        self._pending_xs = []  # 次のフレームでまとめて描画するセル
+        self._pending_ys = []
+        self._stroke_timer = QC.QTimer(self)
+        self._stroke_timer.setSingleShot(True)
+        self._stroke_timer.setInterval(STROKE_FLUSH_MS)
+        self._stroke_timer.timeout.connect(self.flush_stroke)
+
+        # バックグラウンドで実行中・順番待ちの画像の読み込み
+        self._import_pool = QC.QThreadPool(self)
+        self._import_pool.setMaxThreadCount(IMPORT_THREADS)
+        self.imports = []
+        self._finished_imports = []  # ストローク中に届いた結果（ストロークの確定後に書き込む）
+
+        # 合成済み画像のキャッシュ（グリッド解像度、白背景の上に合成）
+        self._composite = None
+        self._composite_image = None
+        self._dirty = None  # 再合成が必要なセル範囲 (x0, y0, x1, y1)
+        self._invalidate_composite()
+        self.setMinimumSize(256, 256)
+        self.setSizePolicy(QW.QSizePolicy.Expanding, QW.QSizePolicy.Expanding)
+
+    @property
+    def layers(self):
+        """表示中のフレームのレイヤー {名前: 配列}（辞書の順番が描画順、差分で持っていれば配列に戻す）"""
+        return self.frames[self.current_frame].unpack()
+
+    @layers.setter
+    def layers(self, layers):
+        self.frames[self.current_frame].layers = layers
+
+    @property
+    def layer_revision(self):
+        return self.frames[self.current_frame].revision
+
+    @layer_revision.setter
+    def layer_revision(self, revision):
+        self.frames[self.current_frame].revision = revision
+
+    def _writable_layer(self, layer_name, frame=None):
+        """書き込み用の配列（他のフレームと共有中ならここでコピー）"""
+        return (frame or self.frames[self.current_frame]).writable_layer(layer_name)
+
+    def _pack_frames(self):
+        """表示していないフレームの描き変えたレイヤーを、共有している土台との差分にする"""
+        pack_frames(self.frames, self.frames[self.current_frame])
+        self._release_frame_images()
+
+    def _release_frame_images(self):
+        """表示中のフレームとオニオンスキンの範囲以外のフレーム画像を手放す（再生中は何もしない）"""
+        if self._playback_frame is not None:
+            return
+        keep = range(self.current_frame - self.onion_skin, self.current_frame + self.onion_skin + 1)
+        for index, frame in enumerate(self.frames):
+            if index not in keep:
+                frame.release_image()
+
+    @property
+    def brush_mode(self):
+        """以前のブラシモード（normal, checker, symmetry）での呼び方"""
+        if self.brush.pattern == "checker":
+            return "checker"
+        return "symmetry" if self.symmetry == "quad" else "normal"
+
+    @brush_mode.setter
+    def brush_mode(self, mode):
+        # 市松模様は 2x2 のスタンプ、シンメトリーは上下左右の 4 方向として扱う
+        if mode == "checker":
+            self.set_brush(size=max(self.brush.size, 2), pattern="checker")
+            self.symmetry = "none"
+        else:
+            self.set_brush(pattern="solid")
+            self.symmetry = "quad" if mode == "symmetry" else "none"
 
     def set_brush_mode(self, mode):
       self.brush_mode = mode
-      print(f"Brush mode set to: {self.brush_mode}")  # デバッグ用
+      logger.debug("ブラシモード: %s", mode)
+
+    def set_brush(self, size=None, shape=None, pattern=None, mask=None):
+      """ブラシを変更する（指定しなかった項目は今の設定のまま）"""
+      brush = self.brush
+      if mask is None and brush.shape == "custom" and size is None and shape is None:
+        mask = brush.mask
+      self.brush = Brush(brush.size if size is None else size,
+                         (brush.shape if brush.shape != "custom" else "square") if shape is None else shape,
+                         brush.pattern if pattern is None else pattern, mask)
+
+    def set_symmetry(self, mode, count=None):
+      """対称変換を変更する（radial は count 方向に回転）"""
+      self.symmetry = mode
+      if count is not None:
+        self.symmetry_count = max(int(count), 1)
+
+    def brush_cells(self, xs, ys):
+      """ダブの中心 (xs, ys) を今のブラシで塗るときのセル（描画と消しゴムで共通）"""
+      return brush_cells(self.brush, xs, ys, self.grid_size, self.symmetry, self.symmetry_count)
+
+    def _new_layer(self):
+        """空（全透明）のレイヤー配列を作成"""
+        if self.indexed:
+            return np.zeros((self.grid_size, self.grid_size), dtype=np.uint8)
+        return np.zeros((self.grid_size, self.grid_size, 4), dtype=np.uint8)
+
+    @staticmethod
+    def _color_to_rgba(color):
+        """QColor を RGBA 配列に変換（None は透明）"""
+        if color is None:
+            return np.zeros(4, dtype=np.uint8)
+        color = QG.QColor(color)
+        return np.array([color.red(), color.green(), color.blue(), color.alpha()], dtype=np.uint8)
+
+    def _color_value(self, color):
+        """レイヤーに書き込む値（RGBA 配列、インデックスカラーなら色表の番号）"""
+        if self.indexed:
+            return np.uint8(self.palette_index(color))
+        return self._color_to_rgba(color)
+
+    def layer_rgba(self, layer_name=None):
+        """レイヤーを RGBA 配列として返す（インデックスカラーなら色表を引いたコピー）"""
+        layer = self.layers[layer_name or self.current_layer]
+        return self.palette_lut[layer] if layer.ndim == 2 else layer
+
+    def _in_grid(self, x, y):
+        return 0 <= x < self.grid_size and 0 <= y < self.grid_size
+
+    def _write_cells(self, xs, ys, color):
+        """グリッド座標の配列に色を書き込む（範囲外は無視）"""
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        inside = (xs >= 0) & (xs < self.grid_size) & (ys >= 0) & (ys < self.grid_size)
+        xs, ys = xs[inside], ys[inside]
+        if xs.size == 0 or self.layer_lock.get(self.current_layer, False):
+            return
+        self._record_cells(self.current_layer, ys * self.grid_size + xs)
+        self._writable_layer(self.current_layer)[ys, xs] = self._color_value(color)
+        self._touch_layer(self.current_layer)
+        self._mark_dirty(xs.min(), ys.min(), xs.max() + 1, ys.max() + 1)
+
+    def _touch_layer(self, layer_name, frame=None):
+        """レイヤーの内容が変わったことを記録"""
+        self._revision_counter += 1
+        (frame or self.frames[self.current_frame]).revision[layer_name] = self._revision_counter
+        self.content_changed.emit()
+
+    def _mark_dirty(self, x0, y0, x1, y1):
+        """セル範囲を再合成対象にして、その部分だけ再描画を要求"""
+        x0, y0, x1, y1 = int(x0), int(y0), int(x1), int(y1)
+        if self._dirty is None:
+            self._dirty = (x0, y0, x1, y1)
+        else:
+            dx0, dy0, dx1, dy1 = self._dirty
+            self._dirty = (min(dx0, x0), min(dy0, y0), max(dx1, x1), max(dy1, y1))
+        self.update(self.grid_rect_to_screen(x0, y0, x1, y1))
+        if self.show_stats:
+            self.update(self.STATS_RECT)  # 計測値の表示も更新
+
+    def _invalidate_composite(self):
+        """キャッシュ全体を作り直す（サイズ変更・レイヤー構成の変更時）"""
+        if self._composite is None or self._composite.shape[0] != self.grid_size:
+            # QImage がメモリを持ち、NumPy からはそのビューに書き込む
+            self._composite_image = QG.QImage(self.grid_size, self.grid_size, QG.QImage.Format_RGBX8888)
+            self._composite_image.fill(QC.Qt.white)
+            self._composite = np.frombuffer(self._composite_image.bits(), dtype=np.uint8).reshape(
+                self.grid_size, self._composite_image.bytesPerLine() // 4, 4)[:, :self.grid_size]
+        self._dirty = None
+        self._mark_dirty(0, 0, self.grid_size, self.grid_size)
+
+    def _flush_composite(self):
+        """ダーティ範囲だけレイヤーを合成し直してキャッシュに反映"""
+        if self._dirty is None:
+            return
+        x0, y0, x1, y1 = self._dirty
+        self._dirty = None
+        self._composite[y0:y1, x0:x1] = composite_region(
+            self.layers, self.layer_visibility, y0, y1, x0, x1, background=(255, 255, 255),
+            opacity=self.layer_opacity, blend=self.layer_blend, palette=self.palette_lut)
+
+    def get_pixel(self, x, y, layer_name=None):
+        """グリッド座標の色を QColor で取得（透明なら None）"""
+        value = self.layers[layer_name or self.current_layer][y, x]
+        if value.ndim == 0:
+            value = self.palette_lut[value]
+        r, g, b, a = (int(v) for v in value)
+        return QG.QColor(r, g, b, a) if a else None
+
+    def layer_pixels(self, layer_name=None):
+        """旧形式の {(x, y): QColor} 辞書を返す（座標は pixel_size 倍のスクリーン座標）"""
+        layer = self.layer_rgba(layer_name)
+        ys, xs = np.nonzero(layer[:, :, 3])
+        return {
+            (int(x) * self.pixel_size, int(y) * self.pixel_size): QG.QColor(*(int(v) for v in layer[y, x]))
+            for y, x in zip(ys, xs)
+        }
 
     def update_canvas_size(self):
-        """キャンバスのサイズを更新"""
-        self.setFixedSize(self.grid_size * self.pixel_size, self.grid_size * self.pixel_size)
+        """キャンバスのサイズを更新（グリッド全体が見えるように表示し直す）"""
+        self._auto_fit = True
+        self.fit_to_window()
+
+    # ----- 表示の座標変換 -----
+
+    def view_transform(self):
+        """グリッド座標からスクリーン座標への変換"""
+        return QG.QTransform(self.zoom, 0, 0, self.zoom, self._offset.x(), self._offset.y())
+
+    def map_to_grid(self, pos):
+        """スクリーン座標（QPoint / QPointF）を含むセルのグリッド座標 (x, y) を返す（範囲外も返す）"""
+        point = self.view_transform().inverted()[0].map(QC.QPointF(pos))
+        return int(np.floor(point.x())), int(np.floor(point.y()))
+
+    def grid_rect_to_screen(self, x0, y0, x1, y1):
+        """セル範囲 [x0, x1) x [y0, y1) を覆うスクリーン上の矩形（グリッド線の太さ分を含む）"""
+        rect = self.view_transform().mapRect(QC.QRectF(x0, y0, x1 - x0, y1 - y0))
+        return rect.toAlignedRect().adjusted(-1, -1, 1, 1)
+
+    def visible_cells(self, rect=None):
+        """スクリーン上の矩形（省略時はウィジェット全体）に見えているセル範囲 (x0, y0, x1, y1)"""
+        rect = QC.QRectF(rect if rect is not None else self.rect())
+        cells = self.view_transform().inverted()[0].mapRect(rect)
+        x0 = min(max(int(np.floor(cells.left())), 0), self.grid_size)
+        y0 = min(max(int(np.floor(cells.top())), 0), self.grid_size)
+        x1 = min(max(int(np.ceil(cells.right())), 0), self.grid_size)
+        y1 = min(max(int(np.ceil(cells.bottom())), 0), self.grid_size)
+        return x0, y0, x1, y1
+
+    def set_zoom(self, zoom, anchor=None):
+        """表示倍率を変更（anchor のスクリーン座標にあるセルは動かさない）"""
+        zoom = min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+        if anchor is None:
+            anchor = QC.QPointF(self.width() / 2, self.height() / 2)
+        anchor = QC.QPointF(anchor)
+        cell = (anchor - self._offset) / self.zoom
+        self.zoom = zoom
+        self._offset = anchor - cell * zoom
+        self._auto_fit = False
+        self.update()
+
+    def pan_by(self, dx, dy):
+        """表示をスクリーン座標で (dx, dy) だけ動かす"""
+        self._offset += QC.QPointF(dx, dy)
+        self._auto_fit = False
         self.update()
 
+    def fit_to_window(self):
+        """グリッド全体がウィンドウに収まるように倍率と位置を合わせる"""
+        zoom = min(self.width(), self.height()) / self.grid_size
+        self.zoom = min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+        extent = self.grid_size * self.zoom
+        self._offset = QC.QPointF((self.width() - extent) / 2, (self.height() - extent) / 2)
+        self.update()
+
+    def sizeHint(self):
+        side = min(self.grid_size * self.pixel_size, 800)
+        return QC.QSize(side, side)
+
+    def resizeEvent(self, event):
+        if self._auto_fit:
+            self.fit_to_window()
+        super().resizeEvent(event)
+
     def resize_canvas(self, new_size):
-        """キャンバスサイズを変更"""
+        """キャンバスサイズを変更（重なる範囲の内容は保持）"""
+        self.commit_state()  # 浮いている選択範囲は確定してから
+        self._drop_selection()
+        old_size = self.grid_size
         self.grid_size = new_size
-        self.pixels.clear()  # サイズ変更時にリセット
+        keep = min(old_size, new_size)
+
+        def resize(layer):
+          array = self._new_layer()
+          array[:keep, :keep] = layer[:keep, :keep]
+          return array
+        resized = {}  # フレーム間で共有している配列は 1 回だけ作り直し、共有を保つ
+        for frame in self.frames:
+          for name, layer in frame.layers.items():
+            frame.layers[name] = mapped_layer(layer, resize, resized)
+            self._touch_layer(name, frame)
+        self._stroke = None
+        self.history.clear()
+        self._invalidate_composite()
+        self.update_canvas_size()
+
+    def save_project(self, file_path, palette=()):
+        """ レイヤー・属性・パレットをプロジェクトファイルに保存
+
+        同じファイルへの上書きでは、前回から変更されたレイヤーだけを書き込む。
+        保存先をマップしている配列があれば、どれも自分の位置だけを参照しているときに限ってその場で書き、
+        そうでなければ（フレームの並び替えや名前の入れ替えの後など）先にメモリに移してから書く
+        """
+        arrays, revisions, frame_keys = self._project_arrays()
+        layout = {key: layer.shape for key, layer in arrays.items()}
+        if file_path == self.project_path:
+          dirty = {key for key in arrays if revisions[key] != self._saved_revision.get(key)}
+        else:
+          dirty = None
+
+        properties, extra = self._project_header(frame_keys)
+        mapped = self._mapped_arrays(file_path)
+        if not mapped:
+          ProjectFile.save_project(file_path, arrays, properties, palette, extra=extra, dirty=dirty)
+        elif (not self._maps_own_slots(mapped, arrays, file_path)
+              or ProjectFile.save_project(file_path, arrays, properties, palette, extra=extra,
+                                          dirty=dirty, rewrite=False) is None):
+          # 書き込むとマップしている別の配列の内容が変わる（全体を書き直すなら置き換えられない）
+          self._load_into_memory()
+          arrays, revisions, frame_keys = self._project_arrays()
+          ProjectFile.save_project(file_path, arrays, properties, palette, extra=extra, dirty=dirty)
+        self.project_path = file_path
+        self._saved_revision = revisions
+        self._saved_layout = layout
+
+    def _layer_dicts(self):
+        """ 配列を持っている辞書のリスト（各フレームのレイヤーと、履歴が持っているフレーム・取り除いたレイヤー） """
+        frames = list(self.frames)
+        dicts = []
+        for entry in self.history.undo_stack + self.history.redo_stack:
+          for record in entry:
+            if isinstance(record, FramesChanged):
+              frames += record.before + record.after
+            elif isinstance(record, (LayerAdded, LayerDeleted)) and record.state is not None:
+              dicts.append(record.state[2])
+        seen = set()
+        for frame in frames:
+          if id(frame) not in seen:
+            seen.add(id(frame))
+            dicts.append(frame.layers)
+        return dicts
+
+    def _mapped_arrays(self, file_path):
+        """file_path をメモリマップしている配列の [(配列, ファイル上の位置), ...]"""
+        mapped = {}
+        for layers in self._layer_dicts():
+          for layer in layers.values():
+            if isinstance(layer, LayerPatch):
+              layer = layer.base
+            if id(layer) not in mapped:
+              offset = ProjectFile.mapped_offset(layer, file_path)
+              if offset is not None:
+                mapped[id(layer)] = (layer, offset)
+        return list(mapped.values())
+
+    @staticmethod
+    def _maps_own_slots(mapped, arrays, file_path):
+        """ マップしている配列がどれも、その位置に書き込まれる配列そのものなら True（書き込んでも内容は変わらない） """
+        try:
+          header = ProjectFile.read_header(file_path)
+        except (OSError, ValueError):
+          return False
+        owners = {entry["offset"]: arrays.get(entry["name"]) for entry in header["layers"]}
+        return all(owners.get(offset) is layer for layer, offset in mapped)
+
+    def _load_into_memory(self):
+        """ファイルをメモリマップしている配列をメモリにコピー（履歴が持つ配列も含め、共有は保つ）"""
+        in_memory = {}
+
+        def copy(layer):
+          if id(layer) not in in_memory:
+            if isinstance(layer, LayerPatch):  # 差分は土台だけをコピーする
+              in_memory[id(layer)] = LayerPatch(copy(layer.base), layer.index, layer.values)
+            else:
+              in_memory[id(layer)] = np.array(layer)
+              in_memory[id(layer)].flags.writeable = layer.flags.writeable
+          return in_memory[id(layer)]
+        for layers in self._layer_dicts():
+          for name, layer in layers.items():
+            if isinstance(layer.base if isinstance(layer, LayerPatch) else layer, np.memmap):
+              layers[name] = copy(layer)
+
+    def _project_header(self, frame_keys):
+        """保存するレイヤーの属性 {名前: {...}} と、ヘッダに加える値"""
+        properties = {name: {key: values.get(name, self.LAYER_PROPERTY_DEFAULTS[key])
+                             for key, values in self._layer_property_dicts().items()}
+                      for name in self.layers}
+        extra = {"grid_size": self.grid_size, "current_layer": self.current_layer, "indexed": self.indexed}
+        if self.indexed:
+          extra["palette_lut"] = self.palette_lut[:self.palette_count].tolist()
+        if len(self.frames) > 1:
+          extra.update(frames=frame_keys, current_frame=self.current_frame, fps=self.fps)
+        return properties, extra
+
+    def _project_arrays(self):
+        """ 保存する配列 {名前: 配列}、その変更番号、フレームごとの {レイヤー名: 配列の名前}
+
+        1 フレーム目はレイヤー名のまま、他のフレームは共有していない配列だけを別名で加える
+        """
+        arrays, revisions, frame_keys, saved = {}, {}, [], {}
+        for i, frame in enumerate(self.frames):
+          keys = {}
+          for name, layer in frame.layers.items():
+            key = saved.get(id(layer)) if i else None
+            if key is None:
+              key = f"{ProjectFile.FRAME_PREFIX}{i}/{name}" if i else name
+              saved[id(layer)] = key
+              arrays[key] = layer
+              revisions[key] = frame.revision.get(name)
+            keys[name] = key
+          frame_keys.append(keys)
+        return arrays, revisions, frame_keys
+
+    def load_project(self, file_path):
+        """ プロジェクトファイルを開く（レイヤーはメモリマップで読み込む）。パレットを返す """
+        project = ProjectFile.load_project(file_path)
+        self.commit_state()
+        self._drop_selection()
+        self.stop()
+        self.grid_size = project["grid_size"]
+        arrays = project["arrays"]
+        frame_keys = project.get("frames") or [
+            {entry["name"]: entry["name"] for entry in project["layers"]
+             if not ProjectFile.is_frame_array(entry["name"])}]
+        self.frames = [Frame({name: arrays[key] for name, key in keys.items()}) for keys in frame_keys]
+        # 複数のフレームで同じ配列を使っている場合は、読み取り専用にして共有する
+        counts = {}
+        for keys in frame_keys:
+          for key in keys.values():
+            counts[key] = counts.get(key, 0) + 1
+        for key, count in counts.items():
+          if count > 1:
+            arrays[key].flags.writeable = False
+        self.current_frame = min(max(project.get("current_frame", 0), 0), len(self.frames) - 1)
+        self.fps = project.get("fps", self.fps)
+        self.indexed = bool(project.get("indexed", False))
+        self.palette_lut = Exporter.palette_lut(project)
+        if self.palette_lut is None:
+          self.palette_lut = np.zeros((PALETTE_SIZE, 4), dtype=np.uint8)
+        self.palette_count = max(len(project.get("palette_lut", [])), 1)
+        for key, values in self._layer_property_dicts().items():
+          values.clear()
+          for entry in project["layers"]:
+            if not ProjectFile.is_frame_array(entry["name"]):
+              values[entry["name"]] = entry.get(key, self.LAYER_PROPERTY_DEFAULTS[key])
+        for frame in self.frames:
+          for name in frame.layers:
+            self._touch_layer(name, frame)
+        self.current_layer = project.get("current_layer")
+        if self.current_layer not in self.layers:
+          self.current_layer = next(reversed(self.layers))
+
+        self.history.clear()
+        self.project_path = file_path
+        arrays, self._saved_revision, _ = self._project_arrays()
+        self._saved_layout = {key: layer.shape for key, layer in arrays.items()}
+        self._invalidate_composite()
         self.update_canvas_size()
+        self.layers_changed.emit()
+        self.palette_changed.emit()
+        self.frames_changed.emit()
+        return [tuple(color) for color in project.get("palette", [])]
 
     def save_canvas(self):
-        """キャンバスの内容を画像として保存（グリッドなし）"""
+        """キャンバスの内容を画像として保存（グリッドなし、レイヤーから直接書き出す）"""
         file_path, _ = QW.QFileDialog.getSaveFileName(
             self, "画像を保存", "", "PNG Files (*.png);;JPEG Files (*.jpg);;BMP Files (*.bmp);;All Files (*)"
         )
 
         if file_path:
-            # 一時的にグリッドを非表示
-            original_show_grid = self.show_grid
-            self.show_grid = False
-            self.repaint()  # 再描画
-
-            image = QG.QImage(self.width(), self.height(),
-                              QG.QImage.Format_ARGB32)
-            image.fill(QC.Qt.white)
-
-            painter = QG.QPainter(image)
-            self.render(painter, QC.QPoint(0, 0))
-            painter.end()
-
-            # グリッド表示を元に戻す
-            self.show_grid = original_show_grid
-            self.repaint()  # 再描画
-
-            image.save(file_path)
+            scale, ok = QW.QInputDialog.getInt(self, "画像を保存", "拡大率（1 = 1セル1ピクセル）:", 1, 1, 64)
+            if ok:
+                try:
+                    self.export_image(file_path, scale)
+                except ValueError as e:
+                    QW.QMessageBox.warning(self, "エラー", str(e))
+
+    @profiler.timed("export")
+    def export_image(self, file_path, scale=1, transparent=True):
+        """表示中のレイヤーを合成して scale 倍（最近傍）で書き出す（PNG は透明背景を保持）"""
+        self.commit_state()
+        Exporter.export_layers(file_path, self.layers, self.layer_visibility,
+                               self.layer_opacity, self.layer_blend, scale, transparent,
+                               palette=self.palette_lut)
 
     def paintEvent(self, event):
+        start = time.perf_counter()
         painter = QG.QPainter(self)
-
-        # ピクセルを描画
-        for (x, y), color in self.pixels.items():
-          rect = (x, y, self.pixel_size, self.pixel_size)
-
-          if color is None:
-            painter.setPen(QC.Qt.NoPen)  # ペンなし
-            color = QC.Qt.white  # デフォルト色を白にする
+        exposed = event.rect()
+        painter.fillRect(exposed, QG.QColor(200, 200, 200))  # キャンバスの外側
+
+        # 合成済みキャッシュのうち、再描画範囲に見えているセルだけを拡大して転送
+        cx0, cy0, cx1, cy1 = self.visible_cells(exposed)
+        if cx1 > cx0 and cy1 > cy0:
+          painter.setTransform(self.view_transform())
+          cells = QC.QRect(cx0, cy0, cx1 - cx0, cy1 - cy0)
+          if self._playback_frame is not None:
+            # 再生中は合成済みのフレーム画像をそのまま転送
+            painter.fillRect(cells, QC.Qt.white)
+            painter.drawImage(cells, self.frame_image(self._playback_frame), cells)
           else:
-            painter.setPen(QG.QPen(color))  # 適切なペンを設定
-
-          painter.fillRect(*rect, color)  # 塗りつぶし
-
-        # すべてのレイヤーを描画
-        for layer_name, layer_data in self.layers.items():
-          if self.layer_visibility.get(layer_name, True):  # 表示されているレイヤーのみ描画
-            for (x, y), color in layer_data.items():
-                if color is None:
-                    painter.setPen(QC.Qt.NoPen)
-                    color = QC.Qt.white
-                else:
-                    painter.setPen(QG.QPen(color))
-
-                painter.fillRect(x, y, self.pixel_size, self.pixel_size, color)
+            self._flush_composite()
+            painter.drawImage(cells, self._composite_image, cells)
+            self._draw_onion_skin(painter, cells)
+            self._draw_selection(painter)
+          painter.resetTransform()
+
+          # グリッドと中心線（ON の場合のみ、見えている範囲の線だけ描く）
+          if self.show_grid:
+            self._draw_grid(painter, cx0, cy0, cx1, cy1)
+
+        profiler.record("paint", time.perf_counter() - start)
+        profiler.mark("frame")
+        profiler.set_value("cells_drawn", max(cx1 - cx0, 0) * max(cy1 - cy0, 0))
+        if self.show_stats:
+          self._draw_stats(painter)
+        painter.end()  # QPainter を明示的に終了
 
-        # グリッド描画（ON の場合のみ）
-        if self.show_grid:
+    STATS_RECT = QC.QRect(4, 4, 360, 20)  # 計測値を表示する位置
+
+    def _draw_stats(self, painter):
+        """FPS・直近の描画時間・描画したセル数・直近のストロークの時間を左上に表示"""
+        stroke = profiler.last("stroke")
+        text = "{:.0f} FPS  paint {:.2f} ms  cells {}  stroke {}".format(
+            profiler.rate("frame"), profiler.last("paint") * 1000.0,
+            profiler.values.get("cells_drawn", 0),
+            "-" if stroke is None else f"{stroke * 1000.0:.2f} ms")
+        painter.fillRect(self.STATS_RECT, QG.QColor(0, 0, 0, 160))
+        painter.setPen(QC.Qt.white)
+        painter.drawText(self.STATS_RECT.adjusted(6, 0, -6, 0), QC.Qt.AlignVCenter | QC.Qt.AlignLeft, text)
+
+    def toggle_stats(self):
+        """FPS・描画時間の表示を切り替える"""
+        self.show_stats = not self.show_stats
+        self.update(self.STATS_RECT)
+
+    def _draw_onion_skin(self, painter, cells):
+        """前後のフレームを薄く重ねて表示（離れたフレームほど薄い）"""
+        for distance in range(1, self.onion_skin + 1):
+          for index in (self.current_frame - distance, self.current_frame + distance):
+            if 0 <= index < len(self.frames):
+              painter.setOpacity(ONION_OPACITY / distance)
+              painter.drawImage(cells, self.frame_image(index), cells)
+        painter.setOpacity(1.0)
+
+    def _draw_selection(self, painter):
+        """浮いている内容と、選択範囲の境界線を描く（キャンバスの変換を掛けた状態で呼ぶ）"""
+        outline, x, y = self._selection_outline, 0, 0
+        if self.floating is not None:
+          floating = self.floating
+          outline, x, y = floating.outline, floating.x, floating.y
+          painter.drawImage(QC.QPointF(x, y), floating.image(self._view_version, self.palette_lut))
+        if self._lasso_points:
+          painter.setPen(QG.QPen(QC.Qt.black, 0))
+          painter.drawPolyline([QC.QPointF(px + 0.5, py + 0.5) for px, py in self._lasso_points])
+        if outline:
+          # 白黒の点線（幅 0 のペンは拡大率によらず 1 ピクセル）
+          painter.translate(x, y)
+          painter.setPen(QG.QPen(QC.Qt.black, 0))
+          painter.drawLines(outline)
+          painter.setPen(QG.QPen(QC.Qt.white, 0, QC.Qt.DashLine))
+          painter.drawLines(outline)
+          painter.translate(-x, -y)
+
+    def _draw_grid(self, painter, cx0, cy0, cx1, cy1):
+        """セル範囲 [cx0, cx1) x [cy0, cy1) に掛かるグリッド線と中心線を描画"""
+        zoom = self.zoom
+        ox, oy = self._offset.x(), self._offset.y()
+        left, right = ox + cx0 * zoom, ox + cx1 * zoom
+        top, bottom = oy + cy0 * zoom, oy + cy1 * zoom
+
+        def lines(step):
+            xs = range(-(-cx0 // step) * step, cx1 + 1, step)
+            ys = range(-(-cy0 // step) * step, cy1 + 1, step)
+            return ([QC.QLineF(ox + i * zoom, top, ox + i * zoom, bottom) for i in xs] +
+                    [QC.QLineF(left, oy + i * zoom, right, oy + i * zoom) for i in ys])
+
+        # 細いグリッド線（線が詰まりすぎる倍率では省略、まとめて 1 回で描画）
+        if self.grid_minor > 0 and self.grid_minor * zoom >= MIN_GRID_SPACING:
           painter.setPen(QC.Qt.gray)
-          for x in range(0, self.width(), self.pixel_size):
-            for y in range(0, self.height(), self.pixel_size):
-                rect = (x, y, self.pixel_size, self.pixel_size)
-                painter.drawRect(*rect)
-
-        # デバッグ: レイヤーごとにポイント描画
-        for layer_name, layer_data in self.layers.items():
-          for pos, color in layer_data.items():
-            if color is None:
-                color = QC.Qt.black  # `None` の場合、デフォルトで黒を設定
-            painter.setPen(QG.QPen(color))
-            painter.drawPoint(*pos)
-
-        # 中心線（show_grid とは別フラグにした方が柔軟かも）
-        if self.show_grid:
-          painter.setPen(QG.QColor(255, 127, 127, 255))
-          center_x = self.width() // 2
-          center_y = self.height() // 2
-          painter.drawLine(center_x, 0, center_x, self.height())
-          painter.drawLine(0, center_y, self.width(), center_y)
-          painter.drawLine(center_x - 1, 0, center_x - 1, self.height())
-          painter.drawLine(0, center_y - 1, self.width(), center_y - 1)
-
-        painter.end()  # QPainter を明示的に終了
+          painter.drawLines(lines(self.grid_minor))
+
+        # 太いグリッド線
+        if self.grid_major > 0 and self.grid_major * zoom >= MIN_GRID_SPACING:
+          painter.setPen(QG.QPen(QC.Qt.darkGray, 2))
+          painter.drawLines(lines(self.grid_major))
+
+        # 中心線
+        painter.setPen(QG.QPen(QG.QColor(255, 127, 127, 255), 2))
+        center_x = ox + self.grid_size * zoom / 2
+        center_y = oy + self.grid_size * zoom / 2
+        painter.drawLines([
+            QC.QLineF(center_x, top, center_x, bottom),
+            QC.QLineF(left, center_y, right, center_y),
+        ])
+
+    def set_grid_spacing(self, minor=None, major=None):
+        """グリッド線の間隔（セル数）を設定"""
+        if minor is not None:
+            self.grid_minor = minor
+        if major is not None:
+            self.grid_major = major
+        self.update()
 
     def clear_canvas(self):
         """キャンバスをクリア"""
-        self.pixels.clear()
-        self.layers = {"background": {}, "foreground": {}}
-        self.update
+        self.save_state()
+        for name, layer in self.layers.items():
+            self._record_cells(name, np.flatnonzero(self._flat_layer(name).any(axis=1)))
+            self._writable_layer(name)[:] = 0
+            self._touch_layer(name)
+        self.commit_state()
+        self._invalidate_composite()
 
     def toggle_grid(self):
         """グリッドの ON/OFF を切り替える"""
@@ -136,71 +737,803 @@ class PixelCanvas(QW.QWidget):
         self.update()
 
     def mousePressEvent(self, event: QG.QMouseEvent):
-        x = (event.pos().x() // self.pixel_size) * self.pixel_size
-        y = (event.pos().y() // self.pixel_size) * self.pixel_size
+        if event.button() == QC.Qt.MiddleButton:  # 中ボタンのドラッグで表示を移動
+            self._pan_anchor = event.position()
+            return
+        self.stop()  # 再生中なら止めてから編集する
+        x, y = self.map_to_grid(event.position())
 
-        if event.button() == QC.Qt.LeftButton:
+        if event.button() == QC.Qt.LeftButton and self.tool == "fill":
+            if self._in_grid(x, y):
+              self.flood_fill(x, y)
+
+        elif event.button() == QC.Qt.LeftButton and self.tool in ("select_rect", "lasso", "wand", "move"):
+            self._selection_press(x, y)
+
+        elif event.button() == QC.Qt.LeftButton:
             self.save_state()  # 変更前の状態を保存
             self.is_drawing = True  # 描画フラグをON
+            self._last_cell = (x, y)
             self.paint_at(x, y)  # 最初の座標を描画
 
         elif event.button() == QC.Qt.RightButton:
-            if (x, y) in self.layers[self.current_layer]:
-              self.set_color(self.layers[self.current_layer][(x, y)])
-
-        self.update()
+            if self._in_grid(x, y):
+              color = self.get_pixel(x, y)
+              if color is not None:
+                self.set_color(color)
 
     def mouseMoveEvent(self, event):
         """マウスが動いたときの処理（ドラッグ時）"""
+        if self._pan_anchor is not None:
+            delta = event.position() - self._pan_anchor
+            self._pan_anchor = event.position()
+            self.pan_by(delta.x(), delta.y())
+            return
+        if self._selection_drag is not None:
+            self._selection_moved(*self.map_to_grid(event.position()))
+            return
         if self.is_drawing:  # フラグがONのときのみ描画
-            x = (event.pos().x() // self.pixel_size) * self.pixel_size
-            y = (event.pos().y() // self.pixel_size) * self.pixel_size
-            self.paint_at(x, y)
+            x, y = self.map_to_grid(event.position())
+            if (x, y) == self._last_cell:
+                return
+            # 前回のセルから直線で補間し、次のフレームでまとめて描画
+            xs, ys = line_cells(*self._last_cell, x, y)
+            self._pending_xs.append(xs[1:])
+            self._pending_ys.append(ys[1:])
+            self._last_cell = (x, y)
+            if not self._stroke_timer.isActive():
+                self._stroke_timer.start()
 
     def mouseReleaseEvent(self, event):
         """マウスが離されたときの処理"""
-        if event.button() == QC.Qt.LeftButton:
+        if event.button() == QC.Qt.MiddleButton:
+            self._pan_anchor = None
+        if event.button() == QC.Qt.LeftButton and self._selection_drag is not None:
+            self._selection_released()
+        if event.button() == QC.Qt.LeftButton and self.is_drawing:
+            self.flush_stroke()
             self.is_drawing = False  # 描画フラグをOFF
+            self._last_cell = None
+            self.commit_state()  # ストローク全体を 1 回分の履歴にする
+
+    def wheelEvent(self, event):
+        """ホイールでマウス位置を中心に拡大・縮小"""
+        steps = event.angleDelta().y() / 120
+        if steps:
+            self.set_zoom(self.zoom * ZOOM_STEP ** steps, event.position())
+
+    def flush_stroke(self):
+        """ドラッグ中にたまったセルを 1 回の書き込みで描画"""
+        self._stroke_timer.stop()
+        if not self._pending_xs:
+            return
+        xs = np.concatenate(self._pending_xs)
+        ys = np.concatenate(self._pending_ys)
+        self._pending_xs.clear()
+        self._pending_ys.clear()
+        self.paint_cells(xs, ys)
 
     def paint_at(self, x,y):
-        """指定座標に色を塗る"""
-        if self.brush_mode == "checker":  # 市松模様モード
-            self.draw_checker_pattern(x, y)
-        elif self.brush_mode == "symmetry":  # 左右対称モード
-            self.draw_symmetric(x, y)
+        """指定グリッド座標に色を塗る"""
+        if not self._in_grid(x, y):
+            return
+        self.paint_cells([x], [y])
+
+    @profiler.timed("stroke")
+    def paint_cells(self, xs, ys):
+        """複数のグリッド座標に現在のブラシでまとめて色を塗る"""
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        inside = (xs >= 0) & (xs < self.grid_size) & (ys >= 0) & (ys < self.grid_size)
+        xs, ys = xs[inside], ys[inside]
+        if xs.size == 0:
+            return
+        # スタンプ・対称変換・模様を適用したセルに 1 回で書き込む（消しゴムは None を書く）
+        self._write_cells(*self.brush_cells(xs, ys), self.current_color)
+
+    def fill_region(self, x, y, mode=None, tolerance=None, sample=None):
+        """ (x, y) の色に一致するセルのマスク (grid, grid) uint8（一致=1）を返す
+
+        mode: contiguous なら (x, y) と上下左右でつながった範囲、global ならレイヤー全体
+        tolerance: RGBA 各成分の差がこの値以下なら同じ色とみなす
+        sample: layer なら現在のレイヤー、merged なら表示中の全レイヤーの合成結果で判定
+        """
+        mode = mode or self.fill_mode
+        tolerance = self.fill_tolerance if tolerance is None else tolerance
+        sample = sample or self.fill_sample
+        if sample == "merged":
+            image = composite_region(self.layers, self.layer_visibility, 0, self.grid_size,
+                                     0, self.grid_size, opacity=self.layer_opacity, blend=self.layer_blend,
+                                     palette=self.palette_lut)
         else:
-            if self.current_color is not None:
-                self.layers[self.current_layer][(x, y)] = self.current_color
-            elif (x, y) in self.layers[self.current_layer]:  # 消しゴム
-                self.erase_pixel(x, y)
-
-        self.update()  # 再描画
+            image = np.asarray(self.layers[self.current_layer])
+        if image.ndim == 2:
+            # インデックスカラー: 一致する色表の番号を求めてから、色表を引くだけでマスクにする
+            seed = self.palette_lut[image[y, x]].astype(np.int16)
+            near = np.abs(self.palette_lut.astype(np.int16) - seed).max(axis=1) <= tolerance
+            match = (near.astype(np.uint8) * 255)[image]
+        else:
+            seed = image[y, x].astype(np.int16)
+            match = None
+        lower = np.clip(seed - tolerance, 0, 255).astype(np.float64)
+        upper = np.clip(seed + tolerance, 0, 255).astype(np.float64)
+        if match is None:
+            match = cv2.inRange(image, lower, upper)  # 一致するセルが 255
+        if mode == "global":
+            return match // 255
+        # 一致するセルだけをたどるスキャンライン塗りつぶし（4 近傍、結果はマスクに書かれる）
+        mask = np.zeros((self.grid_size + 2, self.grid_size + 2), dtype=np.uint8)
+        cv2.floodFill(match, mask, (int(x), int(y)), 0, 0, 0,
+                      4 | cv2.FLOODFILL_MASK_ONLY | (1 << 8))
+        return mask[1:-1, 1:-1]
+
+    @staticmethod
+    def _cells(layer):
+        """1 セルを 1 要素として見たビュー（RGBA は 4 バイトを uint32 として見る）"""
+        if layer.ndim == 2:
+            return layer.reshape(-1)
+        return layer.reshape(-1, 4).view(np.uint32)[:, 0]
+
+    @profiler.timed("fill")
+    def flood_fill(self, x, y, color=None, mode=None, tolerance=None, sample=None):
+        """バケツ塗りつぶし（1 回のアンドゥで元に戻せる）"""
+        layer_name = self.current_layer
+        if not self._in_grid(x, y) or self.layer_lock.get(layer_name, False):
+            return
+        self.save_state()  # 色表に追加する色も同じ 1 回に記録する
+        value = self._color_value(self.current_color if color is None else color)
+        region = self.fill_region(x, y, mode, tolerance, sample)
+        if value.ndim:
+            value = value.view(np.uint32)[0]
+        # すでに塗る色になっているセルは書き換えない
+        index = np.flatnonzero(region.reshape(-1).view(bool) & (self._cells(self.layers[layer_name]) != value))
+        if index.size == 0:
+            self.commit_state()
+            return
+        self._record_cells(layer_name, index)
+        self._cells(self._writable_layer(layer_name))[index] = value
+        self._touch_layer(layer_name)
+        self.commit_state()
+        ys, xs = np.divmod(index, self.grid_size)
+        self._mark_dirty(xs.min(), ys.min(), xs.max() + 1, ys.max() + 1)
 
     def set_color(self, color):
         """スポイトで取得した色を設定"""
         self.current_color = color
-        print(f"現在の色: {color}")  # デバッグ用
+        logger.debug("現在の色: %s", color)
 
     def save_state(self):
-        """現在のピクセルの状態を履歴に保存"""
-        self.history.append(self.layers[self.current_layer].copy())
-        self.future.clear()  # 新しい操作をしたらリドゥ履歴をクリア
+        """変更の記録を開始（commit_state までの変更が 1 回のアンドゥになる）"""
+        self.commit_state()
+        self._stroke = {}
+        self._stroke_palette = self.palette_count
+
+    def _record_cells(self, layer_name, index):
+        """記録中なら、初めて変更されるセルの変更前の値を保存"""
+        if self._stroke is None:
+            return
+        flat = self._flat_layer(layer_name)
+        entry = self._stroke.get(layer_name)
+        if entry is None:
+            entry = self._stroke[layer_name] = (np.zeros(flat.shape[0], dtype=bool), [], [])
+        recorded, indices, befores = entry
+        index = np.asarray(index)
+        index = index[~recorded[index]]
+        if index.size > 1 and not np.all(index[1:] > index[:-1]):
+            # 重複を除く（np.unique より、ソートして隣と比べる方が大きな範囲で速い）
+            index = np.sort(index)
+            index = index[np.concatenate(([True], index[1:] != index[:-1]))]
+        if index.size:
+            recorded[index] = True
+            indices.append(index)
+            befores.append(take_rows(flat, index))
+
+    def commit_state(self):
+        """記録中の変更を、変化したセルだけの履歴として確定（浮いている選択範囲もここで書き込む）"""
+        if self.floating is not None:
+            self._anchor_floating()
+        stroke, self._stroke = self._stroke, None
+        if stroke is None:
+            return
+        records = self._palette_growth(self._stroke_palette)  # 塗った色で色表に追加した分も同じ 1 回にする
+        for name, (_, indices, befores) in stroke.items():
+            if not indices or name not in self.layers:
+                continue
+            record = cell_delta(name, self.layers[name], np.concatenate(indices), np.concatenate(befores),
+                                self.frames[self.current_frame])
+            if record is not None:
+                records.append(record)
+        self.history.push(records)
+        while self._finished_imports:
+            self._apply_import(*self._finished_imports.pop(0))
+
+    def _palette_growth(self, count):
+        """色数 count から色表に追加された色を元に戻せる記録（追加していなければ空のリスト）"""
+        if self.palette_count <= count:
+            return []
+        after = self.palette_lut[count:self.palette_count].copy()
+        return [PaletteChanged(count, np.zeros_like(after), after, count)]
+
+    def _push_history(self, record):
+        """レイヤー操作を 1 回分の履歴として追加"""
+        self.commit_state()
+        self.history.push([record])
 
     def undo(self):
         """アンドゥ（元に戻す）"""
-        if self.history:
-            self.future.append(
-                self.layers[self.current_layer].copy())  # 現在の状態をリドゥ用に保存
-            self.layers[self.current_layer] = self.history.pop()  # 直前の状態を復元
-            self.update()
+        self.commit_state()
+        self.history.undo(self)
 
     def redo(self):
         """リドゥ（やり直す）"""
-        if self.future:
-            self.history.append(self.layers[self.current_layer].copy())  # 現在の状態をアンドゥ用に保存
-            self.layers[self.current_layer] = self.future.pop()  # 直後の状態を復元
+        self.commit_state()
+        self.history.redo(self)
+
+    def _flat_layer(self, layer_name):
+        """レイヤーを (セル数, チャンネル数) のビューとして返す"""
+        layer = self.layers[layer_name]
+        return layer.reshape(layer.shape[0] * layer.shape[1], -1)
+
+    def _restore_cells(self, layer_name, index, values, frame=None):
+        """履歴からセルの値を書き戻す（別のフレームの変更ならそのフレームを表示する）"""
+        if frame is not None and frame is not self.frames[self.current_frame]:
+            if frame not in self.frames:  # 削除済みのフレーム（フレーム操作のアンドゥで戻る）
+                layer = frame.writable_layer(layer_name)
+                layer.reshape(layer.shape[0] * layer.shape[1], -1)[index] = values
+                self._touch_layer(layer_name, frame)
+                return
+            self.set_frame(self.frames.index(frame))
+        layer = self._writable_layer(layer_name)
+        layer.reshape(layer.shape[0] * layer.shape[1], -1)[index] = values
+        self._touch_layer(layer_name)
+        if index.size:
+            ys, xs = np.divmod(index, self.grid_size)
+            self._mark_dirty(xs.min(), ys.min(), xs.max() + 1, ys.max() + 1)
+
+    # ----- 選択範囲 -----
+
+    def set_selection(self, mask):
+        """選択範囲を設定（None や空のマスクなら解除）。浮いている内容は先に確定する"""
+        self.commit_state()
+        self._set_selection(mask)
+
+    def _set_selection(self, mask):
+        if mask is not None and not mask.any():
+            mask = None
+        self.selection = mask
+        self._selection_outline = [] if mask is None else mask_outline(mask)
+        self.update()
+
+    def _drop_selection(self):
+        """キャンバスの作り直しなどで、選択範囲とドラッグ中の状態を捨てる"""
+        self.floating = None
+        self._selection_drag = None
+        self._lasso_points = []
+        self._set_selection(None)
+
+    def select_rect(self, x0, y0, x1, y1):
+        """2 つの角のセル（両端を含む）で囲んだ矩形を選択"""
+        self.set_selection(rect_mask(self.grid_size, x0, y0, x1, y1))
+
+    def select_lasso(self, points):
+        """セルの列 [(x, y), ...] で囲んだ範囲を選択"""
+        self.set_selection(lasso_mask(self.grid_size, points))
+
+    def select_wand(self, x, y, mode=None, tolerance=None, sample=None):
+        """(x, y) と同じ色の範囲を選択（判定は塗りつぶしと同じ設定）"""
+        if self._in_grid(x, y):
+            self.set_selection(self.fill_region(x, y, mode, tolerance, sample).view(bool))
+
+    def select_all(self):
+        self.set_selection(np.ones((self.grid_size, self.grid_size), dtype=bool))
+
+    def clear_selection(self):
+        self.set_selection(None)
+
+    def _selection_block(self):
+        """選択範囲の外接矩形の (スライス, 矩形内のマスク, x0, y0)"""
+        x0, y0, x1, y1 = mask_bounds(self.selection)
+        return (slice(y0, y1), slice(x0, x1)), self.selection[y0:y1, x0:x1], x0, y0
+
+    def copy_selection(self):
+        """選択範囲（浮いていればその内容）をクリップボードにコピー。コピーしたら True"""
+        if self.floating is not None:
+            floating = self.floating
+            pixels, mask, x, y = floating.pixels, floating.mask, floating.x, floating.y
+        elif self.selection is not None:
+            block, mask, x, y = self._selection_block()
+            pixels = self.layers[self.current_layer][block]
+        else:
+            return False
+        # 色の形式を切り替えても貼り付けられるよう RGBA で持つ
+        rgba = self.palette_lut[pixels] if pixels.ndim == 2 else pixels.copy()
+        self.clipboard = (rgba, mask.copy(), x, y)
+        return True
+
+    def cut_selection(self):
+        """選択範囲をクリップボードにコピーしてから消す"""
+        if self.copy_selection():
+            self.delete_selection()
+
+    def delete_selection(self):
+        """選択範囲のセルを透明にする（浮いている内容は捨てる）"""
+        if self.floating is not None:
+            self.floating = None  # 切り取った元のセルは消えたまま確定
+            self.commit_state()
+            self._set_selection(None)
+            return
+        name = self.current_layer
+        if self.selection is None or self.layer_lock.get(name, False):
+            return
+        block, mask, x, y = self._selection_block()
+        erase = mask & opaque_cells(self.layers[name][block])
+        ys, xs = np.nonzero(erase)
+        if ys.size == 0:
+            return
+        self.save_state()
+        self._record_cells(name, (ys + y) * self.grid_size + (xs + x))
+        self._writable_layer(name)[block][erase] = 0
+        self._touch_layer(name)
+        self.commit_state()
+        self._mark_dirty(x + xs.min(), y + ys.min(), x + xs.max() + 1, y + ys.max() + 1)
+
+    def lift_selection(self):
+        """ 選択範囲の内容を浮かせる（元のセルは透明にして、内容は確定するまで表示だけ重ねる）
+
+        浮かせてから確定するまでが 1 回のアンドゥになる。浮かせたら True
+        """
+        if self.floating is not None:
+            return True
+        name = self.current_layer
+        if self.selection is None or self.layer_lock.get(name, False):
+            return False
+        block, mask, x, y = self._selection_block()
+        self.save_state()
+        pixels = self.layers[name][block].copy()
+        cut = mask & opaque_cells(pixels)
+        ys, xs = np.nonzero(cut)
+        if ys.size:
+            self._record_cells(name, (ys + y) * self.grid_size + (xs + x))
+            self._writable_layer(name)[block][cut] = 0
+            self._touch_layer(name)
+            self._mark_dirty(x + xs.min(), y + ys.min(), x + xs.max() + 1, y + ys.max() + 1)
+        self.floating = FloatingSelection(pixels, mask.copy(), x, y, name, origin=(x, y))
+        self._set_selection(None)
+        return True
+
+    def paste(self, x=None, y=None):
+        """クリップボードの内容を浮いた状態で貼り付ける（位置を省略するとコピー元と同じ位置）"""
+        if self.clipboard is None or self.layer_lock.get(self.current_layer, False):
+            return
+        rgba, mask, cx, cy = self.clipboard
+        self.save_state()  # 前に浮いていた内容はここで確定
+        pixels = self.rgba_to_indices(rgba) if self.indexed else rgba.copy()
+        self.floating = FloatingSelection(pixels, mask, cx if x is None else x, cy if y is None else y,
+                                          self.current_layer)
+        self._set_selection(None)
+
+    def move_selection(self, dx, dy):
+        """選択範囲の内容を (dx, dy) セル動かす（浮いていなければ浮かせてから）"""
+        if self.lift_selection() and self.floating.move_to(self.floating.x + dx, self.floating.y + dy):
             self.update()
 
+    def anchor_selection(self):
+        """浮いている内容をレイヤーに書き込んで確定（切り取りから確定までが 1 回のアンドゥ）"""
+        self.commit_state()
+
+    def cancel_floating(self):
+        """浮いている内容を取り消す（切り取ったものは元の位置に戻す）"""
+        floating = self.floating
+        if floating is None:
+            return
+        if floating.origin is None:
+            self.floating = None
+        else:
+            floating.move_to(*floating.origin)
+        self.commit_state()
+        if floating.origin is None:
+            self._set_selection(None)
+
+    def _anchor_floating(self):
+        """浮いている内容を記録中の変更としてレイヤーに書き込み、置いた範囲を選択範囲にする"""
+        floating, self.floating = self.floating, None
+        if self._stroke is None:
+            self._stroke = {}
+        clipped = floating.clipped(self.grid_size)
+        mask = np.zeros((self.grid_size, self.grid_size), dtype=bool)
+        name = floating.layer_name
+        if clipped is not None and name in self.layers:
+            dest, src = clipped
+            mask[dest] = floating.mask[src]
+            # 透明なセルは書き込まない（下の絵に穴を開けない）
+            write = floating.mask[src] & opaque_cells(floating.pixels[src])
+            ys, xs = np.nonzero(write)
+            if ys.size:
+                y0, x0 = dest[0].start, dest[1].start
+                self._record_cells(name, (ys + y0) * self.grid_size + (xs + x0))
+                self._writable_layer(name)[dest][write] = floating.pixels[src][write]
+                self._touch_layer(name)
+                self._mark_dirty(x0 + xs.min(), y0 + ys.min(), x0 + xs.max() + 1, y0 + ys.max() + 1)
+        self._set_selection(mask)
+
+    def deselect(self):
+        """Esc: 浮いている内容があれば取り消し、なければ選択を解除"""
+        if self.floating is not None:
+            self.cancel_floating()
+        else:
+            self.clear_selection()
+
+    def _selection_press(self, x, y):
+        if self.tool == "wand":
+            self.select_wand(x, y)
+        elif self.tool == "move":
+            # どこを掴んでも、浮いている内容を同じだけ動かす
+            if self.lift_selection():
+                self._selection_drag = ("move", x - self.floating.x, y - self.floating.y)
+        elif self.tool == "lasso":
+            self.commit_state()
+            self._lasso_points = [(x, y)]
+            self._selection_drag = ("lasso", x, y)
+        else:
+            self.select_rect(x, y, x, y)
+            self._selection_drag = ("select_rect", x, y)
+
+    def _selection_moved(self, x, y):
+        tool, ax, ay = self._selection_drag
+        if tool == "move":
+            if self.floating is not None and self.floating.move_to(x - ax, y - ay):
+                self.update()  # レイヤーは書き換えず、重ねて表示する位置だけ変える
+        elif tool == "lasso":
+            if self._lasso_points[-1] != (x, y):
+                self._lasso_points.append((x, y))
+                self.update()
+        else:
+            self._set_selection(rect_mask(self.grid_size, ax, ay, x, y))
+
+    def _selection_released(self):
+        tool = self._selection_drag[0]
+        self._selection_drag = None
+        if tool == "lasso":
+            points, self._lasso_points = self._lasso_points, []
+            self.select_lasso(points)
+
+    # ----- アニメーション -----
+
+    def set_frame(self, index):
+        """表示・編集するフレームを切り替える"""
+        index = min(max(index, 0), len(self.frames) - 1)
+        if index == self.current_frame:
+            return
+        self.flush_stroke()
+        self.commit_state()
+        self.current_frame = index
+        self._pack_frames()
+        self._invalidate_composite()
+        self.frames_changed.emit()
+
+    def _set_frames(self, frames, current):
+        kept = {id(frame) for frame in frames}
+        for frame in self.frames:
+            if id(frame) not in kept:
+                frame.release_image()  # 履歴に残るだけのフレームは画像を持たない
+        self.frames = list(frames)
+        self.current_frame = min(max(current, 0), len(self.frames) - 1)
+        self._pack_frames()
+        self._invalidate_composite()
+        self.frames_changed.emit()
+
+    def _change_frames(self, frames, current):
+        """フレームのリストを置き換えて 1 回分の履歴にする"""
+        self.flush_stroke()
+        self.commit_state()
+        record = FramesChanged(self.frames, frames, self.current_frame, current)
+        self._set_frames(frames, current)
+        self._push_history(record)
+
+    def add_frame(self):
+        """表示中のフレームの後ろに空のフレームを追加"""
+        blank = self._new_layer()
+        blank.flags.writeable = False  # 空のレイヤーは書き込むまで共有
+        frame = Frame({name: blank for name in self.layers})
+        for name in frame.layers:
+            self._touch_layer(name, frame)
+        frames = list(self.frames)
+        frames.insert(self.current_frame + 1, frame)
+        self._change_frames(frames, self.current_frame + 1)
+
+    def duplicate_frame(self):
+        """表示中のフレームを複製（内容は書き込むまで共有）"""
+        self.commit_state()
+        frames = list(self.frames)
+        frames.insert(self.current_frame + 1, self.frames[self.current_frame].duplicate())
+        self._change_frames(frames, self.current_frame + 1)
+
+    def delete_frame(self):
+        """表示中のフレームを削除（最後の 1 枚は残す）"""
+        if len(self.frames) > 1:
+            frames = list(self.frames)
+            del frames[self.current_frame]
+            self._change_frames(frames, min(self.current_frame, len(frames) - 1))
+
+    def move_frame(self, index, new_index):
+        """フレームの順番を変える"""
+        new_index = min(max(new_index, 0), len(self.frames) - 1)
+        if index != new_index and 0 <= index < len(self.frames):
+            frames = list(self.frames)
+            frames.insert(new_index, frames.pop(index))
+            current = frames.index(self.frames[self.current_frame])
+            self._change_frames(frames, current)
+
+    def frame_image(self, index):
+        """フレームを合成した QImage（透明背景、内容が変わるまでキャッシュ）"""
+        return self.frames[index].image(self._view_version, self.layer_visibility, self.layer_opacity,
+                                        self.layer_blend, self.palette_lut)
+
+    def set_onion_skin(self, count):
+        """前後に重ねて表示するフレーム数（0 で非表示）"""
+        self.onion_skin = max(int(count), 0)
+        self._release_frame_images()
+        self.update()
+
+    def set_fps(self, fps):
+        self.fps = max(int(fps), 1)
+        if self._playback_timer.isActive():
+            self._playback_timer.setInterval(round(1000 / self.fps))
+
+    def is_playing(self):
+        return self._playback_frame is not None
+
+    def play(self):
+        """表示中のフレームから再生（PLAYBACK_IMAGE_BUDGET に収まる分だけ先に合成しておく）"""
+        self.flush_stroke()
+        self.commit_state()
+        count = min(len(self.frames), max(PLAYBACK_IMAGE_BUDGET // (self.grid_size ** 2 * 4), 1))
+        self._playback_cached = {(self.current_frame + offset) % len(self.frames) for offset in range(count)}
+        for index in self._playback_cached:
+            self.frame_image(index)
+        self._playback_frame = self.current_frame
+        self._playback_timer.start(round(1000 / self.fps))
+        self.update()
+        self.playback_changed.emit(True)
+
+    def stop(self):
+        """再生を止めて、編集中のフレームの表示に戻す"""
+        if self._playback_frame is None:
+            return
+        self._playback_timer.stop()
+        self._playback_frame = None
+        self._playback_cached = set()
+        self._release_frame_images()
+        self.update()
+        self.playback_changed.emit(False)
+
+    def _advance_playback(self):
+        shown = self._playback_frame
+        if shown not in self._playback_cached and shown < len(self.frames):
+            self.frames[shown].release_image()  # 予算の外のフレームは表示し終えたら手放す
+        self._playback_frame = (shown + 1) % len(self.frames)
+        profiler.mark("playback")
+        self.update()
+
+    # ----- インデックスカラー -----
+
+    def palette_colors(self):
+        """色表の色（0 番の透明を除く）を QColor のリストで返す"""
+        return [QG.QColor(*(int(v) for v in rgba)) for rgba in self.palette_lut[1:self.palette_count]]
+
+    def palette_index(self, color, add=True):
+        """ 色の色表の番号を返す（透明・None は 0）
+
+        色表にない色は add=True なら末尾に追加し、満杯なら最も近い色の番号を返す
+        """
+        rgba = self._color_to_rgba(color)
+        if rgba[3] == 0:
+            return 0
+        used = self.palette_lut[1:self.palette_count]
+        found = np.flatnonzero(used.view(np.uint32)[:, 0] == rgba.view(np.uint32)[0])
+        if found.size:
+            return int(found[0]) + 1
+        if add and self.palette_count < PALETTE_SIZE:
+            self._set_palette_entries(self.palette_count, rgba[None])
+            return self.palette_count - 1
+        return int(self._nearest_palette_index(rgba[None])[0])
+
+    def add_palette_color(self, color):
+        """色表に色を追加（すでにあれば何もしない）して番号を返す"""
+        self.commit_state()
+        count = self.palette_count
+        index = self.palette_index(color, add=True)
+        self.history.push(self._palette_growth(count))
+        return index
+
+    def _nearest_palette_index(self, colors):
+        """RGBA 配列 (n, 4) のそれぞれに最も近い色表の番号（1 番以降）"""
+        used = self.palette_lut[1:self.palette_count].astype(np.float32)
+        if used.shape[0] == 0:
+            return np.zeros(len(colors), dtype=np.uint8)
+        # |c - p|^2 = |c|^2 - 2 c・p + |p|^2 の |c|^2 は比較に影響しないので省き、行列積で求める
+        result = np.empty(len(colors), dtype=np.uint8)
+        norms = (used ** 2).sum(axis=1)
+        weights = -2.0 * used.T
+        for start in range(0, len(colors), 16384):  # 距離の表が大きくなりすぎないよう分割
+            scores = colors[start:start + 16384].astype(np.float32) @ weights
+            scores += norms
+            result[start:start + 16384] = scores.argmin(axis=1) + 1
+        return result
+
+    def rgba_to_indices(self, rgba):
+        """ RGBA 配列 (..., 4) を色表の番号の配列に変換
+
+        色表にない色は多く使われているものから色表に追加し、入りきらない色は最も近い色にする
+        """
+        words = np.ascontiguousarray(rgba).reshape(-1, 4).view(np.uint32)[:, 0]
+        colors, inverse, counts = np.unique(words, return_inverse=True, return_counts=True)
+        colors = colors.view(np.uint8).reshape(-1, 4)
+        indices = np.zeros(len(colors), dtype=np.uint8)  # 透明は 0 番
+
+        # すでに色表にある色（色表は最大 256 色なので、ソートして二分探索）
+        opaque = colors[:, 3] > 0
+        known = np.zeros(len(colors), dtype=bool)
+        lut_words = self.palette_lut[1:self.palette_count].view(np.uint32)[:, 0]
+        if lut_words.size:
+            order = np.argsort(lut_words)
+            position = np.minimum(np.searchsorted(lut_words[order], colors.view(np.uint32)[:, 0]),
+                                  lut_words.size - 1)
+            known = opaque & (lut_words[order][position] == colors.view(np.uint32)[:, 0])
+            indices[known] = order[position[known]] + 1
+
+        missing = np.flatnonzero(opaque & ~known)
+        missing = missing[np.argsort(-counts[missing], kind="stable")]
+        room = PALETTE_SIZE - self.palette_count
+        added, rest = missing[:room], missing[room:]
+        if added.size:
+            start = self.palette_count
+            self._set_palette_entries(start, colors[added])
+            indices[added] = np.arange(start, start + added.size)
+        if rest.size:
+            indices[rest] = self._nearest_palette_index(colors[rest])
+        return indices[inverse.reshape(-1)].reshape(rgba.shape[:-1])
+
+    def set_indexed(self, enabled, colors=()):
+        """ インデックスカラーモードの切り替え（全レイヤーを一括で変換、履歴は消去）
+
+        colors: インデックスカラーにするとき、先に色表に入れておく色（エディタのパレット）
+        """
+        enabled = bool(enabled)
+        if enabled == self.indexed:
+            return
+        self.commit_state()
+        if enabled:
+            self.palette_lut[:] = 0
+            self.palette_count = 1
+            for color in colors:
+                self.palette_index(color)
+            convert = lambda layer: self.rgba_to_indices(np.asarray(layer))
+        else:
+            convert = lambda layer: self.palette_lut[layer]
+        converted = {}  # フレーム間で共有している配列は 1 回だけ変換し、共有を保つ
+        for frame in self.frames:
+            for name, layer in frame.layers.items():
+                frame.layers[name] = mapped_layer(layer, convert, converted)
+                self._touch_layer(name, frame)
+        self.indexed = enabled
+        self.history.clear()
+        self._invalidate_composite()
+        self.palette_changed.emit()
+
+    def _set_palette_entries(self, start, values, count=None):
+        """色表の start 番から values (n, 4) を書き込む（レイヤーの配列はそのまま、count で色数を戻す）"""
+        in_use = start < self.palette_count  # 追加だけならどのセルの色も変わらない
+        self.palette_lut[start:start + len(values)] = values
+        self.palette_count = max(self.palette_count, start + len(values)) if count is None else count
+        if self.indexed and in_use:
+            self._view_version += 1
+            self._invalidate_composite()
+        self.palette_changed.emit()
+
+    def _change_palette(self, start, after):
+        before = self.palette_lut[start:start + len(after)].copy()
+        self._set_palette_entries(start, after)
+        self._push_history(PaletteChanged(start, before, np.array(after, dtype=np.uint8)))
+
+    def set_palette_color(self, index, color):
+        """色表の index 番の色を変更（その色で塗ったセルがすべて変わる）"""
+        if 1 <= index < self.palette_count:
+            self._change_palette(index, self._color_to_rgba(color)[None])
+
+    def replace_color(self, old_color, new_color):
+        """色表にある old_color を new_color に置き換える（色表になければ何もしない）"""
+        if not self.indexed:
+            return
+        index = self.palette_index(old_color, add=False)
+        if index and np.array_equal(self.palette_lut[index], self._color_to_rgba(old_color)):
+            self.set_palette_color(index, new_color)
+
+    def cycle_palette(self, first, last, step=1):
+        """色表の first〜last 番を step だけ回転（カラーサイクル）"""
+        first, last = max(first, 1), min(last, self.palette_count - 1)
+        if last > first:
+            self._change_palette(first, np.roll(self.palette_lut[first:last + 1], step, axis=0))
+
+    # レイヤー名をキーに持つ属性の辞書と、その既定値
+    LAYER_PROPERTY_DEFAULTS = {"visible": True, "locked": False, "opacity": 1.0, "blend": "normal"}
+
+    def _layer_property_dicts(self):
+        return {"visible": self.layer_visibility, "locked": self.layer_lock,
+                "opacity": self.layer_opacity, "blend": self.layer_blend}
+
+    def _insert_layer(self, name, position, properties=None, frame_arrays=None):
+        """ 指定位置にレイヤーを挿入
+
+        frame_arrays: {フレーム: 配列}（フレームそのもので対応付ける）。含まれないフレームには空のレイヤー
+        """
+        frame_arrays = frame_arrays or {}
+        blank = None
+        for frame in self.frames:
+          if frame in frame_arrays:
+            layer = frame_arrays[frame]
+          else:
+            if blank is None:  # 空のレイヤーは全フレームで共有
+              blank = self._new_layer()
+              blank.flags.writeable = False
+            layer = blank
+          items = list(frame.layers.items())
+          items.insert(position, (name, layer))
+          frame.layers = dict(items)
+          self._touch_layer(name, frame)
+        properties = properties or {}
+        for key, values in self._layer_property_dicts().items():
+          values[name] = properties.get(key, self.LAYER_PROPERTY_DEFAULTS[key])
+        self._invalidate_composite()
+        self.layers_changed.emit()
+
+    def _remove_layer(self, name):
+        """ レイヤーを取り除き、復元用に (位置, 属性, {フレーム: 配列}) を返す
+
+        表示中のフレームも含め、配列は持っていたフレームごとに返す（戻すときに別のフレームに入らないように）
+        """
+        position = list(self.layers).index(name)
+        frame_arrays = {}
+        for frame in self.frames:
+          if name in frame.layers:
+            frame_arrays[frame] = frame.layers.pop(name)
+            frame.revision.pop(name, None)
+        properties = {key: values.pop(name, self.LAYER_PROPERTY_DEFAULTS[key])
+                      for key, values in self._layer_property_dicts().items()}
+        if self.current_layer == name:
+          self.current_layer = next(reversed(self.layers))
+        self._invalidate_composite()
+        self.layers_changed.emit()
+        return position, properties, frame_arrays
+
+    def _set_layer_property(self, name, key, value):
+        """レイヤーの属性を変更（合成し直す）"""
+        self._layer_property_dicts()[key][name] = value
+        self._view_version += 1
+        self._invalidate_composite()
+        if key in ("visible", "locked"):
+            self.layers_changed.emit()  # レイヤーリストのボタンに反映
+
+    def _set_layer_order(self, order):
+        """レイヤーの並び順を変更"""
+        for frame in self.frames:
+          frame.layers = {name: frame.layers[name] for name in order if name in frame.layers}
+        self._invalidate_composite()
+        self.layers_changed.emit()
+
+    def _rename_layer(self, old_name, new_name):
+        # 描画順を保ったまま名前だけ変更
+        for frame in self.frames:
+          frame.layers = {new_name if name == old_name else name: layer
+                          for name, layer in frame.layers.items()}
+          frame.revision[new_name] = frame.revision.pop(old_name, 0)
+        for key, values in self._layer_property_dicts().items():
+          values[new_name] = values.pop(old_name, self.LAYER_PROPERTY_DEFAULTS[key])
+        self._invalidate_composite()
+        if self.current_layer == old_name:
+          self.current_layer = new_name
+        self.layers_changed.emit()
+
     def set_layer(self, layer):
       """描画するレイヤーを変更"""
       if layer in self.layers:
@@ -209,87 +1542,135 @@ class PixelCanvas(QW.QWidget):
     def add_layer(self, layer_name):
       """新しいレイヤーを追加"""
       if layer_name not in self.layers:
-        self.layers[layer_name] = {}
-        self.layer_visibility[layer_name] = True  # デフォルトで表示
-        self.layer_lock[layer_name] = False  # デフォルトで編集可能
-
-      # DotEditor に更新を伝える
-      self.parent().update_layer_list()
-      self.layer_list_widget.add_layer_item(layer_name)  # リストに追加
+        self._insert_layer(layer_name, len(self.layers),
+                           frame_arrays={self.frames[self.current_frame]: self._new_layer()})
+        self._push_history(LayerAdded(layer_name, len(self.layers) - 1))
 
     def delete_layer(self, layer_name):
       """レイヤーを削除"""
       if layer_name in self.layers and len(self.layers) > 1:
-        del self.layers[layer_name]
+        self.commit_state()
+        self._push_history(LayerDeleted(layer_name, self._remove_layer(layer_name)))
+
+    def reorder_layers(self, new_order):
+      """レイヤーの並び順を変更"""
+      before = list(self.layers)
+      self._set_layer_order(new_order)
+      if list(self.layers) != before:
+        self._push_history(LayerOrderChanged(before, self.layers))
 
     def move_layer_to_front(self, layer_name):
       """指定したレイヤーを前面に移動"""
       if layer_name in self.layers:
-        layer = self.layers.pop(layer_name)
-        self.layers = {layer_name: layer, **self.layers}
+        self.reorder_layers([layer_name] + [name for name in self.layers if name != layer_name])
 
     def move_layer_to_back(self, layer_name):
       """指定したレイヤーを背面に移動"""
       if layer_name in self.layers:
-        layer = self.layers.pop(layer_name)
-        self.layers[layer_name] = layer
+        self.reorder_layers([name for name in self.layers if name != layer_name] + [layer_name])
 
     def set_layer_opacity(self, layer_name, opacity):
-      """指定したレイヤーの透明度を設定"""
+      """指定したレイヤーの透明度を設定（ピクセルは書き換えず、合成時に適用）"""
       if layer_name in self.layers:
-        for key, color in self.layers[layer_name].items():
-            new_color = color.withAlphaF(opacity)
-            self.layers[layer_name][key] = new_color
+        self._change_layer_property(layer_name, "opacity", float(min(max(opacity, 0.0), 1.0)))
+
+    def set_layer_blend_mode(self, layer_name, mode):
+      """指定したレイヤーのブレンドモードを設定（normal, multiply, add, screen）"""
+      if layer_name in self.layers and mode in BLEND_MODES:
+        self._change_layer_property(layer_name, "blend", mode)
+
+    def _change_layer_property(self, layer_name, key, value):
+      before = self._layer_property_dicts()[key].get(layer_name, self.LAYER_PROPERTY_DEFAULTS[key])
+      if before == value:
+        return
+      self._set_layer_property(layer_name, key, value)
+      # スライダーを動かし続けた場合も履歴は 1 つにまとめる
+      self.commit_state()
+      self.history.push([LayerPropertyChanged(layer_name, key, before, value)], merge=True)
 
     def toggle_layer_visibility(self, layer_name):
       """レイヤーの表示/非表示を切り替え"""
       if layer_name in self.layer_visibility:
         self.layer_visibility[layer_name] = not self.layer_visibility[layer_name]
-        self.update()  # 再描画して反映
+        self._view_version += 1
+        self._invalidate_composite()  # 再描画して反映
+
+    def toggle_layer_lock(self, layer_name):
+      """レイヤーのロック/解除を切り替え（ロック中は描画・塗りつぶしを受け付けない）"""
+      if layer_name in self.layers:
+        self.layer_lock[layer_name] = not self.layer_lock.get(layer_name, False)
+      return self.layer_lock.get(layer_name, False)
 
     def rename_layer(self, old_name, new_name):
       """レイヤー名を変更"""
       if old_name in self.layers and new_name not in self.layers:
-        self.layers[new_name] = self.layers.pop(old_name)
-
-    def draw_checker_pattern(self, x, y):
-        """市松模様を描画"""
-        base_x = (x // self.pixel_size) * self.pixel_size
-        base_y = (y // self.pixel_size) * self.pixel_size
-
-        for i in range(2):
-          for j in range(2):
-            grid_x = base_x + i * self.pixel_size
-            grid_y = base_y + j * self.pixel_size
-            if ((grid_x // self.pixel_size) + (grid_y // self.pixel_size)) % 2 == 0:
-                self.layers[self.current_layer][(
-                    grid_x, grid_y)] = self.current_color
-
-        self.update()
-
-    def draw_symmetric(self, x, y):
-        """左右対称にドットを描画（補正版）"""
-        canvas_width = self.width() // self.pixel_size  # ピクセル単位でキャンバスの幅を取得
-        canvas_height = self.height() // self.pixel_size  # ピクセル単位でキャンバスの高さを取得
-
-        mirrored_x = (canvas_width - 1 - (x // self.pixel_size)) * self.pixel_size
-        mirrored_y = (canvas_height - 1 - (y // self.pixel_size)) * self.pixel_size
-
-        print(f"クリック座標: {x}, {y}")
-        print(f"左右対称の座標: {mirrored_x}, {y} と {x}, {mirrored_y}")
-        print(f"対角対称の座標: {mirrored_x}, {mirrored_y}")
-        print(
-            f"描画対象座標: ({x}, {y}), ミラー座標: ({mirrored_x}, {y}), ({x}, {mirrored_y}), ({mirrored_x}, {mirrored_y})")
-        self.layers[self.current_layer][(x, y)] = self.current_color
-        self.layers[self.current_layer][(mirrored_x, y)] = self.current_color
-        self.layers[self.current_layer][(x, mirrored_y)] = self.current_color
-        self.layers[self.current_layer][(mirrored_x, mirrored_y)] = self.current_color
-        
-        print("Calling self.update()")  # 確認用
-        self.update()
-        
-
-    def get_crop_rect(self, pixmap):
+        self._rename_layer(old_name, new_name)
+        self._push_history(LayerRenamed(old_name, new_name))
+
+    # ----- 変形 -----
+
+    def transform_layer(self, op, amount=None, layer_name=None):
+      """ レイヤーを反転・回転・ずらす（表示中のフレームのみ）
+
+      op: flip_h, flip_v, rotate（amount は時計回りの 90 度の回数）, shift（amount は (dx, dy)、はみ出た分は反対側へ）
+      """
+      layer_name = layer_name or self.current_layer
+      if op == "scale":
+        raise ValueError("レイヤーの拡大縮小は scale_layer を使ってください")
+      if layer_name not in self.layers or self.layer_lock.get(layer_name, False):
+        return
+      self.commit_state()
+      frame = self.frames[self.current_frame]
+      self._transform_layers(op, amount, layer_name, frame)
+      self._push_history(LayersTransformed(op, amount, layer_name, frame))
+
+    def transform_canvas(self, op, amount=None):
+      """ 全フレームの全レイヤーを変形（scale は amount 倍にキャンバスを広げる） """
+      if op == "scale":
+        # 縮小は元に戻せない（間引いたセルが消える）ので、キャンバス全体は整数倍の拡大だけ
+        if not (isinstance(amount, int) and amount >= 2):
+          raise ValueError("キャンバス全体は 2 以上の整数倍にだけ拡大できます")
+        if self.grid_size * amount > MAX_GRID_SIZE:
+          raise ValueError(f"拡大後の大きさは {MAX_GRID_SIZE} セルまでです")
+      self.commit_state()
+      self._transform_layers(op, amount)
+      self._push_history(LayersTransformed(op, amount))
+
+    def scale_layer(self, factor, layer_name=None):
+      """ キャンバスの大きさのまま、中心を基準にレイヤーを factor 倍する（2 以上の整数か 1/整数）
+
+      はみ出した部分が消えるので、変化したセルを記録する
+      """
+      layer_name = layer_name or self.current_layer
+      if layer_name in self.layers and not self.layer_lock.get(layer_name, False):
+        self._assign_layer(layer_name, scale_in_place(self.layers[layer_name], factor))
+
+    def _transform_layers(self, op, amount, layer_name=None, frame=None):
+      """ 配列を変形したものに差し替える（layer_name が None なら全フレームの全レイヤー）
+
+      元の配列は書き換えない（自動保存に渡している配列もそのまま使える）
+      """
+      if layer_name is not None:
+        targets = [(frame, layer_name)]
+      else:
+        targets = [(f, name) for f in self.frames for name in f.layers]
+      transformed = {}  # フレーム間で共有している配列は 1 回だけ変形し、共有を保つ
+      for target_frame, name in targets:
+        layer = mapped_layer(target_frame.layers[name], lambda a: transformed_layer(a, op, amount), transformed)
+        if layer_name is not None and not isinstance(layer, LayerPatch):
+          layer.flags.writeable = True  # 1 つのフレームだけを変形したなら他と共有していないので書き込める
+        target_frame.layers[name] = layer
+        self._touch_layer(name, target_frame)
+      if layer_name is None and transformed:
+        size = next(iter(transformed.values()))[1].shape[0]
+        if size != self.grid_size:  # 拡大・縮小でキャンバスの大きさが変わった
+          self.grid_size = size
+          self._drop_selection()
+          self.update_canvas_size()
+      self._invalidate_composite()
+
+    def get_crop_rect(self, pixmap, source_size=None):
+      """切り取り範囲を選択（source_size を渡すと、縮小表示から元画像の座標に換算して返す）"""
       dialog = QW.QDialog(self)
       dialog.setWindowTitle("切り取り範囲を選択")
       layout = QW.QVBoxLayout(dialog)
@@ -298,15 +1679,15 @@ class PixelCanvas(QW.QWidget):
       pixmap_item = QW.QGraphicsPixmapItem(pixmap)
       scene.addItem(pixmap_item)
 
-      view = CropSelectionView(scene)  # カスタムビューを使用
+      view = CropSelectionView(scene, source_size)  # カスタムビューを使用
       layout.addWidget(view)
 
       select_button = QW.QPushButton("選択完了")
       layout.addWidget(select_button)
 
       def on_select():
-        if view.selection_rect:
-            rect = view.selection_rect.rect().toRect()
+        rect = view.source_rect()
+        if rect is not None and not rect.isEmpty():
             dialog.accept()
             return rect
         return None
@@ -316,101 +1697,166 @@ class PixelCanvas(QW.QWidget):
         return on_select()
       return None
 
-    def load_and_crop_image(self, file_path):
-      """ 画像を読み込み、切り取り、キャンバスに適用 """
-      original_pixmap = QG.QPixmap(file_path)
-      if original_pixmap.isNull():
+    def load_and_crop_image(self, file_path, num_colors=64, dither="none"):
+      """ 画像を読み込み、切り取り、キャンバスに適用（num_colors は 256 まで） """
+      reader = QG.QImageReader(file_path)
+      source_size = reader.size()
+      if not source_size.isValid():
         return  # 画像が無効なら何もしない
 
-      # トリミングウィンドウを開く
-      rect = self.get_crop_rect(original_pixmap)
+      # トリミングウィンドウには画面に収まる大きさに縮小してデコードした画像を表示
+      preview_size = self._crop_preview_size()
+      if source_size.width() > preview_size.width() or source_size.height() > preview_size.height():
+        reader.setScaledSize(source_size.scaled(preview_size, QC.Qt.KeepAspectRatio))
+      proxy = reader.read()
+      if proxy.isNull():
+        return
+
+      # トリミングウィンドウを開く（範囲は元画像の座標で返る）
+      rect = self.get_crop_rect(QG.QPixmap.fromImage(proxy), source_size)
       if rect is None:
         return  # 選択なし
 
-      cropped_pixmap = original_pixmap.copy(rect)
-
-      # キャンバスのピクセルグリッドサイズに合わせてリサイズ
-      scaled_pixmap = cropped_pixmap.scaled(
-                      self.width() * self.pixel_size,
-                      self.height() * self.pixel_size,
-          QC.Qt.IgnoreAspectRatio,
-          QC.Qt.SmoothTransformation)
-
-      # QPixmap → QImage に変換してドット絵化
-      self.apply_to_canvas(scaled_pixmap.toImage(), num_colors=64) #256まで調整可能
-
-    def apply_to_canvas(self, image, num_colors=16):
-      """ ピクセルデータをキャンバスに適用（リサイズ＆減色処理） """
-
-      # 画像をキャンバスのピクセルグリッドサイズにリサイズ
-      image = image.scaled(self.width(), self.height(),
-                        QC.Qt.IgnoreAspectRatio, QC.Qt.SmoothTransformation)
-
-      width, height = image.width(), image.height()
-      ptr = image.bits()
-      data = np.frombuffer(ptr, dtype=np.uint8).copy().reshape(
-        (height, width, 4))  # RGBA
-
-      # アルファチャンネルを無視して RGB のみにする
-      data = data[:, :, :3]  # (height, width, 3) の形にする
-
-      # RGB → Lab 色空間に変換
-      lab_image = cv2.cvtColor(data, cv2.COLOR_RGB2Lab)
-
-      # K-means クラスタリング
-      Z = np.float32(lab_image.reshape((-1, 3)))  # 1次元化
-      _, labels, centers = cv2.kmeans(Z, num_colors, None,
-                                    (cv2.TERM_CRITERIA_EPS +
-                                    cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0),
-                                    10, cv2.KMEANS_RANDOM_CENTERS)
-
-      # 量子化した結果を元の形に戻す
-      centers = np.uint8(centers)
-      quantized_lab = centers[labels.flatten()].reshape(data.shape)
-
-      # Lab → RGB に戻す
-      quantized = cv2.cvtColor(quantized_lab, cv2.COLOR_Lab2RGB)
-
-      # ピクセルグリッドに合わせてキャンバスデータに適用
-      pixel_size = self.pixel_size
-      for y in range(height):
-        for x in range(width):
-            grid_x = (x // pixel_size) * pixel_size
-            grid_y = (y // pixel_size) * pixel_size
-            color = tuple(map(int, quantized[y, x]))  # RGB値を整数タプル化
-
-            # PySide6 QColor へ変換
-            qcolor = QG.QColor(*color)
-            self.layers[self.current_layer][(
-                grid_x, grid_y)] = qcolor  # ピクセル情報を適用
+      # 選んだ範囲のデコードと減色はバックグラウンドで行う（その間も描画できる）
+      self.start_import(file_path, rect, num_colors, dither=dither)
+
+    def _crop_preview_size(self):
+      """トリミングウィンドウに表示する画像の最大サイズ"""
+      screen = self.screen() or QG.QGuiApplication.primaryScreen()
+      if screen is None:
+        return QC.QSize(1280, 960)
+      available = screen.availableGeometry().size()
+      return QC.QSize(int(available.width() * 0.8), int(available.height() * 0.8))
+
+    def start_import(self, file_path, rect, num_colors=16, method="area", dither="none"):
+      """ 画像の rect の範囲を、選択中のレイヤーへバックグラウンドで読み込む
+
+      結果は完了時に 1 回の書き込み（1 回分の履歴）としてレイヤーに反映する。
+      ロック中のレイヤーには読み込まない（import_failed を出して None を返す）
+      """
+      if self.layer_lock.get(self.current_layer, False):
+        self.import_failed.emit(file_path, f"レイヤー {self.current_layer} はロックされています")
+        return None
+      task = ImportTask(file_path, rect, self.grid_size, num_colors, method,
+                        self.current_layer, self.frames[self.current_frame], IMPORT_SAMPLES_PER_CELL, dither)
+      # 通知はワーカーのスレッドから届くので、GUI スレッドのメソッドで受ける
+      task.signals.progress.connect(self._import_progressed)
+      task.signals.finished.connect(self._import_finished)
+      task.signals.failed.connect(self._import_failed)
+      task.signals.cancelled.connect(self._import_done)
+      self.imports.append(task)
+      self._import_pool.start(task)
+      self.imports_changed.emit()
+      return task
+
+    def cancel_imports(self):
+      """実行中・順番待ちの読み込みをすべて取り消す"""
+      for task in list(self.imports):
+        if self._import_pool.tryTake(task):  # まだ始まっていなければ取り除くだけ
+          self._import_done(task)
+        else:
+          task.cancel()
 
-      self.update()  # キャンバスを更新
+    def import_progress(self):
+      """読み込み全体の進み具合（0〜100、読み込み中でなければ None）"""
+      if not self.imports:
+        return None
+      return sum(task.progress for task in self.imports) // len(self.imports)
+
+    def wait_for_imports(self, msecs=-1):
+      """読み込みがすべて終わるまで待つ（結果はイベントループで届く）"""
+      return self._import_pool.waitForDone(msecs)
+
+    def _import_done(self, task):
+      if task in self.imports:
+        self.imports.remove(task)
+        self.imports_changed.emit()
+
+    def _import_progressed(self, task, percent):
+      self.imports_changed.emit()
+
+    def _import_failed(self, task, message):
+      self._import_done(task)
+      self.import_failed.emit(task.file_path, message)
+
+    def _import_finished(self, task, cells):
+      self._import_done(task)
+      if task.is_cancelled():
+        return
+      if self._stroke is not None:  # ストロークの途中なら、確定してから書き込む
+        self._finished_imports.append((task, cells))
+      else:
+        self._apply_import(task, cells)
+
+    def _apply_import(self, task, cells):
+      """読み込んだセルを、開始時に選んでいたレイヤーに書き込む"""
+      frame = task.frame
+      if (task.grid_size != self.grid_size or frame not in self.frames
+              or task.layer_name not in frame.layers):
+        logger.warning("読み込み中にキャンバスが変わったため、結果を破棄しました: %s", task.file_path)
+        return
+      if self.layer_lock.get(task.layer_name, False):  # 読み込み中にロックされた
+        logger.warning("読み込み先のレイヤーがロックされたため、結果を破棄しました: %s", task.file_path)
+        self.import_failed.emit(task.file_path, f"レイヤー {task.layer_name} はロックされています")
+        return
+      self.commit_state()
+      count = self.palette_count
+      self._assign_layer(task.layer_name, self._cells_to_layer(cells), frame, palette_count=count)
+
+    def _cells_to_layer(self, cells):
+      """(grid, grid, 3) の RGB をレイヤーの配列（不透明な RGBA、インデックスカラーなら番号）にする"""
+      rgba = np.empty((self.grid_size, self.grid_size, 4), dtype=np.uint8)
+      rgba[:, :, :3] = cells
+      rgba[:, :, 3] = 255
+      if self.indexed:
+        rgba = self.rgba_to_indices(rgba)
+      return rgba
+
+    def apply_to_canvas(self, image, num_colors=16, method="area", dither="none"):
+      """ ピクセルデータをキャンバスに適用（グリッドサイズへ縮小してから減色）
+
+      method: "area"（セル内の平均色）または "mode"（セル内の最頻色）
+      dither: Dither.DITHER_METHODS のいずれか
+      """
+      rgb = image_to_rgb(image)
+      if rgb.size == 0:
+        return
+
+      # グリッドのセル数だけを Lab 空間で k-means 減色
+      with profiler.section("import/quantize"):
+        cells = pixelize(rgb, self.grid_size, num_colors, method, dither=dither)
+
+      # 1 回の代入でレイヤーに書き込む（減色で色表に追加した色も同じ履歴にする）
+      self.commit_state()
+      count = self.palette_count
+      self._assign_layer(self.current_layer, self._cells_to_layer(cells), palette_count=count)
+
+    def _assign_layer(self, layer_name, values, frame=None, palette_count=None):
+      """ レイヤー全体を置き換え、変化したセルだけを 1 回分の履歴に記録
+
+      palette_count: values を作る前の色数（その後に色表に追加した色も同じ履歴にする）
+      """
+      self.commit_state()
+      frame = frame or self.frames[self.current_frame]
+      count = values.shape[0] * values.shape[1]
+      flat = np.asarray(frame.layers[layer_name]).reshape(count, -1)
+      changed = np.flatnonzero(np.any(flat != values.reshape(count, -1), axis=1))
+      records = [] if palette_count is None else self._palette_growth(palette_count)
+      if changed.size == 0:
+        self.history.push(records)  # 色表に追加した色だけを記録
+        return
+      before = take_rows(flat, changed)
+      self._writable_layer(layer_name, frame)[...] = values
+      self._touch_layer(layer_name, frame)
+      records.append(cell_delta(layer_name, frame.layers[layer_name], changed, before, frame))
+      self.history.push(records)
+      if frame is self.frames[self.current_frame]:
+        ys, xs = np.divmod(changed, self.grid_size)
+        self._mark_dirty(xs.min(), ys.min(), xs.max() + 1, ys.max() + 1)  # キャンバスを更新
+      else:
+        self._pack_frames()
+        self.update()  # オニオンスキンに映っているかもしれない
 
     def erase_pixel(self, x, y):
-      """消しゴムで消す処理（シンメトリー・市松模様対応）"""
-      to_erase = [(x, y)]  # 通常の座標を追加
-
-      if self.brush_mode == "checker":
-        # 市松模様で生成された座標を削除
-        for i in range(2):
-            for j in range(2):
-                grid_x = x + i * self.pixel_size
-                grid_y = y + j * self.pixel_size
-                if (i + j) % 2 == 0:
-                    to_erase.append((grid_x, grid_y))
-
-      elif self.brush_mode == "symmetry":
-        # 左右対称で生成された座標を削除
-        width = self.width()
-        height = self.height()
-        mirrored_x = width - x - self.pixel_size
-        mirrored_y = height - y - self.pixel_size
-
-        to_erase.extend([(mirrored_x, y), (x, mirrored_y), (mirrored_x, mirrored_y)])
-
-      # 削除処理
-      for pos in to_erase:
-        if pos in self.layers[self.current_layer]:
-          self.layers[self.current_layer][pos] = QC.Qt.white  # 背景色にする
-
-      self.update()
+      """消しゴムで消す処理（描画と同じブラシのセルを透明にする）"""
+      self._write_cells(*self.brush_cells(np.atleast_1d(x), np.atleast_1d(y)), None)
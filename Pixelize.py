@@ -0,0 +1,89 @@
+import cv2
+import numpy as np
+
+from Dither import dither as apply_dither
+
+RESAMPLE_METHODS = ("area", "mode")
+
+# 最頻色を求める際にセルごとに見るサンプル数（一辺）
+_MODE_SAMPLES = 8
+
+
+def resample_to_grid(rgb, grid_w, grid_h, method="area"):
+    """ RGB 画像 (H, W, 3) を直接 grid_h x grid_w のセルに縮小
+
+    area: セル内の平均色
+    mode: セル内で最も多い色（線画やドット絵の縮小向き）
+    """
+    if method == "area":
+        return cv2.resize(rgb, (grid_w, grid_h), interpolation=cv2.INTER_AREA)
+    if method != "mode":
+        raise ValueError(f"unknown resample method: {method}")
+
+    # 各セルから k x k 個のサンプルを取り出す
+    k = max(1, min(_MODE_SAMPLES, rgb.shape[1] // grid_w, rgb.shape[0] // grid_h))
+    samples = cv2.resize(rgb, (grid_w * k, grid_h * k), interpolation=cv2.INTER_NEAREST)
+    samples = samples.reshape(grid_h, k, grid_w, k, 3).transpose(0, 2, 1, 3, 4)
+    samples = samples.reshape(grid_h * grid_w, k * k, 3)
+
+    # 各チャンネル上位 5 ビットで色をまとめ、セルごとの最頻コードを求める
+    codes = ((samples[:, :, 0].astype(np.int64) >> 3) << 10 |
+             (samples[:, :, 1].astype(np.int64) >> 3) << 5 |
+             (samples[:, :, 2].astype(np.int64) >> 3))
+    cells = np.arange(codes.shape[0])[:, None]
+    keys, counts = np.unique((cells << 15 | codes).ravel(), return_counts=True)
+    key_cells = keys >> 15
+    order = np.lexsort((counts, key_cells))
+    # セルごとに出現数が最大のもの（並べ替えた最後の要素）を採用
+    last = np.flatnonzero(np.r_[key_cells[order][1:] != key_cells[order][:-1], True])
+    mode = (keys[order][last] & 0x7FFF)[:, None]
+
+    # 最頻コードに属するサンプルの平均色
+    mask = (codes == mode)[:, :, None]
+    mean = (samples * mask).sum(axis=1) / mask.sum(axis=1)
+    return np.round(mean).astype(np.uint8).reshape(grid_h, grid_w, 3)
+
+
+def quantize_lab(rgb, num_colors, attempts=3, progress=None):
+    """ Lab 色空間の k-means で num_colors 色に減色（(量子化画像, パレット) を返す）
+
+    progress: k-means を 1 回試すごとに 0〜1 の進み具合で呼ばれる（例外を投げれば中断できる）
+    """
+    shape = rgb.shape
+    lab = cv2.cvtColor(rgb.reshape(-1, 1, 3), cv2.COLOR_RGB2Lab)
+    Z = np.float32(lab.reshape(-1, 3))
+
+    # 色数より多いクラスタは作れない
+    num_colors = min(num_colors, len(np.unique(Z, axis=0)))
+    if num_colors < 1:
+        return rgb.copy(), np.zeros((0, 3), dtype=np.uint8)
+
+    # 試行を 1 回ずつ行い、最もまとまりの良い結果を使う（cv2.kmeans の attempts と同じ）
+    best = None
+    for attempt in range(attempts):
+        result = cv2.kmeans(Z, num_colors, None,
+                            (cv2.TERM_CRITERIA_EPS +
+                             cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0),
+                            1, cv2.KMEANS_PP_CENTERS)
+        if best is None or result[0] < best[0]:
+            best = result
+        if progress is not None:
+            progress((attempt + 1) / attempts)
+    _, labels, centers = best
+
+    # Lab → RGB に戻したパレットを引く
+    centers = np.uint8(np.clip(centers, 0, 255))
+    palette = cv2.cvtColor(centers.reshape(-1, 1, 3), cv2.COLOR_Lab2RGB).reshape(-1, 3)
+    return palette[labels.ravel()].reshape(shape), palette
+
+
+def pixelize(rgb, grid_size, num_colors=16, method="area", progress=None, dither="none"):
+    """ 画像を grid_size x grid_size のドット絵に変換（縮小してから減色）
+
+    dither: 減色で求めた色へのディザリング（Dither.DITHER_METHODS、"none" なら最も近い色）
+    """
+    cells = resample_to_grid(rgb, grid_size, grid_size, method)
+    quantized, palette = quantize_lab(cells, num_colors, progress=progress)
+    if dither != "none":
+        quantized = apply_dither(cells, palette, dither)
+    return quantized
@@ -0,0 +1,135 @@
+""" 処理時間の計測（描画・ストローク・読み込み・書き出しなど）
+
+計測は常に行い、直近の値だけを保持する（1 回あたり数マイクロ秒）。
+個々の計測値は DEBUG レベルでログに出す（既定では出力しない）。
+
+例:
+    with profiler.section("export"):
+        ...
+
+    @profiler.timed("stroke")
+    def paint_cells(...):
+        ...
+"""
+import functools
+import json
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HISTORY_LENGTH = 600  # 名前ごとに保持する直近の計測数
+HISTOGRAM_BINS = 20
+
+
+class Profiler:
+    def __init__(self, history_length=HISTORY_LENGTH):
+        self.history_length = history_length
+        self.samples = {}  # {名前: deque(所要時間（秒）)}
+        self.values = {}  # {名前: 直近の値}（描画したセル数など）
+        self.marks = {}  # {名前: deque(呼び出し時刻)}
+        self.enabled = True
+
+    def record(self, name, seconds):
+        """所要時間を 1 件記録"""
+        if not self.enabled:
+            return
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.history_length)
+        samples.append(seconds)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s: %.2f ms", name, seconds * 1000.0)
+
+    def set_value(self, name, value):
+        """時間以外の値（描画したセル数など）を記録"""
+        self.values[name] = value
+
+    @contextmanager
+    def section(self, name):
+        """with ブロックの所要時間を記録"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """関数の所要時間を記録するデコレーター"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def last(self, name):
+        """直近の所要時間（秒、未計測なら None）"""
+        samples = self.samples.get(name)
+        return samples[-1] if samples else None
+
+    def mark(self, name):
+        """呼び出し時刻を記録（rate() で 1 秒あたりの回数を求める）"""
+        marks = self.marks.get(name)
+        if marks is None:
+            marks = self.marks[name] = deque(maxlen=self.history_length)
+        marks.append(time.perf_counter())
+
+    def rate(self, name, window=1.0):
+        """直近 window 秒に mark(name) が呼ばれた回数（1 秒あたり、FPS など）"""
+        marks = self.marks.get(name)
+        if not marks:
+            return 0.0
+        now = time.perf_counter()
+        return sum(1 for t in marks if now - t <= window) / window
+
+    def stats(self, name):
+        """ {count, mean_ms, p50_ms, p99_ms, max_ms} """
+        samples = np.fromiter(self.samples.get(name, ()), dtype=np.float64) * 1000.0
+        if samples.size == 0:
+            return {"count": 0}
+        return {
+            "count": int(samples.size),
+            "mean_ms": float(samples.mean()),
+            "p50_ms": float(np.percentile(samples, 50)),
+            "p99_ms": float(np.percentile(samples, 99)),
+            "max_ms": float(samples.max()),
+        }
+
+    def histogram(self, name, bins=HISTOGRAM_BINS):
+        """ 直近の所要時間のヒストグラム {edges_ms, counts} """
+        samples = np.fromiter(self.samples.get(name, ()), dtype=np.float64) * 1000.0
+        if samples.size == 0:
+            return {"edges_ms": [], "counts": []}
+        counts, edges = np.histogram(samples, bins=bins)
+        return {"edges_ms": edges.tolist(), "counts": counts.tolist()}
+
+    def report(self):
+        return {
+            "sections": {name: dict(self.stats(name), histogram=self.histogram(name))
+                         for name in sorted(self.samples)},
+            "values": dict(self.values),
+        }
+
+    def dump(self, path):
+        """すべての計測結果（統計とヒストグラム）を JSON ファイルに書き出す"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+        logger.info("計測結果を保存しました: %s", path)
+
+    def clear(self):
+        self.samples.clear()
+        self.values.clear()
+        self.marks.clear()
+
+
+# アプリ全体で共有する計測器
+profiler = Profiler()
@@ -0,0 +1,226 @@
+""" ドット絵プロジェクトの保存形式（.dotp）
+
+    [0:8]    マジック b"DOTPRJ01"
+    [8:16]   ヘッダ（JSON）のバイト数（リトルエンディアン uint64）
+    [16:]    ヘッダ（JSON, UTF-8）と予備領域
+    以降     レイヤーの生データ（各レイヤーはページ境界に揃えて配置、無圧縮）
+
+アニメーションでは 1 フレーム目をレイヤー名のまま保存し、他のフレームで内容が違う配列だけを
+FRAME_PREFIX から始まる名前で追加する（ヘッダの "frames" にフレームごとの対応を持つ）。
+
+レイヤーは np.memmap で読み込むのでファイルを開く時間はほぼ一定。
+レイヤー構成が同じなら、変更されたレイヤーとヘッダだけをその場で書き換える。
+コピーオンライトのマップでも書き換えていないページにはファイルへの書き込みが見えるので、
+読み込み元のファイルに保存するときは、配列がどこをマップしているかを mapped_offset で確かめること。
+"""
+import json
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b"DOTPRJ01"
+VERSION = 1
+EXTENSION = ".dotp"
+_PREFIX = struct.Struct("<8sQ")
+_ALIGN = 4096  # mmap しやすいようにページ境界に揃える
+# アニメーションの 2 フレーム目以降だけが持つ配列の名前の接頭辞（"#frame3/レイヤー名" など）
+FRAME_PREFIX = "#frame"
+
+
+def _align(value, alignment=_ALIGN):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def read_header(path):
+    """ヘッダ（dict）を読む（形式が違えば ValueError）"""
+    with open(path, "rb") as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) != _PREFIX.size:
+            raise ValueError("プロジェクトファイルではありません")
+        magic, length = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError("プロジェクトファイルではありません")
+        header = json.loads(f.read(length).decode("utf-8"))
+    if header.get("version") != VERSION:
+        raise ValueError(f"未対応のバージョンです: {header.get('version')}")
+    return header
+
+
+def _encode_header(header):
+    return json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+
+def _layer_entries(layers, properties):
+    entries = []
+    for name, array in layers.items():
+        entry = {"name": name, "shape": list(array.shape), "dtype": array.dtype.str}
+        entry.update(properties.get(name, {}))
+        entries.append(entry)
+    return entries
+
+
+def _write_full(path, header, layers):
+    """ファイル全体を書き直す（一時ファイルに書いてから置き換え）"""
+    body = _encode_header(header)
+    # ヘッダが多少大きくなってもその場で更新できるよう余裕を持たせる
+    capacity = _align(_PREFIX.size + max(len(body) * 2, 4096)) - _PREFIX.size
+    offset = _PREFIX.size + capacity
+    for entry, array in zip(header["layers"], layers.values()):
+        entry["offset"] = offset
+        offset = _align(offset + array.nbytes)
+    header["header_capacity"] = capacity
+    body = _encode_header(header)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, len(body)))
+        f.write(body)
+        for entry, array in zip(header["layers"], layers.values()):
+            f.seek(entry["offset"])
+            f.write(memoryview(np.ascontiguousarray(array)).cast("B"))
+        f.truncate(offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _try_write_incremental(path, header, layers, dirty):
+    """ レイヤー構成が同じなら変更分だけ書き込む（できなければ False） """
+    try:
+        old = read_header(path)
+    except (OSError, ValueError):
+        return False
+    old_layers = {entry["name"]: entry for entry in old["layers"]}
+    if set(old_layers) != set(layers):
+        return False
+    for entry in header["layers"]:
+        previous = old_layers[entry["name"]]
+        if previous["shape"] != entry["shape"] or previous["dtype"] != entry["dtype"]:
+            return False
+        entry["offset"] = previous["offset"]
+    header["header_capacity"] = old["header_capacity"]
+    body = _encode_header(header)
+    if len(body) > old["header_capacity"]:
+        return False
+
+    with open(path, "r+b") as f:
+        for entry in header["layers"]:
+            if dirty is None or entry["name"] in dirty:
+                f.seek(entry["offset"])
+                f.write(memoryview(np.ascontiguousarray(layers[entry["name"]])).cast("B"))
+        # データを書き終えてからヘッダを更新
+        f.flush()
+        os.fsync(f.fileno())
+        f.seek(0)
+        f.write(_PREFIX.pack(MAGIC, len(body)))
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    return True
+
+
+def save_project(path, layers, properties=None, palette=(), extra=None, dirty=None, rewrite=True):
+    """ プロジェクトを保存し、全体を書き直したかどうかを返す
+
+    layers: {名前: 配列}（辞書の順番が描画順）
+    properties: {名前: {"visible": ..., "locked": ..., "opacity": ..., "blend": ...}}
+    palette: [(r, g, b, a), ...]
+    extra: ヘッダに一緒に保存する値（グリッドサイズなど）
+    dirty: 前回の保存から変更されたレイヤー名（None なら全レイヤー）
+    rewrite: False ならその場で書き換えられないときに全体を書き直さず None を返す
+    """
+    header = {
+        "version": VERSION,
+        "layers": _layer_entries(layers, properties or {}),
+        "palette": [list(map(int, color)) for color in palette],
+    }
+    header.update(extra or {})
+    if os.path.exists(path) and _try_write_incremental(path, header, layers, dirty):
+        return False
+    if not rewrite:
+        return None
+    _write_full(path, header, layers)
+    return True
+
+
+def mapped_offset(array, path):
+    """ array が path をメモリマップした配列なら、そのファイル上の位置を返す
+
+    マップした配列のビュー（位置が決まらない）なら -1、path をマップしていなければ None
+    """
+    root = array
+    while isinstance(root, np.ndarray) and isinstance(root.base, np.ndarray):
+        root = root.base
+    if not isinstance(root, np.memmap) or not isinstance(root.base, mmap.mmap) or root.filename is None:
+        return None
+    if os.path.realpath(root.filename) != os.path.realpath(path):
+        return None
+    return root.offset if array is root else -1
+
+
+def is_frame_array(name):
+    """2 フレーム目以降のための配列なら True（レイヤーとしては扱わない）"""
+    return name.startswith(FRAME_PREFIX)
+
+
+def load_project(path):
+    """ プロジェクトを読み込む
+
+    レイヤーはコピーオンライトの np.memmap（編集してもファイルは変わらない）。
+    戻り値はヘッダの dict に "arrays": {名前: 配列} を加えたもの。
+    """
+    header = read_header(path)
+    arrays = {}
+    for entry in header["layers"]:
+        arrays[entry["name"]] = np.memmap(path, dtype=np.dtype(entry["dtype"]), mode="c",
+                                          offset=entry["offset"], shape=tuple(entry["shape"]))
+    header["arrays"] = arrays
+    return header
+
+
+def benchmark_roundtrip(directory, grid_size=1024, num_layers=8, repeat=3):
+    """ 保存・部分保存・読み込みの所要時間（秒）を計測 """
+    path = os.path.join(directory, "benchmark" + EXTENSION)
+    rng = np.random.default_rng(0)
+    layers = {f"layer{i}": rng.integers(0, 256, (grid_size, grid_size, 4), dtype=np.uint8)
+              for i in range(num_layers)}
+    results = {"grid_size": grid_size, "layers": num_layers,
+               "bytes": sum(a.nbytes for a in layers.values())}
+
+    def best(func):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    if os.path.exists(path):
+        os.remove(path)
+    results["full_save"] = best(lambda: (os.path.exists(path) and os.remove(path),
+                                         save_project(path, layers)))
+    results["incremental_save_1_layer"] = best(lambda: save_project(path, layers, dirty={"layer0"}))
+    results["open"] = best(lambda: load_project(path))
+    results["open_and_read_all"] = best(lambda: [np.asarray(a).sum() for a in load_project(path)["arrays"].values()])
+
+    loaded = load_project(path)["arrays"]
+    assert all(np.array_equal(loaded[name], layers[name]) for name in layers)
+    del loaded
+    os.remove(path)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="プロジェクト保存形式のベンチマーク")
+    parser.add_argument("--grid", type=int, default=1024)
+    parser.add_argument("--layers", type=int, default=8)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        result = benchmark_roundtrip(directory, args.grid, args.layers)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,111 @@
+""" 選択範囲と、移動・貼り付け中の浮いている選択範囲
+
+選択範囲はキャンバスと同じ大きさの bool のマスク。切り取り・コピー・貼り付けは
+マスクの外接矩形のスライスで行い、浮いている間はレイヤーを書き換えない
+（表示だけ重ねて、確定したときに 1 回で書き込む）。
+"""
+import cv2
+import numpy as np
+import PySide6.QtGui as QG
+import PySide6.QtCore as QC
+
+SELECTION_TOOLS = ("select_rect", "lasso", "wand", "move")
+
+
+def rect_mask(grid_size, x0, y0, x1, y1):
+    """ 2 つの角のセル (x0, y0)・(x1, y1)（両端を含む、順不同）で囲んだ矩形のマスク """
+    mask = np.zeros((grid_size, grid_size), dtype=bool)
+    x0, x1 = sorted((x0, x1))
+    y0, y1 = sorted((y0, y1))
+    mask[max(y0, 0):max(y1 + 1, 0), max(x0, 0):max(x1 + 1, 0)] = True
+    return mask
+
+
+def lasso_mask(grid_size, points):
+    """ 通ったセルの列 [(x, y), ...] で囲んだ範囲のマスク（線が通ったセルも含む） """
+    mask = np.zeros((grid_size, grid_size), dtype=np.uint8)
+    if len(points):
+        polygon = np.asarray(points, dtype=np.int32).reshape(-1, 1, 2)
+        cv2.fillPoly(mask, [polygon], 1)
+        cv2.polylines(mask, [polygon], True, 1)
+    return mask.view(bool)
+
+
+def mask_bounds(mask):
+    """ マスクの外接矩形 (x0, y0, x1, y1)（x1, y1 は含まない）。空なら None """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def _edge_runs(edges):
+    """ edges (行, 列) の True の横方向の連続区間 (行, 始まり, 終わり) """
+    padded = np.zeros((edges.shape[0], edges.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = edges
+    change = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(change == 1)
+    _, ends = np.nonzero(change == -1)
+    return rows, starts, ends
+
+
+def mask_outline(mask):
+    """ マスクの境界線（セルの辺）を QLineF のリストで返す（セル座標、連続する辺は 1 本にまとめる） """
+    padded = np.pad(mask, 1)
+    horizontal = padded[1:, 1:-1] != padded[:-1, 1:-1]  # (h + 1, w): 行 y の上の辺
+    vertical = padded[1:-1, 1:] != padded[1:-1, :-1]  # (h, w + 1): 列 x の左の辺
+    lines = [QC.QLineF(x0, y, x1, y) for y, x0, x1 in zip(*_edge_runs(horizontal))]
+    lines += [QC.QLineF(x, y0, x, y1) for x, y0, y1 in zip(*_edge_runs(vertical.T))]
+    return lines
+
+
+def opaque_cells(pixels):
+    """ 透明でないセル（インデックスカラーは 0 番以外、RGBA はアルファが 0 以外） """
+    return pixels != 0 if pixels.ndim == 2 else pixels[..., 3] != 0
+
+
+class FloatingSelection:
+    """ 浮いている選択範囲（レイヤーにはまだ書き込んでいない内容）
+
+    pixels: 外接矩形の内容（レイヤーと同じ形式）、mask: 外接矩形の中で選択されているセル
+    (x, y): 外接矩形の左上のセル、layer_name: 確定したときに書き込むレイヤー
+    origin: 切り取ってきた位置（貼り付けなら None）
+    """
+
+    def __init__(self, pixels, mask, x, y, layer_name, origin=None):
+        self.pixels = pixels
+        self.mask = mask
+        self.x, self.y = x, y
+        self.layer_name = layer_name
+        self.origin = origin
+        self.outline = mask_outline(mask)
+        self._image = None  # (色表の版, 表示用の QImage, QImage が参照する配列)
+
+    def move_to(self, x, y):
+        """位置を変える（変わったら True）"""
+        if (x, y) == (self.x, self.y):
+            return False
+        self.x, self.y = x, y
+        return True
+
+    def clipped(self, grid_size):
+        """ キャンバスに収まる部分の (キャンバス側のスライス, 外接矩形側のスライス)。はみ出していれば None """
+        h, w = self.mask.shape
+        x0, y0 = max(self.x, 0), max(self.y, 0)
+        x1, y1 = min(self.x + w, grid_size), min(self.y + h, grid_size)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return ((slice(y0, y1), slice(x0, x1)),
+                (slice(y0 - self.y, y1 - self.y), slice(x0 - self.x, x1 - self.x)))
+
+    def image(self, version, palette=None):
+        """ 表示用の QImage（選択範囲の外は透明）。色表が変わるまでキャッシュ """
+        if self._image is None or self._image[0] != version:
+            rgba = palette[self.pixels] if self.pixels.ndim == 2 else self.pixels.copy()
+            rgba[~self.mask] = 0
+            rgba = np.ascontiguousarray(rgba)
+            image = QG.QImage(rgba.data, rgba.shape[1], rgba.shape[0], rgba.strides[0],
+                              QG.QImage.Format_RGBA8888)
+            self._image = (version, image, rgba)
+        return self._image[1]
@@ -0,0 +1,72 @@
+""" レイヤー・キャンバス全体の変形（反転・90 度回転・ずらし・整数倍の拡大縮小）
+
+どの変形も NumPy のビュー（反転・回転）か 1 回の配列操作で行う。
+反転・回転・ずらしと整数倍の拡大は元に戻せる変形なので、履歴には変形の種類と量だけを
+記録し、アンドゥでは逆の変形をかける（セルの内容は記録しない）。
+"""
+import numpy as np
+
+TRANSFORMS = ("flip_h", "flip_v", "rotate", "shift", "scale")
+
+
+def transform_array(array, op, amount=None):
+    """ 配列 [y, x(, チャンネル)] を変形した配列（反転・回転はビューのまま返す）
+
+    rotate: amount は時計回りの 90 度の回数、shift: amount は (dx, dy)（はみ出した分は反対側に出る）
+    scale: amount は整数倍（2 以上で拡大、-2 以下なら 1/|amount| に縮小）
+    """
+    if op == "flip_h":
+        return array[:, ::-1]
+    if op == "flip_v":
+        return array[::-1]
+    if op == "rotate":
+        return np.rot90(array, -amount)  # rot90 は反時計回り
+    if op == "shift":
+        dx, dy = amount
+        return np.roll(array, (dy, dx), axis=(0, 1))
+    if op == "scale":
+        if amount >= 1:
+            return array.repeat(amount, axis=0).repeat(amount, axis=1)
+        return array[::-amount, ::-amount]
+    raise ValueError(f"unknown transform: {op}")
+
+
+def transformed_layer(layer, op, amount=None):
+    """ 変形した新しい配列（C 連続）。元の配列は変えない
+
+    RGBA のレイヤーは 1 セル 4 バイトを uint32 として見てから変形する（チャンネルごとにコピーするより速い）
+    """
+    if layer.ndim == 3 and layer.shape[2] == 4 and layer.dtype == np.uint8 and layer.flags.c_contiguous:
+        words = transform_array(layer.view(np.uint32)[..., 0], op, amount)
+        return np.ascontiguousarray(words).view(np.uint8).reshape(words.shape + (4,))
+    return np.ascontiguousarray(transform_array(layer, op, amount))
+
+
+def inverse(op, amount=None):
+    """逆の変形 (op, amount)"""
+    if op == "rotate":
+        return op, -amount
+    if op == "shift":
+        return op, (-amount[0], -amount[1])
+    if op == "scale":
+        return op, -amount  # 拡大したものは間引けば元に戻る
+    return op, amount
+
+
+def scale_in_place(array, factor):
+    """ 大きさを変えずに、中心を基準に最近傍で factor 倍する（factor は 2 以上の整数か 1/整数）
+
+    はみ出した部分は切り捨て、縮小して空いた部分は透明（0）になる
+    """
+    size = array.shape[0]
+    center = size // 2
+    offsets = np.arange(size) - center
+    if factor >= 1:
+        source = center + np.floor_divide(offsets, int(factor))
+    else:
+        source = center + offsets * int(round(1 / factor))
+    inside = (source >= 0) & (source < size)
+    source = np.clip(source, 0, size - 1)
+    result = array[source[:, None], source[None, :]]
+    result[~(inside[:, None] & inside[None, :])] = 0
+    return result
@@ -1,90 +1,236 @@
 import os
+import queue
+import threading
 import tkinter as tk
-from tkinter import filedialog, messagebox
-from PIL import Image
-
-def crop_images(file_paths):
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from tkinter import filedialog, messagebox, ttk
+from PIL import Image, JpegImagePlugin
+
+# 一度に処理中にしておくファイル数（ワーカー数に対する倍率）
+IN_FLIGHT_PER_WORKER = 4
+
+
+class BatchResult:
+    """バッチ処理の結果（成功数・失敗したファイルとエラー・中断の有無）"""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.errors = []  # (ファイル名, エラーメッセージ)
+        self.cancelled = False
+
+    def summary(self, limit=20):
+        lines = [f"{self.done - len(self.errors)} / {self.total} 件を処理しました"]
+        if self.cancelled:
+            lines.append("（中断されました）")
+        if self.errors:
+            lines.append(f"{len(self.errors)} 件失敗:")
+            lines.extend(f"  {name}: {error}" for name, error in self.errors[:limit])
+            if len(self.errors) > limit:
+                lines.append(f"  ...ほか {len(self.errors) - limit} 件")
+        return "\n".join(lines)
+
+
+def run_batch(file_paths, task, workers=None, on_progress=None, cancel_event=None):
+    """ ファイルごとの処理 task(path) をスレッドプールで並列に実行
+
+    on_progress(done, total): 1 件終わるごとに呼ばれる（ワーカー側のスレッドから）
+    cancel_event: セットされると未着手のファイルは処理しない
+    """
+    file_paths = list(file_paths)
+    result = BatchResult(len(file_paths))
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    pending = iter(file_paths)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+
+        def submit_next():
+            # 大量のファイルでも一度に投入せず、少しずつ流し込む
+            while len(in_flight) < workers * IN_FLIGHT_PER_WORKER:
+                if cancel_event is not None and cancel_event.is_set():
+                    result.cancelled = True
+                    return
+                path = next(pending, None)
+                if path is None:
+                    return
+                in_flight[pool.submit(task, path)] = path
+
+        submit_next()
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path = in_flight.pop(future)
+                result.done += 1
+                error = future.exception()
+                if error is not None:
+                    result.errors.append((os.path.basename(path), str(error)))
+                if on_progress is not None:
+                    on_progress(result.done, result.total)
+            submit_next()
+
+    return result
+
+
+def save_like_source(img, source, save_path):
+    """元画像と同じ形式で保存（JPEG への再エンコードで劣化させない）"""
+    fmt = source.format or "PNG"
+    options = {}
+    for key in ("exif", "icc_profile", "dpi"):
+        if key in source.info:
+            options[key] = source.info[key]
+    if fmt == "JPEG":
+        options["quality"] = 95
+        sampling = JpegImagePlugin.get_sampling(source)
+        if sampling != -1:
+            options["subsampling"] = sampling  # 元のクロマサブサンプリングを維持
+    img.save(save_path, fmt, **options)
+
+
+def crop_one(file_path, output_folder):
+    """ファイル名の数字が偶数なら上半分、奇数なら下半分を切り取る"""
+    with Image.open(file_path) as img:
+        width, height = img.size
+
+        # ファイル名から数字を抽出
+        file_name = os.path.basename(file_path)
+        file_number = int(''.join(filter(str.isdigit, file_name)))
+
+        # 偶数なら上半分、奇数なら下半分を切り取る
+        if file_number % 2 == 0:
+            cropped_img = img.crop((0, 0, width, height // 2))
+        else:
+            cropped_img = img.crop((0, height // 2, width, height))
+
+        # 保存
+        save_path = os.path.join(output_folder, f"cropped_{file_name}")
+        save_like_source(cropped_img, img, save_path)
+
+
+def rotate_one(file_path, output_folder, direction):
+    """90 度回転（再サンプリングせずに画素を並べ替える）"""
+    with Image.open(file_path) as img:
+        # 回転方向の選択
+        if direction == "cw":
+            rotated_img = img.transpose(Image.Transpose.ROTATE_270)  # 時計回り
+        else:
+            rotated_img = img.transpose(Image.Transpose.ROTATE_90)  # 反時計回り
+
+        # 保存
+        file_name = os.path.basename(file_path)
+        save_path = os.path.join(output_folder, f"rotated_{file_name}")
+        save_like_source(rotated_img, img, save_path)
+
+
+def crop_images(file_paths, on_progress=None, cancel_event=None):
     output_folder = "cropped_images"
     os.makedirs(output_folder, exist_ok=True)
+    return run_batch(file_paths, lambda path: crop_one(path, output_folder),
+                     on_progress=on_progress, cancel_event=cancel_event)
 
-    for file_path in file_paths:
-        try:
-            img = Image.open(file_path)
-            width, height = img.size
-
-            # ファイル名から数字を抽出
-            file_name = os.path.basename(file_path)
-            file_number = int(''.join(filter(str.isdigit, file_name)))
-
-            # 偶数なら上半分、奇数なら下半分を切り取る
-            if file_number % 2 == 0:
-                cropped_img = img.crop((0, 0, width, height // 2))
-            else:
-                cropped_img = img.crop((0, height // 2, width, height))
-
-            # 保存
-            save_path = os.path.join(output_folder, f"cropped_{file_name}")
-            cropped_img.save(save_path, "JPEG")
-
-        except Exception as e:
-            messagebox.showerror(
-                "Error", f"Failed to process {file_name}: {str(e)}")
 
-def rotate_images(file_paths, direction):
+def rotate_images(file_paths, direction, on_progress=None, cancel_event=None):
     output_folder = "rotated_images"
     os.makedirs(output_folder, exist_ok=True)
-
-    for file_path in file_paths:
+    return run_batch(file_paths, lambda path: rotate_one(path, output_folder, direction),
+                     on_progress=on_progress, cancel_event=cancel_event)
+
+
+class BatchProgress:
+    """ 別スレッドでバッチ処理を実行し、進捗バーと中断ボタンを表示する """
+
+    POLL_MS = 50
+
+    def __init__(self, root, title, run, on_finished):
+        self.root = root
+        self.on_finished = on_finished
+        self.cancel_event = threading.Event()
+        self.messages = queue.Queue()
+
+        self.window = tk.Toplevel(root)
+        self.window.title(title)
+        self.window.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.label = tk.Label(self.window, text="準備中...")
+        self.label.pack(padx=10, pady=5)
+        self.bar = ttk.Progressbar(self.window, length=300, mode="determinate")
+        self.bar.pack(padx=10, pady=5)
+        self.cancel_button = tk.Button(self.window, text="中断", command=self.cancel)
+        self.cancel_button.pack(pady=5)
+
+        # 処理はワーカースレッドで行い、Tk の更新はメインスレッドのポーリングで行う
+        def worker():
+            result = run(lambda done, total: self.messages.put(("progress", done, total)),
+                         self.cancel_event)
+            self.messages.put(("finished", result))
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.root.after(self.POLL_MS, self.poll)
+
+    def cancel(self):
+        self.cancel_event.set()
+        self.cancel_button.config(state=tk.DISABLED, text="中断中...")
+
+    def poll(self):
+        latest = None
         try:
-            img = Image.open(file_path)
-
-            # 回転方向の選択
-            if direction == "cw":
-                rotated_img = img.rotate(-90, expand=True)  # 時計回り
-            else:
-                rotated_img = img.rotate(90, expand=True)  # 反時計回り
-
-            # 保存
-            file_name = os.path.basename(file_path)
-            save_path = os.path.join(output_folder, f"rotated_{file_name}")
-            rotated_img.save(save_path, "JPEG")
-
-        except Exception as e:
-            messagebox.showerror(
-                "Error", f"Failed to rotate {file_name}: {str(e)}")
-
-def select_files(action):
+            while True:
+                message = self.messages.get_nowait()
+                if message[0] == "finished":
+                    self.window.destroy()
+                    self.on_finished(message[1])
+                    return
+                latest = message
+        except queue.Empty:
+            pass
+        if latest is not None:
+            _, done, total = latest
+            self.bar.config(maximum=total, value=done)
+            self.label.config(text=f"{done} / {total}")
+        self.root.after(self.POLL_MS, self.poll)
+
+
+def select_files(root, action):
     file_paths = filedialog.askopenfilenames(
         filetypes=[("JPEG files", "*.jpg"), ("All files", "*.*")]
     )
-    if file_paths:
-        if action == "crop":
-            crop_images(file_paths)
-            messagebox.showinfo(
-                "Completed", "Images have been cropped and saved!")
-        elif action == "cw":
-            rotate_images(file_paths, "cw")
-            messagebox.showinfo(
-                "Completed", "Images have been rotated (Clockwise) and saved!")
-        elif action == "ccw":
-            rotate_images(file_paths, "ccw")
-            messagebox.showinfo(
-                "Completed", "Images have been rotated (Counterclockwise) and saved!")
+    if not file_paths:
+        return
+
+    if action == "crop":
+        title, message = "Cropping", "Images have been cropped and saved!"
+        run = lambda progress, cancel: crop_images(file_paths, progress, cancel)
+    elif action == "cw":
+        title, message = "Rotating", "Images have been rotated (Clockwise) and saved!"
+        run = lambda progress, cancel: rotate_images(file_paths, "cw", progress, cancel)
+    elif action == "ccw":
+        title, message = "Rotating", "Images have been rotated (Counterclockwise) and saved!"
+        run = lambda progress, cancel: rotate_images(file_paths, "ccw", progress, cancel)
+    else:
+        return
+
+    def finished(result):
+        # エラーは 1 件ずつではなくまとめて表示
+        if result.errors:
+            messagebox.showerror("Error", result.summary())
+        else:
+            messagebox.showinfo("Completed", f"{message}\n{result.summary()}")
+
+    BatchProgress(root, title, run, finished)
 
 def main():
     root = tk.Tk()
     root.title("Image Crop & Rotate App")
 
     crop_button = tk.Button(
-        root, text="Select Images for Cropping", command=lambda: select_files("crop"))
+        root, text="Select Images for Cropping", command=lambda: select_files(root, "crop"))
     crop_button.pack(pady=10)
 
     rotate_cw_button = tk.Button(
-        root, text="Rotate Images 90° Clockwise", command=lambda: select_files("cw"))
+        root, text="Rotate Images 90° Clockwise", command=lambda: select_files(root, "cw"))
     rotate_cw_button.pack(pady=10)
 
     rotate_ccw_button = tk.Button(
-        root, text="Rotate Images 90° Counterclockwise", command=lambda: select_files("ccw"))
+        root, text="Rotate Images 90° Counterclockwise", command=lambda: select_files(root, "ccw"))
     rotate_ccw_button.pack(pady=10)
 
     root.mainloop()
@@ -0,0 +1,169 @@
+""" 画像をまとめてドット絵に変換するコマンドラインツール（GUI 不要）
+
+例:
+    python batch_pixelize.py "photos/*.jpg" -o out --grid 64 --colors 16 --workers 8
+
+出力は入力に共通するフォルダからの相対パスのまま --output の下に PNG で保存する
+（photos/a/x.jpg -> out/a/x.png）。同じフォルダに拡張子だけが違う入力があれば x_jpg.png のように
+元の拡張子を付けて分ける。
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import cv2
+import numpy as np
+
+from Dither import DITHER_METHODS
+from Pixelize import RESAMPLE_METHODS, pixelize
+
+# 一度に投入しておく変換の数（ワーカー数に対する倍率）
+IN_FLIGHT_PER_WORKER = 4
+
+
+def read_rgb(path):
+    """画像を RGB 配列として読み込む（日本語パスにも対応）"""
+    data = np.fromfile(path, dtype=np.uint8)
+    bgr = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if bgr is None:
+        raise ValueError("画像を読み込めません")
+    return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+
+def write_rgb(path, rgb):
+    """RGB 配列を拡張子に合わせた形式で保存"""
+    ok, encoded = cv2.imencode(os.path.splitext(path)[1] or ".png", cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+    if not ok:
+        raise ValueError("画像を保存できません")
+    encoded.tofile(path)
+
+
+def crop(rgb, box):
+    """(x, y, w, h) の範囲を切り取る（画像からはみ出す部分は除く）"""
+    if box is None:
+        return rgb
+    x, y, w, h = box
+    height, width = rgb.shape[:2]
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(width, x + w), min(height, y + h)
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"切り取り範囲が画像の外です: {box}")
+    return rgb[y0:y1, x0:x1]
+
+
+def output_paths(paths, output_dir):
+    """ 入力ごとの出力先 {入力: 出力}（出力先が重なる場合は ValueError） """
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    stems = {path: os.path.splitext(os.path.relpath(os.path.abspath(path), root))[0] for path in paths}
+    counts = {}
+    for stem in stems.values():
+        counts[os.path.normcase(stem)] = counts.get(os.path.normcase(stem), 0) + 1
+    outputs, owners = {}, {}
+    for path, stem in stems.items():
+        if counts[os.path.normcase(stem)] > 1:  # 拡張子だけが違う入力は元の拡張子で分ける
+            stem += "_" + os.path.splitext(path)[1].lstrip(".").lower()
+        out_path = os.path.join(output_dir, stem + ".png")
+        key = os.path.normcase(os.path.abspath(out_path))
+        if key in owners:
+            raise ValueError(f"出力先が重なります: {owners[key]} と {path} -> {out_path}")
+        owners[key] = path
+        outputs[path] = out_path
+    return outputs
+
+
+def convert_one(path, out_path, grid_size, num_colors, box, method, dither="none"):
+    """ 1 枚を変換して out_path に保存（ワーカープロセスで実行） """
+    start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        rgb = crop(read_rgb(path), box)
+        write_rgb(out_path, pixelize(rgb, grid_size, num_colors, method, dither=dither))
+    except Exception as e:
+        return path, None, time.perf_counter() - start, str(e)
+    return path, out_path, time.perf_counter() - start, None
+
+
+def expand_inputs(patterns):
+    """glob パターンを展開（重複は除き、順番を保つ）"""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        paths.extend(matches if matches else ([pattern] if os.path.isfile(pattern) else []))
+    return list(dict.fromkeys(paths))
+
+
+def parse_box(text):
+    try:
+        values = tuple(int(v) for v in text.split(","))
+    except ValueError:
+        values = ()
+    if len(values) != 4 or values[2] <= 0 or values[3] <= 0:
+        raise argparse.ArgumentTypeError("切り取り範囲は x,y,w,h の形式で指定してください")
+    return values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="画像をまとめてドット絵に変換します")
+    parser.add_argument("inputs", nargs="+", help="入力画像（glob パターン可）")
+    parser.add_argument("-o", "--output", required=True, help="出力フォルダ")
+    parser.add_argument("--grid", type=int, default=16, help="グリッドサイズ（既定: 16）")
+    parser.add_argument("--colors", type=int, default=16, help="色数（既定: 16）")
+    parser.add_argument("--crop", type=parse_box, default=None, help="切り取り範囲 x,y,w,h")
+    parser.add_argument("--method", choices=RESAMPLE_METHODS, default="area", help="縮小方法")
+    parser.add_argument("--dither", choices=DITHER_METHODS, default="none", help="ディザリング")
+    parser.add_argument("--workers", type=int, default=None, help="プロセス数（既定: CPU 数）")
+    args = parser.parse_args(argv)
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        print("入力画像が見つかりません", file=sys.stderr)
+        return 1
+    try:
+        outputs = output_paths(paths, args.output)
+    except ValueError as e:
+        print(e, file=sys.stderr)  # 変換してから上書きで失うより、始める前に止める
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+
+    failed = done = 0
+    start = time.perf_counter()
+    workers = args.workers or os.cpu_count() or 1
+    pending = iter(paths)
+    # OpenCV 内部のスレッドとプロセスプールが競合しないよう、ワーカーは 1 スレッドにする
+    with ProcessPoolExecutor(max_workers=workers, initializer=cv2.setNumThreads, initargs=(1,)) as pool:
+        in_flight = set()
+
+        def submit_next():
+            # 大量のファイルでも一度に投入せず、少しずつ流し込む
+            for path in pending:
+                in_flight.add(pool.submit(convert_one, path, outputs[path], args.grid, args.colors, args.crop,
+                                          args.method, args.dither))
+                if len(in_flight) >= workers * IN_FLIGHT_PER_WORKER:
+                    return
+
+        submit_next()
+        while in_flight:
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            # 終わったものから順に結果を表示（保存はワーカー側で済んでいる）
+            for future in finished:
+                done += 1
+                path, out_path, seconds, error = future.result()
+                if error:
+                    failed += 1
+                    print(f"[{done}/{len(paths)}] 失敗 {path}: {error}", file=sys.stderr)
+                else:
+                    print(f"[{done}/{len(paths)}] {path} -> {out_path} ({seconds * 1000:.1f} ms)")
+            submit_next()
+
+    elapsed = time.perf_counter() - start
+    converted = len(paths) - failed
+    print(f"{converted} 枚変換, {failed} 枚失敗, {elapsed:.2f} 秒 "
+          f"({converted / elapsed if elapsed > 0 else 0:.1f} 枚/秒)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
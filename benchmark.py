@@ -0,0 +1,404 @@
+""" キャンバスの主要な処理のベンチマーク（画面なしの offscreen Qt で実行）
+
+例:
+    python benchmark.py -o result.json                 # 計測して JSON に保存
+    python benchmark.py --baseline result.json         # 保存した結果と比較（遅くなっていれば終了コード 1）
+    python benchmark.py --filter stroke --quick        # 一部だけ短く計測
+
+各ケースの結果は ops/sec・p50/p99 の所要時間（ミリ秒）・ピークメモリ（KB、tracemalloc）。
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import cv2
+import numpy as np
+import PySide6
+import PySide6.QtWidgets as QW
+import PySide6.QtGui as QG
+
+from PixelCanvas import PixelCanvas
+from Dither import DITHER_METHODS, dither
+from Autosave import Autosave
+
+PAINT_GRID_SIZES = (64, 256, 1024)
+PAINT_FILL_RATIOS = (0.0, 0.5, 1.0)
+BRUSH_MODES = ("normal", "checker", "symmetry", "eraser")
+# (大きさ, 形, 対称変換): 大きなブラシでも 1 セルのブラシと同じ程度の時間で描けることを確認する
+BRUSH_STAMPS = ((1, "square", "none"), (16, "circle", "none"), (64, "circle", "none"),
+                (64, "square", "quad"), (16, "circle", "radial"))
+FLUSH_CELLS = 8  # ドラッグ中に 1 回のまとめ描き（flush_stroke）で届くセル数の目安
+TRANSFORM_CASES = (("flip_h", None), ("rotate", 1), ("shift", (5, 3)))
+VIEW_SIZE = 800  # 描画を計測するウィジェットの大きさ（ピクセル）
+STROKE_CELLS = 256  # 1 ストロークで塗るセル数
+HISTORY_DEPTH = 500  # 履歴のケースで積んでおくストローク数
+DEFAULT_TOLERANCE = 0.25  # ベースラインより p50 がこの割合以上遅ければ失敗
+
+
+class Case:
+    """ 1 つの計測対象
+
+    setup(): 計測前に 1 回呼ばれ、1 回分の処理を行う関数を返す
+    """
+
+    def __init__(self, name, setup, iterations=50):
+        self.name = name
+        self.setup = setup
+        self.iterations = iterations
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) * 1000.0
+
+
+def run_case(case, quick=False):
+    """ケースを実行して結果の dict を返す"""
+    iterations = max(3, case.iterations // 5) if quick else case.iterations
+    step = case.setup()
+    step()  # 初回のみの準備（キャッシュ作成など）を計測から除く
+
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        step()
+        times.append(time.perf_counter() - start)
+
+    # tracemalloc は処理を遅くするので、メモリは別に数回だけ測る
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    for _ in range(min(iterations, 3)):
+        step()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "ops_per_sec": len(times) / sum(times),
+        "p50_ms": _percentile(times, 50),
+        "p99_ms": _percentile(times, 99),
+        "peak_kb": peak / 1024.0,
+    }
+
+
+def _filled_canvas(grid_size, fill_ratio, seed=0):
+    """fill_ratio の割合のセルをランダムな色で塗ったキャンバス"""
+    canvas = PixelCanvas(grid_size=grid_size)
+    canvas.resize(VIEW_SIZE, VIEW_SIZE)
+    canvas.update_canvas_size()
+    rng = np.random.default_rng(seed)
+    for layer in canvas.layers.values():
+        filled = rng.random((grid_size, grid_size)) < fill_ratio
+        layer[filled] = rng.integers(0, 256, (int(filled.sum()), 4), dtype=np.uint8)
+        layer[filled, 3] = 255
+    canvas._invalidate_composite()
+    return canvas
+
+
+def paint_case(grid_size, fill_ratio):
+    def setup():
+        canvas = _filled_canvas(grid_size, fill_ratio)
+        image = QG.QImage(canvas.size(), QG.QImage.Format_ARGB32_Premultiplied)
+
+        def step():
+            # レイヤーが全体的に変わった場合の再描画（再合成 + 転送 + グリッド）
+            canvas._invalidate_composite()
+            canvas.render(image)
+        return step
+    return Case(f"paint/grid{grid_size}/fill{int(fill_ratio * 100)}", setup, iterations=30)
+
+
+def stroke_case(mode, grid_size=256, autosave_directory=None):
+    def setup():
+        canvas = _filled_canvas(grid_size, 0.0)
+        if autosave_directory is not None:
+            # 自動保存を有効にしても 1 ストロークの時間が変わらないことを確認する
+            Autosave(canvas, autosave_directory).start()
+        if mode == "eraser":
+            canvas.set_color(None)
+        else:
+            canvas.brush_mode = mode
+        path = np.arange(STROKE_CELLS) % grid_size
+
+        def step():
+            # 1 ストローク分（マウスイベントごとに paint_at を呼んだ場合）
+            canvas.save_state()
+            for i in path:
+                canvas.paint_at(int(i), int(path[-1 - i % STROKE_CELLS]))
+            canvas.commit_state()
+        return step
+    suffix = "+autosave" if autosave_directory is not None else ""
+    return Case(f"stroke/{mode}{suffix}", setup, iterations=20)
+
+
+def brush_case(size, shape, symmetry, grid_size=256):
+    def setup():
+        canvas = _filled_canvas(grid_size, 0.0)
+        canvas.set_brush(size=size, shape=shape)
+        canvas.set_symmetry(symmetry)
+        path = np.arange(STROKE_CELLS) % grid_size
+
+        def step():
+            # ドラッグ中と同じく、数セルずつまとめて paint_cells で描く
+            canvas.save_state()
+            for start in range(0, STROKE_CELLS, FLUSH_CELLS):
+                xs = path[start:start + FLUSH_CELLS]
+                canvas.paint_cells(xs, path[-1 - xs % STROKE_CELLS])
+            canvas.commit_state()
+        return step
+    return Case(f"brush/{shape}{size}/{symmetry}", setup, iterations=20)
+
+
+def history_cases(grid_size=256):
+    def build():
+        canvas = _filled_canvas(grid_size, 0.5)
+        rng = np.random.default_rng(1)
+        for _ in range(HISTORY_DEPTH):
+            canvas.save_state()
+            canvas.paint_cells(rng.integers(0, grid_size, 64), rng.integers(0, grid_size, 64))
+            canvas.commit_state()
+        return canvas, rng
+
+    def record():
+        canvas, rng = build()
+
+        def step():
+            canvas.save_state()
+            canvas.paint_cells(rng.integers(0, grid_size, 64), rng.integers(0, grid_size, 64))
+            canvas.commit_state()
+        return step
+
+    def undo_redo():
+        canvas, _ = build()
+
+        def step():
+            # 積まれた履歴の半分を戻してやり直す
+            for _ in range(HISTORY_DEPTH // 2):
+                canvas.undo()
+            for _ in range(HISTORY_DEPTH // 2):
+                canvas.redo()
+        return step
+
+    return [Case("history/record", record, iterations=200),
+            Case(f"history/undo_redo_{HISTORY_DEPTH // 2}", undo_redo, iterations=10)]
+
+
+def synthetic_photo(width=1600, height=1200, seed=0):
+    """写真の代わりになる画像（なめらかなグラデーション + 円 + ノイズ）の RGB 配列"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    rgb = np.stack([xx / width, yy / height, 0.5 + 0.5 * np.sin((xx + yy) / 90.0)], axis=2) * 255
+    for _ in range(12):
+        cx, cy, r = rng.integers(0, width), rng.integers(0, height), rng.integers(40, 300)
+        inside = (xx - cx) ** 2 + (yy - cy) ** 2 < r * r
+        rgb[inside] = rng.integers(0, 256, 3)
+    rgb += rng.normal(0, 6, rgb.shape)
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+
+def import_case(grid_size=64, num_colors=16):
+    def setup():
+        canvas = _filled_canvas(grid_size, 0.0)
+        photo = synthetic_photo()
+        image = QG.QImage(photo.data, photo.shape[1], photo.shape[0], photo.strides[0],
+                          QG.QImage.Format_RGB888).copy()
+
+        def step():
+            canvas.apply_to_canvas(image, num_colors)
+        return step
+    return Case(f"import/grid{grid_size}/colors{num_colors}", setup, iterations=10)
+
+
+def export_case(directory, grid_size=256, scale=4):
+    def setup():
+        canvas = _filled_canvas(grid_size, 0.5)
+        path = os.path.join(directory, "export.png")
+
+        def step():
+            canvas.export_image(path, scale)
+        return step
+    return Case(f"export/grid{grid_size}/x{scale}", setup, iterations=10)
+
+
+def recolor_case(grid_size=1024):
+    def setup():
+        canvas = _filled_canvas(grid_size, 1.0)
+        canvas.set_indexed(True)
+        image = QG.QImage(canvas.size(), QG.QImage.Format_ARGB32_Premultiplied)
+        colors = [QG.QColor(255, 0, 0), QG.QColor(0, 0, 255)]
+        state = {"i": 0}
+
+        def step():
+            # インデックスカラーで色表の 1 色を変えて再描画
+            state["i"] += 1
+            canvas.set_palette_color(1, colors[state["i"] % 2])
+            canvas.render(image)
+        return step
+    return Case(f"palette/recolor/grid{grid_size}", setup, iterations=20)
+
+
+def playback_case(grid_size=256, num_frames=24):
+    def setup():
+        canvas = _filled_canvas(grid_size, 0.5)
+        rng = np.random.default_rng(2)
+        for _ in range(num_frames - 1):
+            canvas.duplicate_frame()
+            canvas.paint_cells(rng.integers(0, grid_size, 16), rng.integers(0, grid_size, 16))
+        canvas.play()
+        canvas._playback_timer.stop()  # タイマーを使わず 1 フレームずつ進める
+        image = QG.QImage(canvas.size(), QG.QImage.Format_ARGB32_Premultiplied)
+
+        def step():
+            # 再生中の 1 フレーム分（合成済みのフレーム画像を転送）
+            canvas._advance_playback()
+            canvas.render(image)
+        return step
+    return Case(f"animation/playback/grid{grid_size}", setup, iterations=50)
+
+
+def frame_switch_case(grid_size=1024, num_frames=24):
+    def setup():
+        canvas = _filled_canvas(grid_size, 0.5)
+        rng = np.random.default_rng(4)
+        for _ in range(num_frames - 1):
+            canvas.duplicate_frame()
+            canvas.paint_cells(rng.integers(0, grid_size, 16), rng.integers(0, grid_size, 16))
+
+        def step():
+            # 次のフレームに切り替えて 1 セル描く（前のフレームは差分に、表示するフレームは配列に戻る）
+            canvas.set_frame((canvas.current_frame + 1) % num_frames)
+            canvas.paint_cells(rng.integers(0, grid_size, 1), rng.integers(0, grid_size, 1))
+            canvas.commit_state()
+        return step
+    return Case(f"animation/switch/grid{grid_size}", setup, iterations=24)
+
+
+def selection_move_case(grid_size=512):
+    def setup():
+        canvas = _filled_canvas(grid_size, 1.0)
+        canvas.fit_to_window()
+        canvas.select_all()
+        canvas.lift_selection()
+        image = QG.QImage(canvas.size(), QG.QImage.Format_ARGB32_Premultiplied)
+        moves = itertools.cycle((1, -1))
+
+        def step():
+            # 浮いている選択範囲をドラッグで 1 セル動かして再描画（レイヤーは書き換えない）
+            canvas.move_selection(next(moves), 0)
+            canvas.render(image)
+        return step
+    return Case(f"selection/move/grid{grid_size}", setup, iterations=50)
+
+
+def transform_case(op, amount=None, grid_size=1024):
+    def setup():
+        canvas = _filled_canvas(grid_size, 0.5)
+
+        def step():
+            # レイヤー全体の変形（履歴には変形の種類だけが積まれる）
+            canvas.transform_layer(op, amount)
+        return step
+    return Case(f"transform/{op}/grid{grid_size}", setup, iterations=20)
+
+
+def dither_case(method, grid_size=512, num_colors=16):
+    def setup():
+        cells = cv2.resize(synthetic_photo(), (grid_size, grid_size), interpolation=cv2.INTER_AREA)
+        palette = np.random.default_rng(3).integers(0, 256, (num_colors, 3), dtype=np.uint8)
+
+        def step():
+            dither(cells, palette, method)
+        return step
+    return Case(f"dither/{method}/grid{grid_size}", setup, iterations=10)
+
+
+def all_cases(directory):
+    cases = [paint_case(size, ratio) for size in PAINT_GRID_SIZES for ratio in PAINT_FILL_RATIOS]
+    cases += [stroke_case(mode) for mode in BRUSH_MODES]
+    cases.append(stroke_case("normal", autosave_directory=os.path.join(directory, "autosave")))
+    cases += [brush_case(*stamp) for stamp in BRUSH_STAMPS]
+    cases += history_cases()
+    cases.append(recolor_case())
+    cases.append(playback_case())
+    cases.append(frame_switch_case())
+    cases.append(selection_move_case())
+    cases += [transform_case(op, amount) for op, amount in TRANSFORM_CASES]
+    cases.append(import_case())
+    cases += [dither_case(method) for method in DITHER_METHODS]
+    cases.append(export_case(directory))
+    return cases
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pyside6": PySide6.__version__,
+        "qt_platform": os.environ.get("QT_QPA_PLATFORM"),
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ ベースラインより p50 が tolerance 以上遅くなったケースを返す
+
+    戻り値: [(名前, ベースラインの p50, 今回の p50), ...]
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["p50_ms"] > base["p50_ms"] * (1.0 + tolerance):
+            regressions.append((name, base["p50_ms"], result["p50_ms"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="キャンバスのベンチマーク")
+    parser.add_argument("-o", "--output", help="結果を書き出す JSON ファイル")
+    parser.add_argument("--baseline", help="比較するベースラインの JSON ファイル")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="許容する p50 の悪化の割合（既定 0.25 = 25%%）")
+    parser.add_argument("--filter", default="", help="名前にこの文字列を含むケースだけ実行")
+    parser.add_argument("--quick", action="store_true", help="繰り返し回数を減らして短時間で実行")
+    args = parser.parse_args(argv)
+
+    app = QW.QApplication.instance() or QW.QApplication([])  # noqa: F841（ウィジェットの作成に必要）
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for case in all_cases(directory):
+            if args.filter not in case.name:
+                continue
+            results[case.name] = result = run_case(case, args.quick)
+            print(f"{case.name:32s} {result['ops_per_sec']:10.1f} ops/s  "
+                  f"p50 {result['p50_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+                  f"peak {result['peak_kb']:10.0f} KB", file=sys.stderr)
+
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after in regressions:
+            print(f"遅くなりました: {name} p50 {before:.2f} ms -> {after:.2f} ms", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,23 @@
+import logging
+import os
+
 import PySide6.QtWidgets as QW
 from DotEditor import DotEditor
+import Autosave
 
 if __name__ == "__main__":
+    # ログの詳しさは環境変数で指定（例: DOT_EDITOR_LOG=DEBUG で各処理の所要時間を出力）
+    logging.basicConfig(level=os.environ.get("DOT_EDITOR_LOG", "WARNING").upper(),
+                        format="%(asctime)s %(name)s %(levelname)s: %(message)s")
     app = QW.QApplication([])
     window = DotEditor()
     window.show()
+
+    # 前回クラッシュした場合は自動保存が残っているので、復元するか確認する
+    recover = False
+    if Autosave.find_recovery() is not None:
+        answer = QW.QMessageBox.question(
+            window, "自動保存から復元", "前回終了時に保存されていない作業があります。復元しますか？")
+        recover = answer == QW.QMessageBox.Yes
+    window.start_autosave(recover)
     app.exec()
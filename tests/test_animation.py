@@ -0,0 +1,62 @@
+""" フレームのコピーオンライト（差分で持つフレーム）・合成済み画像の解放・レイヤー削除のアンドゥ """
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def canvas(qapp):
+    from PixelCanvas import PixelCanvas
+    return PixelCanvas()
+
+
+def test_delete_layer_undo_restores_each_frame(canvas):
+    name = canvas.current_layer
+    canvas.paint_cells([1], [1])
+    canvas.commit_state()
+    canvas.duplicate_frame()
+    canvas.paint_cells([5], [5])
+    canvas.commit_state()
+    expected = [np.array(np.asarray(frame.layers[name])) for frame in canvas.frames]
+
+    canvas.delete_layer(name)
+    canvas.set_frame(0)  # 削除したときとは別のフレームでアンドゥ
+    canvas.undo()
+    for frame, layer in zip(canvas.frames, expected):
+        assert np.array_equal(np.asarray(frame.layers[name]), layer)
+
+
+def test_frames_with_small_changes_share_memory(canvas):
+    from Animation import unique_nbytes
+    canvas.resize_canvas(256)
+    rng = np.random.default_rng(0)
+    contents = []
+    for _ in range(200):
+        canvas.paint_cells(rng.integers(0, 256, 4), rng.integers(0, 256, 4))
+        canvas.commit_state()
+        contents.append({name: np.array(layer) for name, layer in canvas.layers.items()})
+        canvas.duplicate_frame()
+    canvas.delete_frame()
+
+    frame_bytes = sum(layer.nbytes for layer in canvas.layers.values())
+    assert unique_nbytes(canvas.frames) < 4 * frame_bytes  # 200 フレームでも数フレーム分
+    for index in (0, 57, 199):
+        canvas.set_frame(index)
+        for name, layer in contents[index].items():
+            assert np.array_equal(canvas.layers[name], layer)
+
+
+def test_playback_images_are_released(canvas, monkeypatch):
+    import PixelCanvas
+    canvas.resize_canvas(64)
+    for _ in range(20):
+        canvas.add_frame()
+    monkeypatch.setattr(PixelCanvas, "PLAYBACK_IMAGE_BUDGET", 5 * 64 * 64 * 4)  # 5 フレーム分
+    canvas.play()
+    for _ in range(50):
+        canvas._advance_playback()
+        canvas.frame_image(canvas._playback_frame)
+        assert sum(frame._image is not None for frame in canvas.frames) <= 6  # 予算分と表示中の 1 枚
+    canvas.stop()
+    canvas.set_onion_skin(1)
+    kept = [index for index, frame in enumerate(canvas.frames) if frame._image is not None]
+    assert all(abs(index - canvas.current_frame) <= 1 for index in kept)
@@ -0,0 +1,37 @@
+""" インデックスカラーの色表と履歴 """
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def canvas(qapp):
+    from PixelCanvas import PixelCanvas
+    canvas = PixelCanvas()
+    canvas.set_indexed(True)
+    return canvas
+
+
+def test_undo_removes_colors_added_by_painting(canvas):
+    from PySide6.QtGui import QColor
+    name = canvas.current_layer
+    count = canvas.palette_count
+    before = np.array(canvas.layers[name])
+
+    canvas.set_color(QColor(10, 20, 30))
+    canvas.save_state()
+    canvas.paint_cells([1, 2], [1, 1])
+    canvas.commit_state()
+    canvas.flood_fill(8, 8, QColor(40, 50, 60))
+    painted = np.array(canvas.layers[name])
+    assert canvas.palette_count == count + 2
+
+    canvas.undo()
+    assert canvas.palette_count == count + 1
+    canvas.undo()
+    assert canvas.palette_count == count
+    assert np.array_equal(canvas.layers[name], before)
+
+    canvas.redo()
+    canvas.redo()
+    assert canvas.palette_count == count + 2
+    assert np.array_equal(canvas.layers[name], painted)
@@ -0,0 +1,87 @@
+""" 読み込み元のファイルへの上書き保存（メモリマップしている配列を壊さないこと） """
+import os
+
+import numpy as np
+import pytest
+
+RED = [255, 0, 0, 255]
+BLUE = [0, 0, 255, 255]
+
+
+@pytest.fixture
+def canvas(qapp):
+    from PixelCanvas import PixelCanvas
+    return PixelCanvas()
+
+
+def _fill(canvas, name, color, frame=None):
+    canvas._writable_layer(name, frame)[...] = color
+    canvas._touch_layer(name, frame)
+
+
+def _colors(canvas, name):
+    return [frame.layers[name][0, 0].tolist() for frame in canvas.frames]
+
+
+def test_move_frame_then_save(canvas, tmp_path):
+    from PixelCanvas import PixelCanvas
+    path = os.fspath(tmp_path / "frames.dotp")
+    name = canvas.current_layer
+    _fill(canvas, name, RED)
+    canvas.add_frame()
+    _fill(canvas, name, BLUE)
+    canvas.save_project(path)
+
+    loaded = PixelCanvas()
+    loaded.load_project(path)
+    assert isinstance(loaded.frames[0].layers[name], np.memmap)
+    loaded.move_frame(1, 0)
+    loaded.save_project(path)
+    assert _colors(loaded, name) == [BLUE, RED]
+
+    reloaded = PixelCanvas()
+    reloaded.load_project(path)
+    assert _colors(reloaded, name) == [BLUE, RED]
+
+    loaded.undo()  # 履歴が持っている並び替える前のフレームも壊れていない
+    assert _colors(loaded, name) == [RED, BLUE]
+
+
+def test_swap_layer_names_then_save(canvas, tmp_path):
+    from PixelCanvas import PixelCanvas
+    path = os.fspath(tmp_path / "layers.dotp")
+    _fill(canvas, "background", RED)
+    _fill(canvas, "foreground", BLUE)
+    canvas.save_project(path)
+
+    loaded = PixelCanvas()
+    loaded.load_project(path)
+    loaded.rename_layer("background", "tmp")
+    loaded.rename_layer("foreground", "background")
+    loaded.rename_layer("tmp", "foreground")
+    loaded.save_project(path)
+    assert loaded.layers["background"][0, 0].tolist() == BLUE
+    assert loaded.layers["foreground"][0, 0].tolist() == RED
+
+    reloaded = PixelCanvas()
+    reloaded.load_project(path)
+    assert reloaded.layers["background"][0, 0].tolist() == BLUE
+    assert reloaded.layers["foreground"][0, 0].tolist() == RED
+
+
+def test_unchanged_layout_saves_in_place(canvas, tmp_path, monkeypatch):
+    import ProjectFile
+    from PixelCanvas import PixelCanvas
+    path = os.fspath(tmp_path / "in_place.dotp")
+    canvas.save_project(path)
+
+    loaded = PixelCanvas()
+    loaded.load_project(path)
+    _fill(loaded, "foreground", RED)
+    monkeypatch.setattr(ProjectFile, "_write_full", lambda *args: pytest.fail("rewrote the whole file"))
+    loaded.save_project(path)
+    assert isinstance(loaded.layers["background"], np.memmap)
+
+    reloaded = PixelCanvas()
+    reloaded.load_project(path)
+    assert reloaded.layers["foreground"][0, 0].tolist() == RED